@@ -0,0 +1,630 @@
+# Namesdao-cli benchmarks
+#
+# Benchmarks for namesdao.py. Results are printed as json (and written to --output, if given), so runs can be
+# compared with each other.
+#
+# Nothing touches the network or a real wallet: name lookups go to two local stub mirrors (with configurable latency and
+# error rate), and sends go to a fake `chia` executable or an in-memory wallet backend.
+#
+#  Usage:
+'''
+        $ python3 bench.py
+        $ python3 bench.py crypto
+        $ python3 bench.py crypto -n 500 --output crypto.json
+        $ python3 bench.py resolve batch --latency 50 --error-rate 0.05 --output before.json
+        $ python3 bench.py startup --processes 50
+        $ python3 bench.py queue --jobs 1000000
+'''
+from optparse import OptionParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import hashlib
+import json
+import os
+import random
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import namesdao
+
+NAMESDAO_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'namesdao.py')
+
+
+def _timed(fn, n):
+    '''Call fn() n times and return the per-call timings, in seconds.'''
+    timings = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _summary(timings):
+    timings = sorted(timings)
+    count = len(timings)
+    return {
+        'count': count,
+        'mean_ms': 1000 * sum(timings) / count,
+        'p50_ms': 1000 * timings[count // 2],
+        'p95_ms': 1000 * timings[min(count - 1, int(count * 0.95))],
+        'p99_ms': 1000 * timings[min(count - 1, int(count * 0.99))],
+        'ops_per_s': count / sum(timings) if sum(timings) else None,
+    }
+
+
+class StubMirror:
+    '''A local lookup mirror serving fixture files, with configurable latency and error rate.
+
+    fixtures maps paths (`name.json`, `name.json.gpg`) to their contents; any
+    other path is a 404. Each request waits latency seconds (+/- 50%), and
+    fails with a 503 with probability error_rate. Files are served with an
+    ETag, and a matching If-None-Match is answered with 304 Not Modified.
+    '''
+
+    def __init__(self, fixtures, latency=0.0, error_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        rng = random.Random(seed)
+        lock = threading.Lock()
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                with lock:
+                    mirror.requests += 1
+                    delay = mirror.latency * rng.uniform(0.5, 1.5)
+                    fail = rng.random() < mirror.error_rate
+                if delay:
+                    time.sleep(delay)
+                body = mirror.fixtures.get(unquote(self.path.lstrip('/')))
+                code = 503 if fail else 404 if body is None else 200
+                etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"' if code == 200 else None
+                if etag is not None and self.headers.get('If-None-Match') == etag:
+                    code = 304
+                body = body if code == 200 else b''
+                self.send_response(code)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _make_fixtures(names, sign=None):
+    '''Name records for names, all resolving to the Namesdao address; signed if sign is given.'''
+    fixtures = {}
+    for name in names:
+        message = json.dumps({'address': namesdao.RECIPIENT_ADDRESS}).encode('utf-8')
+        fixtures[f'{name}.json'] = message
+        if sign is not None:
+            fixtures[f'{name}.json.gpg'] = sign(message)
+    return fixtures
+
+
+def _make_fake_chia(bin_dir, latency=0.0):
+    '''Write a fake `chia` executable to bin_dir that accepts sends (after latency seconds) without output.'''
+    path = os.path.join(bin_dir, 'chia')
+    with open(path, 'w') as f:
+        f.write(
+            '#!/bin/sh\n'
+            f'sleep {latency}\n'
+            'case "$1 $2" in\n'
+            f'  "wallet show") printf \'  -Asset ID: {namesdao.NAME_ASSET_ID}\\n   -Wallet ID: 2\\n\' ;;\n'
+            '  "rpc wallet") echo \'{"success": true, "transaction_id": "0x00"}\' ;;\n'
+            'esac\n'
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+class _NullWalletBackend:
+    '''In-memory wallet backend that accepts every transaction, to time namesdao's own share of a send.'''
+
+    name = 'null'
+
+    def get_fingerprint(self):
+        return 1
+
+    def send(self, safe_address, safe_amount, safe_fee, safe_memo, wallet_id=None):
+        return '0x' + bytes(32).hex()
+
+    def get_name_wallet_id(self):
+        return '2'
+
+    def is_name_wallet(self, wallet_id):
+        return True
+
+
+class _StubBlockFeed:
+    '''Stand-in for namesdao.WalletBlockFeed: a new block on every wait, confirming per_block of the transactions.'''
+
+    def __init__(self, transaction_ids, per_block):
+        self.height = 0
+        self.confirm_at = {transaction_id: 1 + i // per_block for i, transaction_id in enumerate(transaction_ids)}
+        self.reads = 0
+        self.lookups = 0
+
+    def get_height(self):
+        return self.height
+
+    def wait_for_block(self, height):
+        self.height = height + 1
+        return self.height
+
+    def _record(self, transaction_id):
+        confirmed = self.confirm_at[transaction_id] <= self.height
+        return {
+            'name': transaction_id,
+            'confirmed': confirmed,
+            'confirmed_at_height': self.confirm_at[transaction_id] if confirmed else 0,
+            'sent_to': [['peer', namesdao.MEMPOOL_SUCCESS, None]],
+        }
+
+    def transactions(self, wallet_id, count):
+        # Like the wallet's RELEVANCE order: unconfirmed first, then the latest confirmed.
+        self.reads += 1
+        records = sorted(map(self._record, self.confirm_at), key=lambda record: (record['confirmed'], -record['confirmed_at_height']))
+        return records[:count]
+
+    def transaction(self, transaction_id):
+        self.lookups += 1
+        return self._record(transaction_id)
+
+
+def _reset_namesdao():
+    '''Drop namesdao's process-wide caches, pools and mirror state, as in a new process.'''
+    if namesdao._connection_pool is not None:
+        namesdao._connection_pool.close()
+    if namesdao._resolve_cache is not None:
+        namesdao._resolve_cache.close()
+    namesdao._connection_pool = None
+    namesdao._resolve_cache = None
+    namesdao._mirror_health = None
+    namesdao._reverse_index = None
+    namesdao._wallet_backends.clear()
+    namesdao._signature_verifier = None
+    namesdao._revalidation_counts.update(dict.fromkeys(namesdao._revalidation_counts, 0))
+    for name in os.listdir(namesdao.DATA_DIR):
+        path = os.path.join(namesdao.DATA_DIR, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+class _Mirrors:
+    '''Start two stub mirrors (primary and secondary) serving signed fixtures when possible, and point namesdao at them.
+
+    Only this process trusts the throwaway signing key, so benchmarks that run
+    namesdao.py in a subprocess pass signed=False to get unsigned fixtures.
+    '''
+
+    def __init__(self, options, names, signed=True):
+        sign = None
+        self._gnupg = tempfile.TemporaryDirectory()
+        if signed:
+            try:
+                sign = _make_signing_key(os.path.join(self._gnupg.name, 'signer'))
+            except (OSError, subprocess.CalledProcessError):
+                pass
+        self.signed = sign is not None
+        fixtures = _make_fixtures(names, sign)
+        self.mirrors = [
+            StubMirror(fixtures, options.latency / 1000, options.error_rate, seed=options.seed + i)
+            for i in range(2)
+        ]
+        self._saved = namesdao.MIRRORS
+        namesdao.MIRRORS = [mirror.url for mirror in self.mirrors]
+        _reset_namesdao()
+
+    def config(self, options):
+        return {
+            'latency_ms': options.latency,
+            'error_rate': options.error_rate,
+            'signed': self.signed,
+        }
+
+    def requests(self):
+        return sum(mirror.requests for mirror in self.mirrors)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for mirror in self.mirrors:
+            mirror.close()
+        namesdao.MIRRORS = self._saved
+        self._gnupg.cleanup()
+
+
+def _make_signing_key(home_dir):
+    '''Create a throwaway RSA 4096 signing key (like the Namesdao key) with the gpg binary and point namesdao at it.
+
+    Returns a function that makes a detached signature of some bytes.
+    '''
+    os.makedirs(home_dir, mode=0o700, exist_ok=True)
+    gpg_cmd = ['gpg', '--batch', '--quiet', '--homedir', home_dir]
+    subprocess.run(
+        gpg_cmd + ['--passphrase', '', '--quick-gen-key', 'namesdao bench <bench@namesdao.invalid>', 'rsa4096', 'sign,encr', 'never'],
+        check=True,
+        capture_output=True,
+    )
+    colons = subprocess.run(gpg_cmd + ['--with-colons', '--list-keys'], check=True, capture_output=True, text=True).stdout
+    fingerprint = next(line.split(':')[9] for line in colons.splitlines() if line.startswith('fpr:'))
+    pubkey = subprocess.run(gpg_cmd + ['--armor', '--export', fingerprint], check=True, capture_output=True).stdout
+
+    namesdao.RECIPIENT_FINGERPRINT = fingerprint
+    namesdao.RECIPIENT_PUBKEY = pubkey
+    namesdao._signature_verifier = None
+
+    def sign(message):
+        return subprocess.run(gpg_cmd + ['--detach-sign', '-o', '-'], input=message, check=True, capture_output=True).stdout
+
+    return sign
+
+
+def _legacy_verify(message, signature):
+    '''verify() as it was before CryptoSession: a new context and key lookup per call.'''
+    import io
+    import gpg
+
+    c = gpg.Context()
+    try:
+        key = c.get_key(namesdao.RECIPIENT_FINGERPRINT)
+    except gpg.errors.KeyNotFound:
+        c.key_import(namesdao.RECIPIENT_PUBKEY)
+        key = c.get_key(namesdao.RECIPIENT_FINGERPRINT)
+    try:
+        c.verify(io.BytesIO(message), signature=io.BytesIO(signature), verify=[key])
+    except (gpg.errors.BadSignatures, gpg.errors.MissingSignatures):
+        return False
+    return True
+
+
+def bench_crypto(options):
+    '''Per-operation cost of signature verification and encryption: the in-process SignatureVerifier namesdao.py
+    uses, vs. gpg with a fresh context per call and with the shared CryptoSession (if the gpg bindings are installed).'''
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            sign = _make_signing_key(os.path.join(tmp, 'signer'))
+        except (OSError, subprocess.CalledProcessError):
+            return {'skipped': 'the gpg binary is not installed'}
+        message = json.dumps({'address': namesdao.RECIPIENT_ADDRESS}).encode('utf-8')
+        signature = sign(message)
+        verifier = namesdao.get_signature_verifier()
+
+        assert verifier.verify(message, signature)
+        pairs = [(message, signature)] * options.number
+        started = time.perf_counter()
+        namesdao.verify_many(pairs)
+        results = {
+            'verify_python': _summary(_timed(lambda: verifier.verify(message, signature), options.number)),
+            'verify_many_ops_per_s': options.number / (time.perf_counter() - started),
+        }
+
+        try:
+            import gpg  # noqa: F401
+        except ImportError:
+            results['gpg'] = {'skipped': 'the gpg python bindings are not installed'}
+            return results
+        os.environ['GNUPGHOME'] = os.path.join(tmp, 'legacy')
+        os.makedirs(os.environ['GNUPGHOME'], mode=0o700)
+        session = namesdao.CryptoSession(home_dir=os.path.join(tmp, 'session'))
+        assert _legacy_verify(message, signature) and session.verify(message, signature)
+        results.update({
+            'verify_legacy': _summary(_timed(lambda: _legacy_verify(message, signature), options.number)),
+            'verify_session': _summary(_timed(lambda: session.verify(message, signature), options.number)),
+            'encrypt_session': _summary(_timed(lambda: session.encrypt(b'name.xch:' + message), options.number)),
+        })
+        return results
+
+
+def bench_resolve(options):
+    '''Single lookup latency: downloading from the mirrors every time, answering from the warm cache, and
+    revalidating expired cache entries (304 Not Modified).'''
+    names = [f'bench{i}' for i in range(options.number)]
+    with _Mirrors(options, names) as mirrors:
+        results = {'config': mirrors.config(options)}
+        iterator = iter(names)
+        results['uncached'] = _summary(_timed(lambda: namesdao.lookup(next(iterator), use_cache=False), options.number))
+        for name in names:
+            namesdao.lookup(name)
+        iterator = iter(names)
+        results['cached'] = _summary(_timed(lambda: namesdao.lookup(next(iterator)), options.number))
+        iterator = iter(names)
+        results['revalidated'] = _summary(_timed(lambda: namesdao.lookup(next(iterator), cache_ttl=0), options.number))
+        results['revalidation'] = namesdao.revalidation_stats()
+        namesdao.get_resolve_cache(namesdao.CACHE_TTL)
+        iterator = iter(f'missing{i}' for i in range(options.number))
+        results['not_found_uncached'] = _summary(_timed(lambda: namesdao.lookup(next(iterator), use_cache=False), options.number))
+        results['mirror_requests'] = mirrors.requests()
+        return results
+
+
+def bench_batch(options):
+    '''Batch resolution throughput (names/s) with resolve_many(), cold and warm; 10% of the names aren't registered.'''
+    names = [f'bench{i}' for i in range(options.names)]
+    batch = [name if i % 10 else f'missing{i}' for i, name in enumerate(names)]
+    with _Mirrors(options, names) as mirrors:
+        results = {'config': {**mirrors.config(options), 'names': len(batch), 'concurrency': options.concurrency}}
+        for run in ('cold', 'warm'):
+            started = time.perf_counter()
+            statuses = {}
+            for result in namesdao.resolve_many(batch, concurrency=options.concurrency, use_daemon=False):
+                statuses[result.status] = statuses.get(result.status, 0) + 1
+            elapsed = time.perf_counter() - started
+            results[run] = {'seconds': elapsed, 'names_per_s': len(batch) / elapsed, 'statuses': statuses}
+        results['mirror_requests'] = mirrors.requests()
+        return results
+
+
+def _run_checked(command, env, expected):
+    '''Run a command, and raise unless it exits with 0 and prints expected, so a failing run is never timed as a result.'''
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    if proc.returncode != 0 or expected not in proc.stdout:
+        raise RuntimeError(
+            f'{" ".join(command)} exited with {proc.returncode} without printing {expected!r}:\n{proc.stdout}{proc.stderr}'
+        )
+
+
+def bench_cli(options):
+    '''End-to-end `namesdao.py wallet resolve` process time: cold (empty data dir) vs. warm (cached record).'''
+    with _Mirrors(options, ['bench0'], signed=False) as mirrors, tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, NAMESDAO_MIRRORS=','.join(namesdao.MIRRORS), NAMESDAO_DATA_DIR=os.path.join(tmp, 'warm'))
+        os.makedirs(env['NAMESDAO_DATA_DIR'])
+        command = [sys.executable, NAMESDAO_PY, 'wallet', 'resolve', 'bench0']
+
+        def run(data_dir=None):
+            run_env = env if data_dir is None else dict(env, NAMESDAO_DATA_DIR=data_dir)
+            _run_checked(command, run_env, namesdao.RECIPIENT_ADDRESS)
+
+        def cold():
+            data_dir = tempfile.mkdtemp(dir=tmp)
+            run(data_dir)
+
+        run()
+        cold_timings = _timed(cold, options.processes)
+        requests = mirrors.requests()
+        warm_timings = _timed(run, options.processes)
+        return {
+            'config': mirrors.config(options),
+            'cold': _summary(cold_timings),
+            'warm': _summary(warm_timings),
+            'warm_mirror_requests': mirrors.requests() - requests,
+        }
+
+
+def bench_startup(options):
+    '''Start-up cost of the CLI: help, and `wallet resolve` of a cached name, run as a script and with -m.
+
+    Run as a script, namesdao.py is compiled on every start; with -m (or when
+    imported) its cached bytecode is used.
+    '''
+    with _Mirrors(options, ['bench0'], signed=False) as mirrors, tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, NAMESDAO_MIRRORS=','.join(namesdao.MIRRORS), NAMESDAO_DATA_DIR=data_dir)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(NAMESDAO_PY), env.get('PYTHONPATH')]))
+        # Measure with bytecode caching, as most installs have it.
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        def timed_command(*args, expected=''):
+            command = [sys.executable, *args]
+            _run_checked(command, env, expected)
+            return _summary(_timed(lambda: _run_checked(command, env, expected), options.processes))
+
+        modules = subprocess.run(
+            [sys.executable, '-c', 'import sys; before = set(sys.modules); import namesdao; print(len(set(sys.modules) - before))'],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout.strip()
+        return {
+            'config': mirrors.config(options),
+            'modules_imported': int(modules),
+            'python': timed_command('-c', 'pass'),
+            'help_script': timed_command(NAMESDAO_PY, expected='Sample usage'),
+            'help_module': timed_command('-m', 'namesdao', expected='Sample usage'),
+            'resolve_warm_script': timed_command(NAMESDAO_PY, 'wallet', 'resolve', 'bench0', expected=namesdao.RECIPIENT_ADDRESS),
+            'resolve_warm_module': timed_command('-m', 'namesdao', 'wallet', 'resolve', 'bench0', expected=namesdao.RECIPIENT_ADDRESS),
+        }
+
+
+def bench_send(options):
+    '''Send path: namesdao's own overhead (in-memory wallet) vs. a send through a fake `chia` executable.'''
+    with _Mirrors(options, ['bench0']) as mirrors, tempfile.TemporaryDirectory() as bin_dir:
+        _make_fake_chia(bin_dir)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        namesdao.lookup('bench0')
+        null_backend = _NullWalletBackend()
+        cli_backend = namesdao.CliWalletBackend()
+
+        def send(backend):
+            address = namesdao.lookup('bench0').address
+            return namesdao.send_payment(address, '0.000001', memo='bench', backend=backend)
+
+        return {
+            'config': mirrors.config(options),
+            'send_null_backend': _summary(_timed(lambda: send(null_backend), options.number)),
+            'send_fake_chia': _summary(_timed(lambda: send(cli_backend), min(options.number, options.processes * 5))),
+        }
+
+
+def bench_queue(options):
+    '''Job queue: enqueueing a large batch, and claiming/finishing jobs in a small vs. a large queue.'''
+    queue = namesdao.JobQueue(os.path.join(namesdao.DATA_DIR, 'bench-jobs.sqlite3'))
+    payload = {
+        'name': 'bench0.xch',
+        'target': namesdao.RECIPIENT_ADDRESS,
+        'address': namesdao.RECIPIENT_ADDRESS,
+        'amount': '0.000000000001',
+        'asset': 'XCH',
+        'fee': '0.000000000001',
+        'memo': 'bench0.xch:' + namesdao.RECIPIENT_ADDRESS,
+    }
+
+    def claim_and_finish(batch):
+        job = queue.claim(batch)
+        queue.finish(job.id, '0x' + bytes(32).hex())
+
+    try:
+        small = queue.create_batch('register', [payload] * options.number)
+        small_queue = _summary(_timed(lambda: claim_and_finish(small), options.number))
+
+        start = time.perf_counter()
+        large = queue.create_batch('register', (payload for _ in range(options.jobs)))
+        enqueue_s = time.perf_counter() - start
+        # A batch queued behind the large one, as after a big run was interrupted.
+        behind = queue.create_batch('register', [payload] * options.number)
+
+        drained = queue.create_batch('register', [payload] * options.number)
+        start = time.perf_counter()
+        for _ in namesdao.run_jobs(queue, drained, _NullWalletBackend(), concurrency=options.concurrency):
+            pass
+        run_jobs_s = time.perf_counter() - start
+
+        return {
+            'jobs': options.jobs,
+            'enqueue_jobs_per_s': round(options.jobs / enqueue_s),
+            'claim_finish_small_queue': small_queue,
+            'claim_finish_large_batch': _summary(_timed(lambda: claim_and_finish(large), options.number)),
+            'claim_finish_behind_large_batch': _summary(_timed(lambda: claim_and_finish(behind), options.number)),
+            'run_jobs_null_backend_per_s': round(options.number / run_jobs_s),
+            'status_counts_ms': _summary(_timed(lambda: queue.counts(large), 5))['mean_ms'],
+        }
+    finally:
+        queue.close()
+
+
+def bench_track(options):
+    '''Transaction tracking: --jobs in-flight transactions confirming over 10 blocks, against a stub block feed.'''
+    transaction_ids = ['0x%064x' % i for i in range(options.jobs)]
+    feed = _StubBlockFeed(transaction_ids, max(1, options.jobs // 10))
+    transactions = [namesdao.TrackedTransaction(transaction_id, '1', None) for transaction_id in transaction_ids]
+    start = time.perf_counter()
+    events = sum(1 for _ in namesdao.track_transactions(transactions, feed))
+    elapsed = time.perf_counter() - start
+    return {
+        'transactions': options.jobs,
+        'blocks': feed.height,
+        'events': events,
+        'wallet_reads': feed.reads,
+        'single_lookups': feed.lookups,
+        'events_per_s': round(events / elapsed),
+    }
+
+
+BENCHMARKS = {
+    'crypto': bench_crypto,
+    'resolve': bench_resolve,
+    'batch': bench_batch,
+    'cli': bench_cli,
+    'startup': bench_startup,
+    'send': bench_send,
+    'queue': bench_queue,
+    'track': bench_track,
+}
+
+
+def main():
+    parser = OptionParser(usage=f'%prog [options] [{"|".join(BENCHMARKS)}] ...')
+    parser.add_option(
+        '-n', '--number',
+        type='int',
+        default=200,
+        help='Number of operations per measurement (default 200)',
+    )
+    parser.add_option(
+        '-o', '--output',
+        help='Also write the results to this json file',
+    )
+    parser.add_option(
+        '--latency',
+        type='float',
+        default=20,
+        help='Stub mirror latency per request, in milliseconds (default 20)',
+    )
+    parser.add_option(
+        '--error-rate',
+        type='float',
+        default=0.0,
+        help='Fraction of stub mirror requests that fail with a 503 (default 0)',
+    )
+    parser.add_option(
+        '--names',
+        type='int',
+        default=1000,
+        help='Number of names in the batch benchmark (default 1000)',
+    )
+    parser.add_option(
+        '--jobs',
+        type='int',
+        default=100000,
+        help='Number of jobs in the large batch of the queue benchmark, and of transactions in the track benchmark (default 100000)',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=namesdao.RESOLVE_CONCURRENCY,
+        help=f'Batch resolution (and queue benchmark) concurrency (default {namesdao.RESOLVE_CONCURRENCY})',
+    )
+    parser.add_option(
+        '--processes',
+        type='int',
+        default=10,
+        help='Number of namesdao.py processes to time in the cli and startup benchmarks (default 10)',
+    )
+    parser.add_option(
+        '--seed',
+        type='int',
+        default=0,
+        help='Seed for the stub mirrors\' latency and errors (default 0)',
+    )
+    options, args = parser.parse_args()
+    names = args or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'Unknown benchmark(s): {", ".join(unknown)}')
+
+    # Keep the benchmarks away from the user's cache and keyring.
+    with tempfile.TemporaryDirectory() as data_dir:
+        namesdao.DATA_DIR = data_dir
+        results = {
+            'python': sys.version.split()[0],
+            'timestamp': time.time(),
+            'number': options.number,
+            'results': {},
+        }
+        for name in names:
+            results['results'][name] = BENCHMARKS[name](options)
+            _reset_namesdao()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
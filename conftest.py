@@ -0,0 +1,61 @@
+# Namesdao-cli tests
+#
+# Shared pytest fixtures. Nothing touches the network or a real wallet; mirrors and wallets are local stubs.
+#
+#  Usage:
+'''
+        $ python3 -m pytest -q
+'''
+import pytest
+
+import namesdao
+
+
+@pytest.fixture(autouse=True)
+def namesdao_state(tmp_path, monkeypatch):
+    '''Give every test its own data dir and fresh process-wide caches, pools and mirror state.'''
+    monkeypatch.setattr(namesdao, 'DATA_DIR', str(tmp_path / 'data'))
+    for name in ('_resolve_cache', '_name_index', '_reverse_index', '_connection_pool', '_mirror_health', '_signature_verifier', '_job_queue', '_onchain_index'):
+        monkeypatch.setattr(namesdao, name, None)
+    # False means "not looked up yet"; None means no daemon is running.
+    monkeypatch.setattr(namesdao, '_daemon_client', None)
+    yield
+    for name in ('_resolve_cache', '_connection_pool', '_job_queue'):
+        opened = getattr(namesdao, name)
+        if opened is not None:
+            opened.close()
+
+
+@pytest.fixture(scope='session')
+def make_signing_key(tmp_path_factory):
+    '''Return a function that makes a throwaway gpg signing key: (pubkey, fingerprint, sign). Skips without gpg.'''
+    import shutil
+    import subprocess
+
+    if shutil.which('gpg') is None:
+        pytest.skip('the gpg binary is not installed')
+
+    def make_key(algorithm='rsa2048', expire='never'):
+        home_dir = str(tmp_path_factory.mktemp('gnupg'))
+        gpg_cmd = ['gpg', '--batch', '--quiet', '--homedir', home_dir]
+        subprocess.run(
+            gpg_cmd + ['--passphrase', '', '--quick-gen-key', 'namesdao test <test@namesdao.invalid>', algorithm, 'sign', expire],
+            check=True,
+            capture_output=True,
+        )
+        colons = subprocess.run(gpg_cmd + ['--with-colons', '--list-keys'], check=True, capture_output=True, text=True).stdout
+        fingerprint = next(line.split(':')[9] for line in colons.splitlines() if line.startswith('fpr:'))
+        pubkey = subprocess.run(gpg_cmd + ['--armor', '--export', fingerprint], check=True, capture_output=True).stdout
+
+        def sign(message, *options):
+            return subprocess.run(gpg_cmd + list(options) + ['--detach-sign', '-o', '-'], input=message, check=True, capture_output=True).stdout
+
+        return pubkey, fingerprint, sign
+
+    return make_key
+
+
+@pytest.fixture(scope='session')
+def signing_key(make_signing_key):
+    '''An RSA signing key like the Namesdao one: (pubkey, fingerprint, sign).'''
+    return make_signing_key()
@@ -9,7 +9,6 @@
 #
 # TODOs:
 #  check with primary record (on chia blockchain) to confirm before sending
-#  add pytest unit tests
 #
 # contact @theNamesdao or @BenAtreidesVing on Twitter if you'd like bounty commissions to upgrade this code, thank you!
 #
@@ -26,9 +25,22 @@
         $ python3 namesdao.py name register _nameToRegister.xch _MyExistingName.xch --cloak -a 0.018
         $ python3 namesdao.py name register ___nameToRegister.xch xchaddresstoregister --cloak -a 0.000000000001 -m 0.0000000001
         $ python3 namesdao.py name register ___nameToRegister.xch xchaddresstoregister -a 0.000000000001 -m 0.0000000001
+        $ python3 namesdao.py name register-batch names.csv --cloak -m 0.0000000001
+        $ python3 namesdao.py name sync --from-file names.txt
+        $ python3 namesdao.py name index --follow
+        $ python3 namesdao.py name check --from-file candidates.txt --available-only
+        $ python3 namesdao.py wallet resolve $name --verify-onchain
+        $ python3 namesdao.py wallet reverse $xchaddress
+        $ python3 namesdao.py wallet reverse --from-file addresses.txt
+        $ python3 namesdao.py wallet warm --from-file contacts.txt --interval 300
+        $ python3 namesdao.py serve
         $ python3 namesdao.py wallet send $address -a $amount -m $fee
         $ python3 namesdao.py wallet send hellobilly.xch -a 0.000000000001 -m 0.000000000002
         $ python3 namesdao.py wallet resolve $address
+        $ python3 namesdao.py wallet send-batch payouts.csv -m $fee
+        $ python3 namesdao.py wallet resolve $name1 $name2 ...
+        $ python3 namesdao.py wallet resolve --from-file names.txt --concurrency 32
+        $ cat names.txt | python3 namesdao.py wallet resolve -
 
         Options:
           First argument is the address to send the XCH  [required]
@@ -38,24 +50,30 @@
           -m, --fee TEXT                  Set the fees for the transaction, in XCH (optional, default value 1 mojo)
           -M, --Fee TEXT                  Set the fees for the transaction, in mojos [takes precedence over --fee]
           -y, --yes                       Execute without asking for confirmation
+          --no-cache                      Do not use the local resolution cache
+          --refresh                       Download the name record again, even if it is cached
+          --cache-ttl SECONDS             Seconds a cached name record stays valid
+          --not-found-ttl SECONDS         Seconds an unregistered name stays cached as not found
+          --stale-while-revalidate SECONDS  Answer from an expired cached record and revalidate it in the background
+          --hedge-delay SECONDS           Seconds to wait for a mirror before also asking the next one
+          --verify-onchain                Resolve from the on-chain index built by `name index`
+          --backend auto|rpc|cli          How to talk to the wallet (default auto: the wallet RPC if it's running)
+          --fingerprint FINGERPRINT       Fingerprint of the wallet key to use (default: the active key)
+          --trace[=FILE]                  Write timing spans as json lines to stderr (or FILE)
           -h, --help                      Show this message and exit.
 '''
 #
 # processing starts at main() at the bottom
 #
-from optparse import OptionParser
+# Only what every command needs is imported here; the rest is imported where it's used, to keep start-up fast.
 import sys
 import json
-import re
-import shlex
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError, URLError
-from urllib.parse import quote
-import subprocess
 import time
-import hashlib
 import os
-import base64
+import struct
+import threading
+from collections import deque, namedtuple
+from itertools import chain
 
 RECIPIENT_ADDRESS = 'xch1jhye8dmkhree0zr8t09rlzm9cc82mhuqtp5tlmsj4kuqvs69s2wsl90su4'
 RECIPIENT_FINGERPRINT = '2A06D252B6B804C837E2BA2D2B3A61F48A54276C'
@@ -197,64 +215,720 @@ evFFqsVLe8jB1LlsYrQJ
 
 INCLUDE_SALT = True
 
+# Local data (resolution cache etc.) is kept under the user's data dir.
+DATA_DIR = os.environ.get('NAMESDAO_DATA_DIR') or os.path.join(
+    os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'),
+    'namesdao',
+)
+CACHE_FILENAME = 'cache.sqlite3'
+GPG_HOME_DIRNAME = 'gnupg'  # dedicated keyring holding only the Namesdao key
+NAME_INDEX_FILENAME = 'names.idx'  # offline name index, see NameIndex
+CACHE_TTL = 3600  # seconds before a cached name record is downloaded again
+NOT_FOUND_TTL = 300  # seconds a name the mirrors don't know stays cached as not found
+CACHE_MAX_ENTRIES = 10000  # least recently used records are evicted past this
+# Seconds past its TTL that `serve` (or --stale-while-revalidate) still answers
+# from an expired cached record while it's revalidated in the background
+STALE_WHILE_REVALIDATE = 86400
+REVALIDATE_CONCURRENCY = 4  # background revalidations run at once
 
-def encrypt(message):
-    '''Encrypt a message using gpg'''
+RESOLVE_CONCURRENCY = 16  # default number of parallel lookups for batch resolves
+CHECK_CONCURRENCY = 32  # default number of parallel lookups for `name check`
+CHECK_RATE_LIMIT = 100  # default mirror lookups per second for `name check`
+WARM_CONCURRENCY = 8  # default number of parallel refreshes for `wallet warm`
+WARM_RATE_LIMIT = 20  # default mirror lookups per second for `wallet warm`
+WARM_REFRESH_AHEAD = 60  # `wallet warm --interval` refreshes records this many seconds before the next pass would be too late
 
-    import io
-    import gpg
+# Mirror downloads reuse keep-alive connections, see ConnectionPool
+HTTP_POOL_SIZE = 16  # idle connections kept open per host
+HTTP_IDLE_TIMEOUT = 30  # seconds an idle connection is kept before it's closed
+HTTP_TIMEOUT = 10  # seconds to wait for a mirror to connect or respond
+HEDGE_DELAY = 0.3  # seconds to wait for a mirror before racing the request against the next one
 
-    ptext = io.BytesIO(message)
-    c = gpg.Context()
-    c.armor = True
+# Mirrors serving the secondary cache, as base URLs for `{mirror}/{name}.json`.
+# NAMESDAO_MIRRORS may hold a comma separated list to use other (e.g. local) mirrors.
+MIRRORS = [
+    mirror.strip().rstrip('/')
+    for mirror in os.environ.get(
+        'NAMESDAO_MIRRORS',
+        'https://namesdaolookup.xchstorage.com,https://storage1.xchstorage.cyou/names_lookup',
+    ).split(',')
+    if mirror.strip()
+]
+MIRROR_STATE_FILENAME = 'mirrors.json'
+MIRROR_EWMA_ALPHA = 0.3  # weight of the newest sample in the latency and error averages
+CIRCUIT_FAILURE_THRESHOLD = 3  # consecutive failures that open a mirror's circuit
+CIRCUIT_COOLDOWN = 60  # seconds an open circuit waits before letting a probe through
+RESOLVE_RETRIES = 3  # rounds of attempts across all mirrors before giving up
+RETRY_BACKOFF = 0.5  # base of the jittered exponential backoff between rounds, in seconds
+RETRY_BACKOFF_MAX = 8
 
-    try:
-        recipient = c.get_key(RECIPIENT_FINGERPRINT)
-    except gpg.errors.KeyNotFound:
-        c.key_import(RECIPIENT_PUBKEY)
-        recipient = c.get_key(RECIPIENT_FINGERPRINT)
+# Status of a name lookup, see lookup()
+RESOLVE_VERIFIED = 'verified'
+RESOLVE_UNSIGNED = 'unsigned'
+RESOLVE_NOT_FOUND = 'not_found'
+NOT_FOUND_DETAIL = 'We don\'t currently have this address registered in our cache.'
+RESOLVE_BAD_SIGNATURE = 'bad_signature'
+RESOLVE_ERROR = 'error'
+RESOLVE_ONCHAIN = 'onchain'  # answered from the on-chain index
 
-    ctext = c.encrypt(
-        recipients=[recipient],
-        plaintext=ptext,
-        always_trust=True,
-        sign=False,
-    )[0]
+ResolveResult = namedtuple('ResolveResult', ['name', 'address', 'status', 'detail'])
+# A validated payment, see prepare_send(); amount and fee are in XCH (amount in NAME with use_name_tokens)
+SendRequest = namedtuple('SendRequest', ['address', 'amount', 'fee', 'memo', 'use_name_tokens'])
+SendResult = namedtuple('SendResult', ['address', 'amount', 'fee', 'memo', 'use_name_tokens', 'transaction_id'])
 
-    return ctext.decode('utf-8')
 
+class NamesdaoError(Exception):
+    '''Base class of the errors raised by the library API (async_resolve(), send_payment(), ...).'''
 
-def verify(message, signature):
-    '''Verify a signature using gpg'''
 
-    import io
-    import gpg
+class ResolveError(NamesdaoError):
+    '''A name couldn't be resolved; result is the ResolveResult saying why.'''
 
-    c = gpg.Context()
+    def __init__(self, result):
+        super().__init__(result.detail or f'{result.name}.xch could not be resolved ({result.status})')
+        self.result = result
 
-    try:
-        key = c.get_key(RECIPIENT_FINGERPRINT)
-    except gpg.errors.KeyNotFound:
-        c.key_import(RECIPIENT_PUBKEY)
-        key = c.get_key(RECIPIENT_FINGERPRINT)
 
-    message_buffer = io.BytesIO(message)
-    signature_buffer = io.BytesIO(signature)
+class NameNotFoundError(ResolveError):
+    '''The name isn't registered.'''
 
-    try:
-        c.verify(
-            message_buffer,
-            signature=signature_buffer,
-            verify=[key],
-        )
-    except (gpg.errors.BadSignatures, gpg.errors.MissingSignatures):
-        return False
 
-    return True
+class SendError(NamesdaoError):
+    '''A payment was invalid, or the wallet didn't take it.'''
+
+
+# Resolver daemon, see cmd_serve()
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8477
+DAEMON_STATE_FILENAME = 'serve.json'  # where a running daemon says how to reach it, and its token
+DAEMON_TOKEN_BYTES = 32  # random bytes in the token clients must present
+DAEMON_CACHE_SIZE = 100000  # names kept in the daemon's in-memory cache
+DAEMON_BATCH_SIZE = 500  # names per batch request to the daemon
+DAEMON_TIMEOUT = 60
+
+# On-chain index of Namesdao name records, see OnchainIndexer
+FULL_NODE_RPC_PORT = 8555
+ONCHAIN_INDEX_FILENAME = 'onchain.sqlite3'
+ONCHAIN_CONFIRMATIONS = 6  # blocks a block must be buried under before it's indexed
+ONCHAIN_REORG_DEPTH = 32  # blocks re-indexed when the checkpoint block was reorged out
+# Addresses whose spends create Namesdao name records (a CREATE_COIN to the owner, with a `<name>.xch` memo)
+NAMESDAO_REGISTRARS = [
+    'xch1jhye8dmkhree0zr8t09rlzm9cc82mhuqtp5tlmsj4kuqvs69s2wsl90su4',
+]
+
+MOJOS_PER_XCH = 10**12
+MOJOS_PER_CAT = 1000
+NAME_ASSET_ID = '4c4380af7d15c896d9e6266f322ac494c398803032eef56f2ab65877956d007f'
+
+# Wallet operations go through the wallet daemon's RPC when it's reachable, or the chia CLI.
+# NAMESDAO_WALLET_BACKEND (or --backend) may be 'auto', 'rpc' or 'cli'.
+WALLET_BACKEND = os.environ.get('NAMESDAO_WALLET_BACKEND', 'auto')
+CHIA_ROOT = os.path.expanduser(os.environ.get('CHIA_ROOT', '~/.chia/mainnet'))
+WALLET_RPC_HOST = 'localhost'
+WALLET_RPC_PORT = 9256
+WALLET_RPC_TIMEOUT = 30
+WALLET_TYPE_CAT = 6
+NAME_WALLET_CACHE_FILENAME = 'name_wallets.json'  # wallet fingerprint -> NAME CAT wallet id
+BATCH_CHUNK_SIZE = 100  # outputs per transaction for wallet send-batch
+REGISTER_BATCH_CONCURRENCY = 4  # registrations sent in parallel by name register-batch
+JOBS_FILENAME = 'jobs.sqlite3'  # durable queue of batch sends and registrations, see JobQueue
+
+# State of a queued send or registration, see JobQueue
+JOB_PENDING = 'pending'
+JOB_SUBMITTING = 'submitting'  # being handed to the wallet; if a run dies now, it's unknown whether it went out
+JOB_SUBMITTED = 'submitted'
+JOB_CONFIRMED = 'confirmed'
+JOB_FAILED = 'failed'
+JOB_INTERRUPTED = 'Interrupted while being submitted; check the wallet, and `queue retry` it if it was not sent'
+
+# `wallet track` checks the wallet's height every TRACK_POLL_INTERVAL seconds, and reads its transactions once per new block
+TRACK_POLL_INTERVAL = 5
+TRACK_EXPIRE_BLOCKS = 600  # a transaction that isn't confirmed after this many blocks (about 3 hours) has expired
+TRACK_SWEEP_SIZE = 50  # transactions read per wallet and block, on top of twice the number being tracked
+MEMPOOL_SUCCESS = 1  # MempoolInclusionStatus of a transaction a peer took into its mempool
+MEMPOOL_PENDING = 2
+
+# Instrumentation, see trace_span(); both are off unless enabled
+TRACE = os.environ.get('NAMESDAO_TRACE')  # like --trace: '-' or '1' for stderr, else a file to append spans to
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # histogram buckets, in seconds
+
+
+class Tracer:
+    '''Write timed spans as json lines, e.g. to stderr for --trace.
+
+    Each span has the trace id of the process, its own id, the id of the
+    enclosing span in the same thread, the phase, start time, duration and
+    attributes.
+    '''
+
+    def __init__(self, out):
+        self._out = out
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.trace_id = os.urandom(8).hex()
+
+    def write(self, span):
+        line = json.dumps(span, default=str)
+        with self._lock:
+            self._out.write(line + '\n')
+            self._out.flush()
+
+    def stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+class Metrics:
+    '''Counters and histograms for long-running modes, rendered in the Prometheus text format.'''
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def render(self):
+        def labels_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in labels) + '}'
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (key_name, labels), value in sorted(self._counters.items()):
+                    if key_name == name:
+                        lines.append(f'{name}{labels_text(labels)} {value}')
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (key_name, labels), (counts, count, total) in sorted(self._histograms.items()):
+                    if key_name != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f'{name}_bucket{labels_text(labels, [("le", bound)])} {bucket_count}')
+                    lines.append(f'{name}_bucket{labels_text(labels, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{labels_text(labels)} {total}')
+                    lines.append(f'{name}_count{labels_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Span:
+    def __init__(self, phase, attrs):
+        self.phase = phase
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if _tracer is not None:
+            stack = _tracer.stack()
+            self.parent = stack[-1] if stack else None
+            self.id = os.urandom(4).hex()
+            stack.append(self.id)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        if _metrics is not None:
+            _metrics.observe('namesdao_phase_seconds', duration, phase=self.phase)
+        if _tracer is not None:
+            _tracer.stack().pop()
+            span = {
+                'trace': _tracer.trace_id,
+                'span': self.id,
+                'parent': self.parent,
+                'phase': self.phase,
+                'start': self.start,
+                'duration_ms': round(duration * 1000, 3),
+                **self.attrs,
+            }
+            if exc_type is not None:
+                span['error'] = exc_type.__name__
+            _tracer.write(span)
+
+
+class _NoSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+_tracer = None
+_metrics = None
+
+
+def trace_span(phase, **attrs):
+    '''Return a context manager timing one phase (dns, tls, download, verify, ...).
+
+    The span is written by the tracer (see enable_tracing()) and its duration
+    recorded in the namesdao_phase_seconds histogram (see enable_metrics()).
+    When neither is enabled this returns a shared no-op object.
+    '''
+    if _tracer is None and _metrics is None:
+        return _NO_SPAN
+    return _Span(phase, attrs)
+
+
+def count(name, value=1, **labels):
+    '''Add value to a counter, if metrics are enabled.'''
+    if _metrics is not None:
+        _metrics.inc(name, value, **labels)
+
+
+def enable_tracing(path='-'):
+    '''Write spans to stderr ('-') or append them to the file at path (closed at exit).'''
+    import atexit
+
+    global _tracer
+    if path in ('-', '1', ''):
+        out = sys.stderr
+    else:
+        out = open(path, 'a', buffering=1)
+        atexit.register(out.close)
+    _tracer = Tracer(out)
+    return _tracer
+
+
+def enable_metrics():
+    '''Start collecting metrics; returns the Metrics object (see Metrics.render()).'''
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+class CryptoSession:
+    '''Long-lived gpg contexts with the Namesdao key loaded once.
+
+    The key is imported into a dedicated keyring (by default `gnupg` in the data
+    dir), so the user's own keyring is neither read nor modified, and the key
+    lookup happens once per process instead of once per operation. gpgme
+    contexts aren't thread-safe, so each thread gets its own context on the
+    same keyring.
+    '''
+
+    def __init__(self, home_dir=None):
+        import gpg
+
+        if home_dir is None:
+            home_dir = os.path.join(get_data_dir(), GPG_HOME_DIRNAME)
+        os.makedirs(home_dir, mode=0o700, exist_ok=True)
+        self.home_dir = home_dir
+        self._gpg = gpg
+        self._local = threading.local()
+
+        c = self._context()
+        try:
+            c.get_key(RECIPIENT_FINGERPRINT)
+        except gpg.errors.KeyNotFound:
+            c.key_import(RECIPIENT_PUBKEY)
+
+    def _context(self):
+        c = getattr(self._local, 'context', None)
+        if c is None:
+            c = self._gpg.Context(armor=True, home_dir=self.home_dir)
+            self._local.context = c
+            self._local.key = None
+        return c
+
+    def _key(self):
+        c = self._context()
+        if self._local.key is None:
+            self._local.key = c.get_key(RECIPIENT_FINGERPRINT)
+        return self._local.key
+
+    def encrypt(self, message):
+        '''Encrypt a message (bytes) to the Namesdao key and return the armored text.'''
+        import io
+
+        with trace_span('encrypt', bytes=len(message)):
+            ctext = self._context().encrypt(
+                recipients=[self._key()],
+                plaintext=io.BytesIO(message),
+                always_trust=True,
+                sign=False,
+            )[0]
+        return ctext.decode('utf-8')
+
+    def verify(self, message, signature):
+        '''Return True if signature is a valid detached signature of message by the Namesdao key.'''
+        import io
+
+        with trace_span('verify', bytes=len(message), engine='gpg') as span:
+            try:
+                self._context().verify(
+                    io.BytesIO(message),
+                    signature=io.BytesIO(signature),
+                    verify=[self._key()],
+                )
+            except (self._gpg.errors.BadSignatures, self._gpg.errors.MissingSignatures):
+                span.set(valid=False)
+                count('namesdao_verify_total', result='bad')
+                return False
+        count('namesdao_verify_total', result='good')
+        return True
+
+    def encrypt_many(self, messages):
+        '''Encrypt each message, returning a list of armored texts.'''
+        return [self.encrypt(message) for message in messages]
+
+    def verify_many(self, pairs):
+        '''Verify (message, signature) pairs, returning a list of booleans.'''
+        return [self.verify(message, signature) for message, signature in pairs]
+
+
+_crypto_session = None
+_crypto_session_lock = threading.Lock()
+
+
+def get_crypto_session():
+    '''Return the process-wide CryptoSession.'''
+    global _crypto_session
+    with _crypto_session_lock:
+        if _crypto_session is None:
+            _crypto_session = CryptoSession()
+    return _crypto_session
+
+
+class UnsupportedSignature(NamesdaoError):
+    '''The in-process verifier can't check this signature (or key); gpg has to.'''
+
+
+# A parsed signature packet; hashed is the part the digest covers, issuers the key ids it names
+_PgpSignature = namedtuple('_PgpSignature', ['sig_type', 'pubkey_algorithm', 'hash_algorithm', 'hashed', 'subpackets', 'issuers', 'left16', 's'])
+
+
+class SignatureVerifier:
+    '''In-process checker of detached OpenPGP signatures by the Namesdao key.
+
+    The armored key block is parsed once, keeping the RSA parameters of the
+    primary key whose fingerprint is RECIPIENT_FINGERPRINT, so checking a
+    signature is a hash and a modular exponentiation, with no gpg process,
+    agent or keyring. Only what Namesdao signatures use is implemented:
+    version 4 RSA signatures over binary or text documents, with SHA-2
+    digests. For anything else (or a key with an expiry, a revocation or a
+    signature by one of its subkeys) verify() raises UnsupportedSignature, so
+    the caller can fall back to gpg, which knows the whole standard.
+    '''
+
+    # OpenPGP hash algorithm id -> (hashlib name, DER prefix of the PKCS #1 v1.5 DigestInfo)
+    HASHES = {
+        8: ('sha256', bytes.fromhex('3031300d060960864801650304020105000420')),
+        9: ('sha384', bytes.fromhex('3041300d060960864801650304020205000430')),
+        10: ('sha512', bytes.fromhex('3051300d060960864801650304020305000440')),
+        11: ('sha224', bytes.fromhex('302d300d06096086480165030402040500041c')),
+    }
+    RSA_ALGORITHMS = (1, 3)  # RSA (encrypt or sign), RSA sign-only
+    # Signature subpackets understood well enough to be marked critical:
+    # creation time, expiration time, issuer key id, issuer fingerprint
+    KNOWN_SUBPACKETS = (2, 3, 16, 33)
+    TAG_SIGNATURE, TAG_PUBLIC_KEY, TAG_PUBLIC_SUBKEY = 2, 6, 14
+
+    def __init__(self, pubkey=None, fingerprint=None):
+        import hashlib
+
+        pubkey = RECIPIENT_PUBKEY if pubkey is None else pubkey
+        fingerprint = (RECIPIENT_FINGERPRINT if fingerprint is None else fingerprint).upper()
+        self.key_id = None
+        self.subkey_ids = set()
+        ours = in_primary = False
+        for tag, body in self._packets(self._dearmor(pubkey)):
+            if tag == self.TAG_PUBLIC_KEY:
+                key_fingerprint = hashlib.sha1(b'\x99' + len(body).to_bytes(2, 'big') + body).digest()
+                ours = in_primary = key_fingerprint.hex().upper() == fingerprint
+                if ours:
+                    self.key_id = key_fingerprint[-8:]
+                    self.n, self.e = self._rsa_public_key(body)
+            elif tag == self.TAG_PUBLIC_SUBKEY:
+                in_primary = False
+                if ours:
+                    self.subkey_ids.add(hashlib.sha1(b'\x99' + len(body).to_bytes(2, 'big') + body).digest()[-8:])
+            elif tag == self.TAG_SIGNATURE and in_primary and len(body) > 6:
+                # The key's own signatures (on its user ids) can revoke it or make it expire.
+                hashed_end = 6 + int.from_bytes(body[4:6], 'big')
+                subpackets = self._subpackets(body[6:hashed_end], hashed=False) if body[0] == 4 else {}
+                if body[1] == 0x20 or 9 in subpackets:
+                    raise UnsupportedSignature('The key has a revocation or an expiry')
+        if self.key_id is None:
+            raise UnsupportedSignature(f'No RSA key with fingerprint {fingerprint} in the key block')
+        self._size = (self.n.bit_length() + 7) // 8
+
+    @staticmethod
+    def _dearmor(data):
+        '''Return the binary packets of ASCII armored data; binary data is returned as is.'''
+        import base64
+
+        stripped = data.lstrip()
+        if not stripped.startswith(b'-----BEGIN PGP '):
+            return data
+        lines = stripped.decode('ascii').splitlines()
+        try:
+            body_start = lines.index('', 1) + 1
+            end = next(i for i, line in enumerate(lines) if line.startswith('-----END PGP '))
+        except (ValueError, StopIteration):
+            raise UnsupportedSignature('Malformed ASCII armor') from None
+        body = [line.strip() for line in lines[body_start:end] if line.strip()]
+        checksum = body.pop()[1:] if body and body[-1].startswith('=') else None
+        try:
+            packets = base64.b64decode(''.join(body), validate=True)
+        except ValueError:
+            raise UnsupportedSignature('Malformed ASCII armor') from None
+        if checksum is not None and base64.b64decode(checksum) != SignatureVerifier._crc24(packets):
+            raise UnsupportedSignature('ASCII armor checksum mismatch')
+        return packets
+
+    _crc24_table = None
+
+    @classmethod
+    def _crc24(cls, data):
+        '''The CRC-24 checksum of ASCII armor.'''
+        if cls._crc24_table is None:
+            table = []
+            for byte in range(256):
+                crc = byte << 16
+                for _ in range(8):
+                    crc <<= 1
+                    if crc & 0x1000000:
+                        crc ^= 0x1864CFB
+                table.append(crc & 0xFFFFFF)
+            cls._crc24_table = table
+        table = cls._crc24_table
+        crc = 0xB704CE
+        for byte in data:
+            crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ byte]
+        return crc.to_bytes(3, 'big')
+
+    @staticmethod
+    def _packets(data):
+        '''Yield (tag, body) for each OpenPGP packet in data.'''
+        offset = 0
+        try:
+            while offset < len(data):
+                ctb = data[offset]
+                if not ctb & 0x80:
+                    raise UnsupportedSignature('Not an OpenPGP packet')
+                if ctb & 0x40:
+                    # New format: the body may come in partial chunks.
+                    tag = ctb & 0x3F
+                    offset += 1
+                    body = b''
+                    while True:
+                        first = data[offset]
+                        if first < 192:
+                            length, offset = first, offset + 1
+                        elif first < 224:
+                            length, offset = ((first - 192) << 8) + data[offset + 1] + 192, offset + 2
+                        elif first == 255:
+                            length, offset = int.from_bytes(data[offset + 1:offset + 5], 'big'), offset + 5
+                        else:
+                            partial = 1 << (first & 0x1F)
+                            body += data[offset + 1:offset + 1 + partial]
+                            offset += 1 + partial
+                            continue
+                        body += data[offset:offset + length]
+                        offset += length
+                        break
+                else:
+                    tag = (ctb >> 2) & 0x0F
+                    length_type = ctb & 3
+                    if length_type == 3:
+                        length, offset = len(data) - offset - 1, offset + 1
+                    else:
+                        size = 1 << length_type
+                        length, offset = int.from_bytes(data[offset + 1:offset + 1 + size], 'big'), offset + 1 + size
+                    body = data[offset:offset + length]
+                    offset += length
+                if offset > len(data):
+                    raise UnsupportedSignature('Truncated OpenPGP packet')
+                yield tag, body
+        except IndexError:
+            raise UnsupportedSignature('Truncated OpenPGP packet') from None
+
+    @staticmethod
+    def _mpi(data, offset):
+        '''Return (value, offset after it) of the multiprecision integer at offset.'''
+        size = (int.from_bytes(data[offset:offset + 2], 'big') + 7) // 8
+        if offset + 2 + size > len(data):
+            raise UnsupportedSignature('Truncated OpenPGP packet')
+        return int.from_bytes(data[offset + 2:offset + 2 + size], 'big'), offset + 2 + size
+
+    def _rsa_public_key(self, body):
+        if len(body) < 6 or body[0] != 4 or body[5] not in self.RSA_ALGORITHMS:
+            raise UnsupportedSignature('Only version 4 RSA keys are supported')
+        n, offset = self._mpi(body, 6)
+        e, _ = self._mpi(body, offset)
+        return n, e
+
+    def _parse_signature(self, body):
+        '''Split a version 4 signature packet into a _PgpSignature.'''
+        if len(body) < 6 or body[0] != 4:
+            raise UnsupportedSignature('Only version 4 signatures are supported')
+        sig_type, pubkey_algorithm, hash_algorithm = body[1], body[2], body[3]
+        hashed_end = 6 + int.from_bytes(body[4:6], 'big')
+        unhashed_end = hashed_end + 2 + int.from_bytes(body[hashed_end:hashed_end + 2], 'big')
+        if unhashed_end + 2 > len(body):
+            raise UnsupportedSignature('Truncated signature packet')
+        subpackets = self._subpackets(body[6:hashed_end], hashed=True)
+        issuers = set()
+        for area in (subpackets, self._subpackets(body[hashed_end + 2:unhashed_end], hashed=False)):
+            if 16 in area:
+                issuers.add(area[16])
+            if 33 in area and len(area[33]) == 21 and area[33][0] == 4:
+                issuers.add(area[33][-8:])
+        left16 = body[unhashed_end:unhashed_end + 2]
+        s, _ = self._mpi(body, unhashed_end + 2) if pubkey_algorithm in self.RSA_ALGORITHMS else (None, None)
+        return _PgpSignature(sig_type, pubkey_algorithm, hash_algorithm, body[:hashed_end], subpackets, issuers, left16, s)
+
+    def _subpackets(self, data, hashed):
+        '''Return {type: body} for a signature subpacket area; an unknown critical hashed subpacket is unsupported.'''
+        subpackets = {}
+        offset = 0
+        while offset < len(data):
+            first = data[offset]
+            if first < 192:
+                length, offset = first, offset + 1
+            elif first < 255:
+                length, offset = ((first - 192) << 8) + data[offset + 1] + 192, offset + 2
+            else:
+                length, offset = int.from_bytes(data[offset + 1:offset + 5], 'big'), offset + 5
+            if length == 0 or offset + length > len(data):
+                raise UnsupportedSignature('Malformed signature subpacket')
+            kind = data[offset] & 0x7F
+            if hashed and data[offset] & 0x80 and kind not in self.KNOWN_SUBPACKETS:
+                raise UnsupportedSignature(f'Critical signature subpacket {kind} is not supported')
+            subpackets[kind] = data[offset + 1:offset + length]
+            offset += length
+        return subpackets
+
+    def verify(self, message, signature):
+        '''Return True if signature is a valid detached signature of message by the Namesdao key.
+
+        Raises UnsupportedSignature if it can't tell; see the class docstring.
+        '''
+        import hashlib
+
+        with trace_span('verify', bytes=len(message), engine='python') as span:
+            packets = [body for tag, body in self._packets(self._dearmor(signature)) if tag == self.TAG_SIGNATURE]
+            if not packets:
+                raise UnsupportedSignature('No signature packet')
+            valid = True
+            for body in packets:
+                sig = self._parse_signature(body)
+                if sig.sig_type not in (0x00, 0x01) or sig.pubkey_algorithm not in self.RSA_ALGORITHMS or sig.hash_algorithm not in self.HASHES:
+                    raise UnsupportedSignature(f'Unsupported signature (type {sig.sig_type}, algorithms {sig.pubkey_algorithm}/{sig.hash_algorithm})')
+                if self.key_id not in sig.issuers:
+                    if not sig.issuers or sig.issuers & self.subkey_ids:
+                        raise UnsupportedSignature('The signature was not made by the primary key')
+                    valid = False
+                    continue
+                if 3 in sig.subpackets and 2 in sig.subpackets:
+                    expires = int.from_bytes(sig.subpackets[3], 'big')
+                    if expires and int.from_bytes(sig.subpackets[2], 'big') + expires < time.time():
+                        valid = False
+                        continue
+
+                hash_name, digest_info = self.HASHES[sig.hash_algorithm]
+                h = hashlib.new(hash_name)
+                if sig.sig_type == 0x01:
+                    # Text documents are signed with canonical CRLF line endings.
+                    h.update(message.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n'))
+                else:
+                    h.update(message)
+                h.update(sig.hashed)
+                h.update(b'\x04\xff' + len(sig.hashed).to_bytes(4, 'big'))
+                digest = h.digest()
+                if digest[:2] != sig.left16 or sig.s >= self.n:
+                    valid = False
+                    continue
+                encoded = digest_info + digest
+                expected = b'\x00\x01' + b'\xff' * (self._size - len(encoded) - 3) + b'\x00' + encoded
+                if pow(sig.s, self.e, self.n).to_bytes(self._size, 'big') != expected:
+                    valid = False
+            span.set(valid=valid)
+        count('namesdao_verify_total', result='good' if valid else 'bad')
+        return valid
+
+
+_signature_verifier = None
+_signature_verifier_lock = threading.Lock()
+
+
+def get_signature_verifier():
+    '''Return the process-wide SignatureVerifier, or None if the key needs gpg.'''
+    global _signature_verifier
+    with _signature_verifier_lock:
+        if _signature_verifier is None:
+            try:
+                _signature_verifier = SignatureVerifier()
+            except UnsupportedSignature:
+                _signature_verifier = False
+    return _signature_verifier or None
+
+
+def encrypt(message):
+    '''Encrypt a message using gpg'''
+    return get_crypto_session().encrypt(message)
+
+
+def verify(message, signature):
+    '''Verify a signature by the Namesdao key, in-process if possible, otherwise with gpg'''
+    verifier = get_signature_verifier()
+    if verifier is not None:
+        try:
+            return verifier.verify(message, signature)
+        except UnsupportedSignature:
+            pass
+    return get_crypto_session().verify(message, signature)
+
+
+def encrypt_many(messages):
+    '''Encrypt many messages using gpg, sharing one context'''
+    return get_crypto_session().encrypt_many(messages)
+
+
+def verify_many(pairs):
+    '''Verify many (message, signature) pairs, see verify()'''
+    return [verify(message, signature) for message, signature in pairs]
 
 
 def sanitize_address(address):
     '''Make sure address is safe input for a shell command.'''
+    import re
+
     if re.match(r'^[a-z0-9]{62}$', address):
         return address
 
@@ -277,362 +951,4287 @@ def sanitize_number12dec(number):
     return f'{num:.12f}'
 
 
-def resolve(name):
-    ''' Use the Namesdao name to get the XCH address it refers to. Look up name json file and return the address, which the file lists.'''
+_BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_BECH32M_CONST = 0x2bc830a3
+
+
+def _bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _bech32_hrp_expand(hrp):
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+
+def _convertbits(data, frombits, tobits, pad=True):
+    acc = 0
+    bits = 0
+    ret = []
+    maxv = (1 << tobits) - 1
+    for value in data:
+        acc = (acc << frombits) | value
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            ret.append((acc >> bits) & maxv)
+    if pad and bits:
+        ret.append((acc << (tobits - bits)) & maxv)
+    elif not pad and (bits >= frombits or ((acc << (tobits - bits)) & maxv)):
+        raise ValueError('Invalid padding')
+    return ret
+
+
+def decode_puzzle_hash(address):
+    '''Decode a bech32m xch address into its 32 byte puzzle hash. Raises ValueError if it isn't valid.'''
+    address = address.lower()
+    hrp, sep, data_part = address.rpartition('1')
+    if not sep or not hrp or len(data_part) < 6:
+        raise ValueError(f'Invalid address: {address}')
+    try:
+        data = [_BECH32_CHARSET.index(c) for c in data_part]
+    except ValueError:
+        raise ValueError(f'Invalid address: {address}') from None
+    if _bech32_polymod(_bech32_hrp_expand(hrp) + data) != _BECH32M_CONST:
+        raise ValueError(f'Invalid address checksum: {address}')
+    puzzle_hash = bytes(_convertbits(data[:-6], 5, 8, False))
+    if len(puzzle_hash) != 32:
+        raise ValueError(f'Invalid address length: {address}')
+    return puzzle_hash
+
+
+def encode_puzzle_hash(puzzle_hash, prefix='xch'):
+    '''Encode a 32 byte puzzle hash as a bech32m address.'''
+    data = _convertbits(puzzle_hash, 8, 5)
+    polymod = _bech32_polymod(_bech32_hrp_expand(prefix) + data + [0] * 6) ^ _BECH32M_CONST
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return prefix + '1' + ''.join(_BECH32_CHARSET[d] for d in data + checksum)
+
+
+def mojos_to_xch(mojos):
+    '''Format an integer number of mojos as an XCH amount, without trailing zeros.'''
+    whole, frac = divmod(mojos, MOJOS_PER_XCH)
+    return f'{whole}.{frac:012d}'.rstrip('0').rstrip('.')
+
+
+def xch_to_mojos(amount):
+    '''Convert an amount of XCH (a string, up to 12 decimals) to an integer number of mojos. Raises ValueError.'''
+    from decimal import Decimal, InvalidOperation
+    try:
+        mojos = Decimal(amount.strip()) * MOJOS_PER_XCH
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {amount}') from None
+    if mojos != mojos.to_integral_value():
+        raise ValueError(f'Amount has more than 12 decimals: {amount}')
+    return int(mojos)
+
+
+def get_data_dir():
+    '''Return the directory for local namesdao data, creating it if needed.'''
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return DATA_DIR
+
+
+# A ResolveCache entry; stale_for is the number of seconds since it expired (0 if it's fresh)
+CachedRecord = namedtuple('CachedRecord', ['message', 'signature', 'verified', 'etag', 'last_modified', 'mirror', 'stale_for'])
+
+
+class ResolveCache:
+    '''On-disk cache of downloaded name records.
+
+    Each entry keeps the raw JSON, the detached signature, the result of the
+    signature check and the time it was fetched, so a warm lookup needs neither
+    the network nor gpg. Names the mirrors don't have are cached too, as an
+    entry with an empty message (NOT_FOUND) that expires after the shorter
+    not_found_ttl. The cache is bounded by evicting the least recently used
+    entries.
+
+    The mirror a record came from and its ETag / Last-Modified validators are
+    kept too, so an expired record can be revalidated with a conditional
+    request; if the mirror answers 304 Not Modified, touch() makes it fresh
+    again without downloading or verifying anything.
+    '''
+
+    NOT_FOUND = b''
+    # Columns added after the first release; missing ones are added on open.
+    VALIDATOR_COLUMNS = ('etag', 'last_modified', 'mirror')
+
+    def __init__(self, path=None, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, not_found_ttl=NOT_FOUND_TTL):
+        import sqlite3
+
+        if path is None:
+            path = os.path.join(get_data_dir(), CACHE_FILENAME)
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                ' name TEXT PRIMARY KEY,'
+                ' message BLOB NOT NULL,'
+                ' signature BLOB,'
+                ' verified INTEGER,'
+                ' fetched_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL,'
+                ' etag TEXT,'
+                ' last_modified TEXT,'
+                ' mirror TEXT)'
+            )
+            columns = {row[1] for row in self._db.execute('PRAGMA table_info(records)')}
+            for column in self.VALIDATOR_COLUMNS:
+                if column not in columns:
+                    self._db.execute(f'ALTER TABLE records ADD COLUMN {column} TEXT')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS records_accessed_at ON records (accessed_at)'
+            )
+
+    def get(self, name, max_stale=0):
+        '''Return a CachedRecord for a fresh entry, or None.
+
+        The message is NOT_FOUND if the name was cached as not found. Entries
+        that expired at most max_stale seconds ago are returned too, with
+        stale_for set; use max_stale=None to return an entry however old it is.
+        '''
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT message, signature, verified, etag, last_modified, mirror, fetched_at'
+                ' FROM records WHERE name = ?',
+                (name,),
+            ).fetchone()
+            if row is None:
+                return
+            message, signature, verified, etag, last_modified, mirror, fetched_at = row
+            stale_for = max(now - fetched_at - (self.not_found_ttl if message == self.NOT_FOUND else self.ttl), 0)
+            if max_stale is not None and stale_for > max_stale:
+                return
+            with self._db:
+                self._db.execute('UPDATE records SET accessed_at = ? WHERE name = ?', (now, name))
+        return CachedRecord(
+            message, signature, None if verified is None else bool(verified),
+            etag, last_modified, mirror, stale_for,
+        )
+
+    def put(self, name, message, signature, verified, etag=None, last_modified=None, mirror=None):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO records'
+                ' (name, message, signature, verified, fetched_at, accessed_at, etag, last_modified, mirror)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, message, signature, None if verified is None else int(verified), now, now, etag, last_modified, mirror),
+            )
+            self._evict()
+
+    def expires_at(self, name):
+        '''Return the time the entry for name expires (or expired), or None if it isn't cached.'''
+        with self._lock:
+            row = self._db.execute('SELECT message, fetched_at FROM records WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[1] + (self.not_found_ttl if row[0] == self.NOT_FOUND else self.ttl)
+
+    def touch(self, name):
+        '''Make an entry fresh again, e.g. after the mirror said it's not modified.'''
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('UPDATE records SET fetched_at = ?, accessed_at = ? WHERE name = ?', (now, now, name))
+
+    def put_not_found(self, name):
+        self.put(name, self.NOT_FOUND, None, None)
+
+    def items(self):
+        '''Return (name, message) for every cached entry, fresh or not.'''
+        with self._lock:
+            return self._db.execute('SELECT name, message FROM records').fetchall()
+
+    def _evict(self):
+        count = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                'DELETE FROM records WHERE name IN'
+                ' (SELECT name FROM records ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_resolve_cache = None
+
+
+def get_resolve_cache(ttl=None, not_found_ttl=None):
+    '''Return the process-wide resolution cache, or None if it can't be opened.'''
+    import sqlite3
+
+    global _resolve_cache
+    if _resolve_cache is None:
+        try:
+            _resolve_cache = ResolveCache()
+        except (OSError, sqlite3.Error) as err:
+            print(f'WARNING: Resolution cache is unavailable ({err}).')
+            return
+    if ttl is not None:
+        _resolve_cache.ttl = ttl
+    if not_found_ttl is not None:
+        _resolve_cache.not_found_ttl = not_found_ttl
+    return _resolve_cache
+
+
+class NameIndex:
+    '''Compact offline index of name -> puzzle hash, searched in place.
+
+    The file is a 32 byte header followed by fixed size records, sorted by key:
+    a 16 byte hash of the normalized name and the 32 byte puzzle hash it
+    resolves to. Lookups binary search the memory-mapped file, so they need no
+    network and memory use stays flat however many names are indexed.
+    '''
+
+    MAGIC = b'NDIX'
+    VERSION = 1
+    HEADER = struct.Struct('>4sHHQQd')  # magic, version, flags, count, generation, created (when the records were current)
+    KEY_SIZE = 16
+    RECORD_SIZE = KEY_SIZE + 32
+    FLAG_VERIFIED = 1  # every record came from a verified signature
+    FLAG_DELTA = 2  # a delta file: a zero puzzle hash removes the name
+    DELETED = bytes(32)
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            try:
+                magic, version, self.flags, self.count, self.generation, self.created = self.HEADER.unpack_from(self._mmap)
+            except struct.error:
+                raise ValueError(f'{path} is not a name index') from None
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(f'{path} is not a version {self.VERSION} name index')
+            if len(self._mmap) != self.HEADER.size + self.count * self.RECORD_SIZE:
+                raise ValueError(f'{path} is truncated')
+        except ValueError:
+            self._mmap.close()
+            raise
+
+    @classmethod
+    def name_key(cls, name):
+        import hashlib
+
+        return hashlib.sha256(normalize_name(name).encode('utf-8')).digest()[:cls.KEY_SIZE]
+
+    @property
+    def verified(self):
+        return bool(self.flags & self.FLAG_VERIFIED)
+
+    def _record(self, i):
+        offset = self.HEADER.size + i * self.RECORD_SIZE
+        return self._mmap[offset:offset + self.KEY_SIZE], self._mmap[offset + self.KEY_SIZE:offset + self.RECORD_SIZE]
+
+    def get_key(self, key):
+        '''Return the puzzle hash stored for a key, or None.'''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            found, puzzle_hash = self._record(lo)
+            if found == key:
+                return puzzle_hash
+
+    def get(self, name):
+        '''Return the puzzle hash name resolves to, or None if it isn't indexed.'''
+        return self.get_key(self.name_key(name))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._record(i)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+    def age(self):
+        '''Return how many seconds ago the records were current.'''
+        return time.time() - self.created
+
+    @classmethod
+    def write(cls, path, records, generation, flags=0, created=None):
+        '''Write sorted (key, puzzle_hash) records to path atomically; returns the number written.
+
+        created is when the records were current (default now).
+        '''
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        count = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(bytes(cls.HEADER.size))
+                previous = None
+                for key, puzzle_hash in records:
+                    if previous is not None and key <= previous:
+                        raise ValueError('Index records must be sorted by key, without duplicates')
+                    f.write(key + puzzle_hash)
+                    previous = key
+                    count += 1
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, flags, count, generation, time.time() if created is None else created))
+            os.replace(tmp_path, path)
+        except BaseException:
+            # e.g. the records iterator failed, or the disk is full; don't leave the partial file behind.
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return count
+
+    @classmethod
+    def merge(cls, records, updates):
+        '''Merge sorted updates into sorted records, streaming; an update with a zero puzzle hash removes the key.'''
+        records = iter(records)
+        updates = iter(updates)
+        record = next(records, None)
+        update = next(updates, None)
+        while record is not None or update is not None:
+            if update is None or (record is not None and record[0] < update[0]):
+                yield record
+                record = next(records, None)
+                continue
+            if record is not None and record[0] == update[0]:
+                record = next(records, None)
+            if update[1] != cls.DELETED:
+                yield update
+            update = next(updates, None)
+
+
+_name_index = None
+
+
+def get_name_index():
+    '''Return the offline name index built by `name sync`, or None if there isn't one.'''
+    global _name_index
+    path = os.path.join(DATA_DIR, NAME_INDEX_FILENAME)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return
+    if _name_index is None or _name_index[0] != mtime:
+        try:
+            _name_index = (mtime, NameIndex(path))
+        except (OSError, ValueError):
+            return
+    return _name_index[1]
+
+
+class ReverseIndex:
+    '''In-memory inverted index of puzzle hash -> the names that resolve to it.
+
+    It is built from the names this machine knows about: the on-chain index
+    (see `name index`), which takes precedence, and the resolution cache. An
+    address may have any number of names. Once loaded, it is kept up to date
+    by every lookup() and on-chain indexing run in the process, so the resolver
+    daemon can answer reverse lookups from memory.
+    '''
+
+    def __init__(self):
+        self._names = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        cache = get_resolve_cache()
+        if cache is not None:
+            for name, message in cache.items():
+                try:
+                    index.update(name, decode_puzzle_hash(json.loads(message.decode('utf-8'))['address']))
+                except (ValueError, KeyError, TypeError):
+                    pass
+        if os.path.exists(os.path.join(DATA_DIR, ONCHAIN_INDEX_FILENAME)):
+            for name, puzzle_hash in get_onchain_index().items():
+                index.update(name, puzzle_hash)
+        return index
+
+    def update(self, name, puzzle_hash):
+        '''Record that name resolves to puzzle_hash (None: it resolves to nothing).'''
+        with self._lock:
+            previous = self._owners.pop(name, None)
+            if previous is not None:
+                names = self._names[previous]
+                names.discard(name)
+                if not names:
+                    del self._names[previous]
+            if puzzle_hash is not None:
+                self._owners[name] = puzzle_hash
+                self._names.setdefault(puzzle_hash, set()).add(name)
+
+    def note(self, result):
+        '''Update the index from a ResolveResult.'''
+        if result.address is not None:
+            try:
+                self.update(result.name, decode_puzzle_hash(result.address))
+            except ValueError:
+                pass
+        elif result.status == RESOLVE_NOT_FOUND:
+            self.update(result.name, None)
+
+    def names(self, puzzle_hash):
+        '''Return the sorted names that resolve to puzzle_hash.'''
+        with self._lock:
+            return sorted(self._names.get(puzzle_hash, ()))
+
+    def __len__(self):
+        return len(self._owners)
+
+
+_reverse_index = None
+
+
+def get_reverse_index():
+    '''Return the process-wide ReverseIndex, loading it on first use.'''
+    global _reverse_index
+    if _reverse_index is None:
+        _reverse_index = ReverseIndex.load()
+    return _reverse_index
+
+
+def forget_reverse_index():
+    global _reverse_index
+    _reverse_index = None
+
+
+def reverse_lookup(address):
+    '''Return the sorted names that resolve to address. Raises ValueError for an invalid address.'''
+    return get_reverse_index().names(decode_puzzle_hash(address))
+
+
+def normalize_name(name):
+    '''Lowercase a Namesdao name and strip any permitted top-level suffix.'''
+    name = name.lower()
+
+    suffixes = ['.xch', '.chia']
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name
+
+
+class ConnectionPool:
+    '''Keep-alive HTTP(S) connections to the mirrors, pooled per host.
+
+    Connections are reused across all lookups in the process, so a batch of
+    lookups pays for the TCP connection and TLS handshake once per host rather
+    than once per file. Idle connections are closed after idle_timeout seconds,
+    and at most size idle connections are kept per host.
+    '''
+
+    def __init__(self, size=HTTP_POOL_SIZE, idle_timeout=HTTP_IDLE_TIMEOUT, timeout=HTTP_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl = None
+
+    def _connect(self, scheme, host, port):
+        import http.client
+
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context())
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _ssl_context(self):
+        import ssl
+
+        if self._ssl is None:
+            self._ssl = ssl.create_default_context()
+            self._ssl.set_alpn_protocols(['http/1.1'])
+        return self._ssl
+
+    def _open(self, conn, scheme, host, port):
+        '''Connect conn, with the DNS lookup, TCP connect and TLS handshake as separate phases.'''
+        import socket
+
+        port = port or (443 if scheme == 'https' else 80)
+        with trace_span('dns', host=host):
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with trace_span('connect', host=host):
+            error = None
+            for family, type_, proto, _, address in addresses:
+                sock = socket.socket(family, type_, proto)
+                try:
+                    sock.settimeout(self.timeout)
+                    sock.connect(address)
+                    break
+                except OSError as err:
+                    sock.close()
+                    error = err
+            else:
+                raise error or OSError(f'No addresses for {host}')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if scheme == 'https':
+            with trace_span('tls', host=host):
+                try:
+                    sock = self._ssl_context().wrap_socket(sock, server_hostname=host)
+                except OSError:
+                    sock.close()
+                    raise
+        conn.sock = sock
+
+    def _acquire(self, key):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._connect(*key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def get(self, url, headers=None):
+        '''GET url and return (status, headers, body).
+
+        The body is transparently gunzipped. Raises HTTPError for error statuses
+        and URLError if the mirror can't be reached, like urlopen() does.
+        '''
+        import gzip
+        import http.client
+        from urllib.error import HTTPError, URLError
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request_headers = {
+            'Accept-Encoding': 'gzip',
+            'User-Agent': f'Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}',
+        }
+        request_headers.update(headers or {})
+
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                if not reused:
+                    self._open(conn, *key)
+                with trace_span('download', url=url, reused=reused) as span:
+                    conn.request('GET', path, headers=request_headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    span.set(status=response.status, bytes=len(body))
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                if reused:
+                    # The server may have closed an idle connection; retry on a fresh one.
+                    continue
+                raise URLError(err)
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return response.status, response.headers, body
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+_connection_pool = None
+
+
+def get_connection_pool():
+    '''Return the process-wide mirror connection pool.'''
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = ConnectionPool()
+    return _connection_pool
+
+
+class MirrorHealth:
+    '''Health of the mirrors, used to decide which mirror to ask first.
+
+    Keeps an exponentially weighted moving average of each mirror's latency and
+    error rate, and a circuit breaker per mirror: after CIRCUIT_FAILURE_THRESHOLD
+    consecutive failures the circuit opens and the mirror is tried last; after
+    CIRCUIT_COOLDOWN seconds it is half-open and a single success closes it again.
+    The state is saved to a small json file so the next run starts on the
+    healthy, fastest mirror.
+    '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._mirrors = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._mirrors = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _stats(self, mirror):
+        return self._mirrors.setdefault(mirror, {
+            'latency': None,
+            'error_rate': 0.0,
+            'failures': 0,
+            'state': self.CLOSED,
+            'opened_at': 0,
+        })
+
+    def state(self, mirror):
+        stats = self._mirrors.get(mirror)
+        if stats is None:
+            return self.CLOSED
+        if stats['state'] == self.OPEN and time.time() - stats['opened_at'] >= CIRCUIT_COOLDOWN:
+            return self.HALF_OPEN
+        return stats['state']
+
+    def order(self, mirrors):
+        '''Return the mirrors to ask, best first.
+
+        Mirrors with an open circuit are left out, unless every mirror's circuit
+        is open. The others are ranked by their error-weighted latency; mirrors
+        we know nothing about yet keep their place at the front.
+        '''
+        def key(item):
+            idx, mirror = item
+            stats = self._mirrors.get(mirror)
+            if stats is None or stats['latency'] is None:
+                return (0, idx)
+            return (stats['latency'] * (1 + 4 * stats['error_rate']), idx)
+
+        with self._lock:
+            ranked = [mirror for _, mirror in sorted(enumerate(mirrors), key=key)]
+            available = [mirror for mirror in ranked if self.state(mirror) != self.OPEN]
+        return available or ranked
+
+    def record_success(self, mirror, latency):
+        with self._lock:
+            stats = self._stats(mirror)
+            if stats['latency'] is None:
+                stats['latency'] = latency
+            else:
+                stats['latency'] += MIRROR_EWMA_ALPHA * (latency - stats['latency'])
+            stats['error_rate'] *= 1 - MIRROR_EWMA_ALPHA
+            stats['failures'] = 0
+            stats['state'] = self.CLOSED
+            self._dirty = True
+
+    def record_failure(self, mirror):
+        count('namesdao_mirror_failures_total', mirror=mirror)
+        with self._lock:
+            stats = self._stats(mirror)
+            stats['error_rate'] += MIRROR_EWMA_ALPHA * (1 - stats['error_rate'])
+            stats['failures'] += 1
+            if stats['failures'] >= CIRCUIT_FAILURE_THRESHOLD or self.state(mirror) == self.HALF_OPEN:
+                stats['state'] = self.OPEN
+                stats['opened_at'] = time.time()
+            self._dirty = True
+
+    def save(self):
+        '''Write the state file, if anything changed.'''
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._mirrors, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                return
+            self._dirty = False
+
+
+_mirror_health = None
+
+
+def get_mirror_health():
+    '''Return the process-wide mirror health, loaded from (and saved at exit to) the data dir.'''
+    global _mirror_health
+    if _mirror_health is None:
+        import atexit
+        try:
+            path = os.path.join(get_data_dir(), MIRROR_STATE_FILENAME)
+        except OSError:
+            path = None
+        _mirror_health = MirrorHealth(path)
+        atexit.register(_mirror_health.save)
+    return _mirror_health
+
+
+def _backoff_delay(attempt):
+    '''Seconds to wait before retry number `attempt` (1-based): exponential backoff with full jitter.'''
+    import random
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+
+class RateLimiter:
+    '''Token bucket shared by threads: acquire() blocks so calls average at most rate per second.'''
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_MirrorResult = namedtuple(
+    '_MirrorResult',
+    ['message', 'signature', 'verified', 'status', 'detail', 'retryable', 'etag', 'last_modified', 'mirror', 'not_modified'],
+    defaults=(None, None, None, False),
+)
+
+_fetch_executors = None
+
+
+def _get_fetch_executors():
+    '''Return the (mirror, file) thread pools used for hedged downloads.
+
+    Mirror attempts and the file downloads they start run in separate pools, so
+    an attempt waiting on its signature download can never starve it.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    global _fetch_executors
+    if _fetch_executors is None:
+        _fetch_executors = (
+            ThreadPoolExecutor(max_workers=2 * HTTP_POOL_SIZE, thread_name_prefix='namesdao-mirror'),
+            ThreadPoolExecutor(max_workers=2 * HTTP_POOL_SIZE, thread_name_prefix='namesdao-file'),
+        )
+    return _fetch_executors
+
+
+def _fetch_from_mirror(mirror, name, cached=None):
+    '''Download a name json file and its signature from one mirror, in parallel, and verify them.
+
+    If cached is a CachedRecord that came from this mirror, the download is
+    conditional on its ETag / Last-Modified, and the signature is only fetched
+    once the mirror says the record changed; a 304 Not Modified answer returns
+    a result with not_modified set and nothing else.
+    '''
+    from urllib.error import HTTPError, URLError
+
+    pool = get_connection_pool()
+    health = get_mirror_health()
+    _, file_executor = _get_fetch_executors()
+    url = f'{mirror}/{name}.json'
+    headers = {}
+    if cached is not None and cached.mirror == mirror:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    signature_future = None if headers else file_executor.submit(pool.get, f'{url}.gpg')
+
+    started = time.monotonic()
+    try:
+        status, response_headers, message = pool.get(url, headers=headers)
+    except HTTPError as err:
+        if signature_future is not None:
+            signature_future.cancel()
+        code = err.getcode()
+        if code in (403, 404):
+            health.record_success(mirror, time.monotonic() - started)
+            return _MirrorResult(None, None, None, RESOLVE_NOT_FOUND, NOT_FOUND_DETAIL, False)
+        health.record_failure(mirror)
+        return _MirrorResult(None, None, None, RESOLVE_ERROR, (
+            'An error occurred while trying to resolve. Please try again.\n'
+            f'Error was: {err}'
+        ), code >= 500 or code == 429)
+    except URLError:
+        if signature_future is not None:
+            signature_future.cancel()
+        health.record_failure(mirror)
+        return _MirrorResult(None, None, None, RESOLVE_ERROR, 'An error occurred while trying to resolve. Please check your network connection and try again.', True)
+    health.record_success(mirror, time.monotonic() - started)
+    if status == 304:
+        return _MirrorResult(None, None, None, None, None, False, mirror=mirror, not_modified=True)
+    if signature_future is None:
+        signature_future = file_executor.submit(pool.get, f'{url}.gpg')
+    etag, last_modified = response_headers.get('ETag'), response_headers.get('Last-Modified')
+
+    detail = None
+    signature = None
+    try:
+        _, _, signature = signature_future.result()
+    except HTTPError as err:
+        if err.getcode() not in (403, 404):
+            detail = (
+                'An error occurred while trying to download the signature file. Please try again.\n'
+                f'Error was: {err}'
+            )
+    except URLError:
+        detail = 'An error occurred while trying to download the signature file. Please check your network connection and try again.'
+
+    verified = None
+    if signature:
+        if not verify(message, signature):
+            return _MirrorResult(None, None, None, RESOLVE_BAD_SIGNATURE, 'WARNING: Aborting due to invalid signature.', False)
+        verified = True
+    return _MirrorResult(message, signature, verified, None, detail, False, etag, last_modified, mirror)
+
+
+def _fetch_record(name, hedge_delay=HEDGE_DELAY, cached=None):
+    '''Download and verify the name json file and its signature (if any) from the mirrors.
+
+    The healthiest mirror (see MirrorHealth) is asked first. If it fails, or
+    hasn't answered within hedge_delay seconds, the same request is raced
+    against the next mirror, and the first complete, valid record wins. When
+    every mirror fails with a transient error, the round is retried up to
+    RESOLVE_RETRIES times with jittered exponential backoff.
+
+    Returns a _MirrorResult. On success status is None and signature is None
+    if the record isn't signed; otherwise status is one of the RESOLVE_*
+    failure statuses and detail explains what went wrong. If cached is given
+    (see _fetch_from_mirror()), not_modified may be set instead.
+    '''
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    mirror_executor, _ = _get_fetch_executors()
+    health = get_mirror_health()
+
+    attempt = 0
+    while True:
+        remaining = health.order(MIRRORS)
+        pending = {mirror_executor.submit(_fetch_from_mirror, remaining.pop(0), name, cached)}
+        failures = []
+        while pending:
+            done, pending = wait(pending, timeout=hedge_delay if remaining else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # The mirrors we asked are slow; hedge with the next one.
+                pending.add(mirror_executor.submit(_fetch_from_mirror, remaining.pop(0), name, cached))
+                continue
+            for future in done:
+                result = future.result()
+                if result.status is None:
+                    for other in pending:
+                        other.cancel()
+                    return result
+                failures.append(result)
+                if remaining:
+                    pending.add(mirror_executor.submit(_fetch_from_mirror, remaining.pop(0), name, cached))
+
+        if all(failure.status == RESOLVE_NOT_FOUND for failure in failures):
+            return failures[0]
+        attempt += 1
+        if attempt >= RESOLVE_RETRIES or not any(failure.retryable for failure in failures):
+            for status in (RESOLVE_BAD_SIGNATURE, RESOLVE_ERROR):
+                for failure in failures:
+                    if failure.status == status:
+                        return failure
+        time.sleep(_backoff_delay(attempt))
+
+
+def lookup(name, use_cache=True, refresh=False, cache_ttl=None, hedge_delay=None, verify_onchain=False, not_found_ttl=None, rate_limiter=None, stale_while_revalidate=0):
+    '''Resolve a Namesdao name without printing anything.
+
+    Returns a ResolveResult; its address is None unless the status is
+    RESOLVE_VERIFIED or RESOLVE_UNSIGNED, and its status is RESOLVE_NOT_FOUND
+    for a name that isn't registered. The offline name index (see `name sync`)
+    is checked first, then the local resolution cache, which also remembers
+    unregistered names for not_found_ttl (default NOT_FOUND_TTL) seconds; pass
+    use_cache=False to bypass both, or refresh=True to download the record
+    again and update the cache.
+    hedge_delay overrides HEDGE_DELAY, see _fetch_record(). A rate_limiter
+    (see RateLimiter) is acquired before asking the mirrors.
+
+    Expired cache entries are revalidated with a conditional request, so an
+    unchanged record isn't downloaded or verified again. A record that expired
+    at most stale_while_revalidate seconds ago is answered from the cache right
+    away, and revalidated in the background. See revalidation_stats().
+
+    With verify_onchain=True, the answer comes from the on-chain index built
+    by `name index` instead (status RESOLVE_ONCHAIN).
+    '''
+
+    name = normalize_name(name)
+    _last_lookup.stale = False
+    with trace_span('resolve', name=name) as span:
+        result = _lookup(name, use_cache, refresh, cache_ttl, hedge_delay, verify_onchain, not_found_ttl, rate_limiter, stale_while_revalidate)
+        span.set(status=result.status)
+    count('namesdao_lookups_total', status=result.status)
+    return result
+
+
+def _lookup(name, use_cache, refresh, cache_ttl, hedge_delay, verify_onchain, not_found_ttl, rate_limiter, stale_while_revalidate):
+    if verify_onchain:
+        return get_onchain_index().lookup(name)
+
+    if use_cache and not refresh:
+        index = get_name_index()
+        # Like a cached record, the index is only trusted while it's fresh, and only if it was built from verified records.
+        if index is not None and index.verified and 0 <= index.age() <= (CACHE_TTL if cache_ttl is None else cache_ttl):
+            puzzle_hash = index.get(name)
+            if puzzle_hash is not None:
+                count('namesdao_cache_requests_total', cache='index', result='hit')
+                return _noted(ResolveResult(name, encode_puzzle_hash(puzzle_hash), RESOLVE_VERIFIED, None))
+
+    cache = get_resolve_cache(cache_ttl, not_found_ttl) if use_cache else None
+    entry = None
+    if cache is not None and not refresh:
+        # Expired entries are kept for their validators; an expired not found entry is just a miss.
+        entry = cache.get(name, max_stale=None)
+        if entry is not None and entry.stale_for and entry.message == ResolveCache.NOT_FOUND:
+            entry = None
+
+    if cache is not None:
+        if entry is None:
+            outcome = 'miss'
+        elif entry.stale_for:
+            outcome = 'stale'
+        else:
+            outcome = 'not_found' if entry.message == ResolveCache.NOT_FOUND else 'hit'
+        count('namesdao_cache_requests_total', cache='records', result=outcome)
+
+    hedge_delay = HEDGE_DELAY if hedge_delay is None else hedge_delay
+    detail = None
+    if entry is not None and (not entry.stale_for or entry.stale_for <= stale_while_revalidate):
+        message, verified = entry.message, entry.verified
+        if message == ResolveCache.NOT_FOUND:
+            return _noted(ResolveResult(name, None, RESOLVE_NOT_FOUND, NOT_FOUND_DETAIL))
+        if entry.stale_for:
+            _last_lookup.stale = True
+            _revalidate_later(name, cache, entry, hedge_delay)
+    else:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        record = _refresh_record(name, cache, entry, hedge_delay)
+        if record.status is not None:
+            return _noted(ResolveResult(name, None, record.status, record.detail))
+        message, verified, detail = record.message, record.verified, record.detail
+
+    try:
+        address = json.loads(message.decode('utf-8'))['address']
+    except (ValueError, KeyError, TypeError) as err:
+        return ResolveResult(name, None, RESOLVE_ERROR, f'The name record could not be read: {err}')
+    status = RESOLVE_VERIFIED if verified else RESOLVE_UNSIGNED
+    return _noted(ResolveResult(name, address, status, detail))
+
+
+def _refresh_record(name, cache, cached, hedge_delay):
+    '''Download a name record with _fetch_record() and store it in the cache (if any).
+
+    cached is the expired CachedRecord being revalidated, or None. If the
+    mirror says it's not modified, it's made fresh again and returned as the
+    result, signature check and all.
+    '''
+    record = _fetch_record(name, hedge_delay=hedge_delay, cached=cached)
+    if cached is not None and (cached.etag or cached.last_modified):
+        if record.not_modified:
+            outcome = 'not_modified'
+        else:
+            outcome = 'modified' if record.status in (None, RESOLVE_NOT_FOUND) else 'error'
+        _note_revalidation(outcome)
+    if record.not_modified:
+        cache.touch(name)
+        return _MirrorResult(
+            cached.message, cached.signature, cached.verified, None, None, False,
+            cached.etag, cached.last_modified, cached.mirror, True,
+        )
+    if cache is not None:
+        if record.status is None:
+            cache.put(name, record.message, record.signature, record.verified, record.etag, record.last_modified, record.mirror)
+        elif record.status == RESOLVE_NOT_FOUND:
+            cache.put_not_found(name)
+    return record
+
+
+_last_lookup = threading.local()  # stale is True if this thread's last lookup() answered from an expired record
+_revalidation_lock = threading.Lock()
+_revalidation_counts = {'not_modified': 0, 'modified': 0, 'error': 0, 'stale_served': 0}
+_revalidating = set()
+_revalidate_executor = None
+
+
+def _note_revalidation(outcome):
+    with _revalidation_lock:
+        _revalidation_counts[outcome] += 1
+    count('namesdao_revalidations_total', result=outcome)
+
+
+def revalidation_stats():
+    '''Return how cached records were revalidated by this process.
+
+    not_modified, modified and error count conditional requests; hit_rate is
+    the share of them answered 304 Not Modified (None before the first one).
+    stale_served counts answers from an expired record, see lookup().
+    '''
+    with _revalidation_lock:
+        stats = dict(_revalidation_counts)
+    revalidations = stats['not_modified'] + stats['modified'] + stats['error']
+    stats['revalidations'] = revalidations
+    stats['hit_rate'] = stats['not_modified'] / revalidations if revalidations else None
+    return stats
+
+
+def _format_revalidation_stats():
+    '''One line summary of revalidation_stats() for the output of batch commands, or None.'''
+    stats = revalidation_stats()
+    if not stats['revalidations'] and not stats['stale_served']:
+        return
+    hit_rate = '-' if stats['hit_rate'] is None else f'{stats["hit_rate"]:.0%}'
+    return (
+        f'Revalidated {stats["revalidations"]} cached records: {stats["not_modified"]} not modified'
+        f' (hit rate {hit_rate}), {stats["modified"]} changed, {stats["error"]} errors;'
+        f' {stats["stale_served"]} stale answers'
+    )
+
+
+def _revalidate_later(name, cache, cached, hedge_delay):
+    '''Revalidate an expired cached record in the background, unless that's already under way.'''
+    from concurrent.futures import ThreadPoolExecutor
+
+    global _revalidate_executor
+    with _revalidation_lock:
+        _revalidation_counts['stale_served'] += 1
+        if name in _revalidating:
+            return
+        _revalidating.add(name)
+        if _revalidate_executor is None:
+            _revalidate_executor = ThreadPoolExecutor(max_workers=REVALIDATE_CONCURRENCY, thread_name_prefix='namesdao-revalidate')
+    count('namesdao_stale_answers_total')
+
+    def revalidate():
+        try:
+            _refresh_record(name, cache, cached, hedge_delay)
+        finally:
+            with _revalidation_lock:
+                _revalidating.discard(name)
+
+    _revalidate_executor.submit(revalidate)
+
+
+def _noted(result):
+    '''Keep the reverse index (if one is loaded) up to date with a lookup result.'''
+    if _reverse_index is not None:
+        _reverse_index.note(result)
+    return result
+
+
+def resolve(name, use_cache=True, refresh=False, cache_ttl=None, hedge_delay=None, verify_onchain=False, not_found_ttl=None, stale_while_revalidate=0, use_daemon=True):
+    ''' Use the Namesdao name to get the XCH address it refers to. Look up name json file and return the address, which the file lists.
+
+    If the resolver daemon (`namesdao.py serve`) is running, it answers the
+    lookup, unless use_daemon or use_cache is False. See lookup() for the other options.
+    '''
+
+    result = None
+    if use_daemon and use_cache and not verify_onchain:
+        client = get_daemon_client()
+        if client is not None:
+            result = client.lookup(name, refresh=refresh)
+    if result is None:
+        result = lookup(
+            name, use_cache=use_cache, refresh=refresh, cache_ttl=cache_ttl,
+            hedge_delay=hedge_delay, verify_onchain=verify_onchain, not_found_ttl=not_found_ttl,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+    if result.detail:
+        print(result.detail)
+    if result.status == RESOLVE_VERIFIED:
+        print('Verified signature')
+    elif result.status == RESOLVE_ONCHAIN:
+        print('Verified on chain')
+    return result.address
+
+
+def resolve_many(names, concurrency=RESOLVE_CONCURRENCY, use_daemon=True, **kwargs):
+    '''Resolve many names with a bounded pool of worker threads.
+
+    Yields a ResolveResult per name, in input order. names may be any iterable
+    (e.g. a file); at most a few times `concurrency` lookups are queued at once.
+    If the resolver daemon is running (and use_daemon is True), the names are
+    sent to it in batches instead. kwargs are passed on to lookup().
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = None
+    if use_daemon and kwargs.get('use_cache', True) and not kwargs.get('verify_onchain'):
+        client = get_daemon_client()
+    if client is not None:
+        from itertools import islice
+
+        names = iter(names)
+        while True:
+            batch = list(islice(names, DAEMON_BATCH_SIZE))
+            if not batch:
+                return
+            results = client.lookup_many(batch, refresh=kwargs.get('refresh', False))
+            if results is None:
+                # The daemon went away; resolve the rest ourselves.
+                names = chain(batch, names)
+                break
+            yield from results
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name in names:
+            pending.append(executor.submit(lookup, name, **kwargs))
+            if len(pending) >= concurrency * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+WarmResult = namedtuple('WarmResult', ['name', 'outcome', 'address', 'previous_address', 'not_modified', 'status', 'detail'])
+
+
+def _record_address(message):
+    '''Return the address in a cached name record, or None.'''
+    if not message:
+        return
+    try:
+        return json.loads(message.decode('utf-8'))['address']
+    except (ValueError, KeyError, TypeError):
+        return
+
+
+def warm(names, concurrency=WARM_CONCURRENCY, rate_limiter=None, hedge_delay=None, cache_ttl=None):
+    '''Download (or revalidate) the records of names into the resolution cache, so lookups of them are cache hits.
+
+    Every name is refreshed, even if its cached record hasn't expired yet;
+    expired and uncached names come first, then the rest by expiry time. Yields
+    a WarmResult per name as it finishes, whose outcome is 'refreshed',
+    'changed' (the name now resolves to another address) or 'failed' (status
+    and detail say why). not_modified is True if the mirror said the cached
+    record is still current. A rate_limiter (see RateLimiter) is acquired
+    before each download.
+    '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    cache = get_resolve_cache(cache_ttl)
+    if cache is None:
+        raise NamesdaoError('The resolution cache is unavailable')
+    hedge_delay = HEDGE_DELAY if hedge_delay is None else hedge_delay
+    names = sorted({normalize_name(name) for name in names}, key=lambda name: cache.expires_at(name) or 0)
+
+    def refresh(name):
+        cached = cache.get(name, max_stale=None)
+        previous_address = None if cached is None else _record_address(cached.message)
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        record = _refresh_record(name, cache, cached, hedge_delay)
+        if record.status is not None:
+            return WarmResult(name, 'failed', None, previous_address, False, record.status, record.detail)
+        address = _record_address(record.message)
+        if address is None:
+            return WarmResult(name, 'failed', None, previous_address, False, RESOLVE_ERROR, 'The name record could not be read')
+        _noted(ResolveResult(name, address, RESOLVE_VERIFIED if record.verified else RESOLVE_UNSIGNED, None))
+        outcome = 'changed' if cached is not None and previous_address != address else 'refreshed'
+        return WarmResult(name, outcome, address, previous_address, record.not_modified, None, record.detail)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='namesdao-warm') as executor:
+        for future in as_completed([executor.submit(refresh, name) for name in names]):
+            yield future.result()
+
+
+class LruCache:
+    '''Thread-safe in-memory LRU cache whose entries expire after ttl seconds.'''
+
+    def __init__(self, max_entries, ttl):
+        from collections import OrderedDict
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _unix_http_connection(path, timeout=None):
+    '''Return an HTTPConnection over a Unix domain socket.'''
+    import http.client
+    import socket
+
+    class UnixHTTPConnection(http.client.HTTPConnection):
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(path)
+
+    return UnixHTTPConnection('localhost', timeout=timeout)
+
+
+class DaemonClient:
+    '''Client for a running resolver daemon, see cmd_serve().'''
+
+    def __init__(self, host=None, port=None, socket_path=None, timeout=DAEMON_TIMEOUT, token=''):
+        import http.client
+
+        if socket_path:
+            self._conn = _unix_http_connection(socket_path, timeout=timeout)
+        else:
+            self._conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self._lock = threading.Lock()
+        self._token = token
+        self.rejected = False
+
+    def _request(self, method, path, body=None):
+        import http.client
+
+        headers = {'Authorization': f'Bearer {self._token}'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        with self._lock:
+            if self.rejected:
+                return
+            try:
+                self._conn.request(method, path, body=body, headers=headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                if response.status == 403:
+                    # Whatever is listening isn't the daemon that wrote serve.json; stop asking it.
+                    self.rejected = True
+                    self._conn.close()
+                    return
+                return json.loads(data)
+            except (OSError, http.client.HTTPException, ValueError):
+                self._conn.close()
+
+    def lookup(self, name, refresh=False):
+        '''Return the daemon's ResolveResult for name, or None if the daemon can't be reached.'''
+        from urllib.parse import quote
+
+        data = self._request('GET', f'/resolve/{quote(name, safe="")}' + ('?refresh=1' if refresh else ''))
+        if data is not None:
+            return ResolveResult(**data)
+
+    def lookup_many(self, names, refresh=False):
+        '''Return the daemon's ResolveResults for names, or None if the daemon can't be reached.'''
+        data = self._request('POST', '/resolve', json.dumps({'names': names, 'refresh': refresh}))
+        if data is not None:
+            return [ResolveResult(**result) for result in data['results']]
+
+    def reverse_many(self, addresses):
+        '''Return the daemon's list of names for each address, or None if the daemon can't be reached.
+
+        The list is None for an invalid address.
+        '''
+        data = self._request('POST', '/reverse', json.dumps({'addresses': addresses}))
+        if data is not None and 'results' in data:
+            return [result['names'] for result in data['results']]
+
+
+_daemon_client = False
+
+
+def get_daemon_client():
+    '''Return a DaemonClient if the resolver daemon is running, else None.
+
+    The daemon only answers requests carrying the token from its state file,
+    so a process that took over its pid or port is not mistaken for it.
+    '''
+    global _daemon_client
+    if _daemon_client is False:
+        _daemon_client = None
+        try:
+            with open(os.path.join(DATA_DIR, DAEMON_STATE_FILENAME)) as f:
+                state = json.load(f)
+            token = state['token']
+            if not isinstance(token, str) or not token:
+                return
+            os.kill(state['pid'], 0)
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        _daemon_client = DaemonClient(state.get('host'), state.get('port'), state.get('socket'), token=token)
+    return _daemon_client
+
+
+def _make_daemon_handler(memory_cache, lookup_kwargs, token, open_metrics=False):
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler
+    import hmac
+    import socket
+    from urllib.parse import parse_qs, unquote, urlsplit
+
+    def cached_lookup(name, refresh):
+        key = normalize_name(name)
+        if not refresh:
+            result = memory_cache.get(key)
+            count('namesdao_cache_requests_total', cache='memory', result='miss' if result is None else 'hit')
+            if result is not None:
+                return result
+        result = lookup(key, refresh=refresh, **lookup_kwargs)
+        if _last_lookup.stale:
+            # Being revalidated in the background; the next request should see the outcome.
+            return result
+        if result.address is not None:
+            memory_cache.put(key, result)
+        elif result.status == RESOLVE_NOT_FOUND:
+            memory_cache.put(key, result, ttl=lookup_kwargs['not_found_ttl'])
+        return result
+
+    def reverse_result(address):
+        try:
+            names = reverse_lookup(address)
+        except ValueError as err:
+            return {'address': address, 'names': None, 'error': str(err)}
+        return {'address': address, 'names': names}
+
+    class DaemonRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            if self.connection.family != socket.AF_UNIX:
+                # Headers and body go out in separate writes; don't let Nagle delay the body.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _send_json(self, code, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            '''Send a 403 and return False unless the request has the daemon's token.'''
+            given = self.headers.get('Authorization', '').encode('latin-1', 'replace')
+            if hmac.compare_digest(given, f'Bearer {token}'.encode('ascii')):
+                return True
+            # Any request body is left unread, so don't reuse the connection.
+            self.close_connection = True
+            self._send_json(403, {'error': 'Missing or wrong token'})
+            return False
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            # Scrapers on this machine may read the metrics without the token.
+            if not (open_metrics and parts.path == '/metrics') and not self._authorized():
+                return
+            refresh = parse_qs(parts.query).get('refresh') == ['1']
+            if parts.path == '/health':
+                self._send_json(200, {'status': 'ok', 'cached_names': len(memory_cache), 'revalidation': revalidation_stats()})
+            elif parts.path == '/metrics' and _metrics is not None:
+                body = _metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif parts.path.startswith('/resolve/') and len(parts.path) > len('/resolve/'):
+                result = cached_lookup(unquote(parts.path[len('/resolve/'):]), refresh)
+                code = 200 if result.address else 404 if result.status == RESOLVE_NOT_FOUND else 502
+                self._send_json(code, result._asdict())
+            elif parts.path.startswith('/reverse/') and len(parts.path) > len('/reverse/'):
+                result = reverse_result(unquote(parts.path[len('/reverse/'):]))
+                self._send_json(200 if result['names'] is not None else 400, result)
+            else:
+                self._send_json(404, {'error': 'Unknown path'})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            path = urlsplit(self.path).path
+            if path == '/reverse':
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    addresses = request['addresses'] if isinstance(request, dict) else request
+                    if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+                        raise ValueError('addresses must be a list of strings')
+                except (ValueError, KeyError) as err:
+                    self._send_json(400, {'error': f'Invalid request: {err}'})
+                    return
+                self._send_json(200, {'results': [reverse_result(address) for address in addresses]})
+                return
+            if path != '/resolve':
+                self._send_json(404, {'error': 'Unknown path'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                names = request['names'] if isinstance(request, dict) else request
+                refresh = bool(request.get('refresh')) if isinstance(request, dict) else False
+                if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                    raise ValueError('names must be a list of strings')
+            except (ValueError, KeyError) as err:
+                self._send_json(400, {'error': f'Invalid request: {err}'})
+                return
+            with ThreadPoolExecutor(max_workers=RESOLVE_CONCURRENCY) as executor:
+                results = list(executor.map(lambda name: cached_lookup(name, refresh), names))
+            self._send_json(200, {'results': [result._asdict() for result in results]})
+
+        def address_string(self):
+            return self.client_address[0] if self.client_address else 'unix'
+
+        def log_message(self, format, *args):
+            pass
+
+    return DaemonRequestHandler
+
+
+def cmd_send_after_confirmation(safe_address, safe_amount, safe_fee, safe_memo, use_name_tokens=False, backend=None, wallet_id=None):
+    '''Send safe_amount XCH (or NAME tokens) through the wallet backend.
+
+    Returns the transaction id ('' if the backend doesn't report it). Raises
+    SendError if the wallet doesn't take the transaction, and
+    WalletRpcUncertain if it may or may not have. wallet_id is the NAME token
+    wallet to use with use_name_tokens; by default it's looked up.
+    '''
+    if backend is None:
+        backend = get_wallet_backend()
+
+    if not use_name_tokens:
+        wallet_id = None
+    elif wallet_id is None:
+        wallet_id = find_name_wallet_id(backend)
+
+    with trace_span('wallet_send', backend=backend.name, asset='NAME' if wallet_id else 'XCH') as span:
+        try:
+            transaction_id = backend.send(safe_address, safe_amount, safe_fee, safe_memo, wallet_id=wallet_id)
+        except (SendError, WalletRpcError):
+            span.set(ok=False)
+            count('namesdao_sends_total', result='failed')
+            raise
+        span.set(ok=True)
+    count('namesdao_sends_total', result='ok')
+    return transaction_id
+
+
+def cmd_determine_name_wallet_id(fingerprint=None):
+    '''Determine NAME wallet id from the Chia CLI
+
+    The wallet id is used to pay with NAME tokens when registering a name.
+    '''
+    import subprocess
+    import re
+
+    cmd = [
+        'chia',
+        'wallet',
+        'show',
+    ]
+    if fingerprint is not None:
+        cmd.extend([
+            '-f',
+            str(fingerprint),
+        ])
+
+    with trace_span('wallet_show'):
+        ps = subprocess.Popen(('echo'), stdout=subprocess.PIPE)
+        out = subprocess.check_output(cmd, stdin=ps.stdout)
+        ps.wait()
+    #print('out=', out)
+    match = re.search(rb'-Asset ID:\s+' + NAME_ASSET_ID.encode() + rb'\n\s+-Wallet ID:\s+(\d+)', out)
+    if match:
+        return match.group(1).decode('utf-8')
+
+
+class NameWalletCache:
+    '''Small json file remembering the NAME CAT wallet id of each wallet fingerprint.'''
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_data_dir(), NAME_WALLET_CACHE_FILENAME)
+        self.path = path
+        try:
+            with open(path) as f:
+                self._wallet_ids = json.load(f)
+        except (OSError, ValueError):
+            self._wallet_ids = {}
+
+    def get(self, fingerprint):
+        return self._wallet_ids.get(str(fingerprint))
+
+    def set(self, fingerprint, wallet_id):
+        if wallet_id is None:
+            self._wallet_ids.pop(str(fingerprint), None)
+        else:
+            self._wallet_ids[str(fingerprint)] = wallet_id
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._wallet_ids, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def get_name_wallet_id(backend):
+    '''Return the NAME CAT wallet id of the backend's wallet.
+
+    The id is cached per wallet fingerprint. A cached id is checked cheaply with
+    the backend, and the full lookup (e.g. `chia wallet show`) only runs when
+    there is no cached id or the backend rejects it.
+    '''
+    try:
+        cache = NameWalletCache()
+    except OSError:
+        return backend.get_name_wallet_id()
+    fingerprint = backend.get_fingerprint() or 'default'
+    wallet_id = cache.get(fingerprint)
+    if wallet_id is not None and backend.is_name_wallet(wallet_id):
+        return wallet_id
+    wallet_id = backend.get_name_wallet_id()
+    cache.set(fingerprint, wallet_id)
+    return wallet_id
+
+
+def forget_name_wallet_id(backend):
+    '''Drop the cached NAME wallet id of the backend's wallet, e.g. after the wallet rejected it.'''
+    try:
+        NameWalletCache().set(backend.get_fingerprint() or 'default', None)
+    except OSError:
+        pass
+
+
+def find_name_wallet_id(backend):
+    '''Return the NAME CAT wallet id of the backend's wallet, see get_name_wallet_id(); raises SendError if it has none.'''
+    with trace_span('name_wallet_id', backend=backend.name):
+        wallet_id = get_name_wallet_id(backend)
+    if not wallet_id:
+        raise SendError('Unable to determine NAME token wallet id. Please specify an amount with `-a <amount>` to send XCH.')
+    return wallet_id
+
+
+class CliWalletBackend:
+    '''Wallet backend that runs the `chia` CLI for every operation.
+
+    This is the fallback when the wallet RPC isn't reachable. Every call starts
+    a new `chia` process, which takes a few seconds.
+    '''
+
+    name = 'cli'
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+
+    def get_fingerprint(self):
+        return self.fingerprint
+
+    def send(self, safe_address, safe_amount, safe_fee, safe_memo, wallet_id=None):
+        import subprocess
+        import re
+
+        cmd = [
+            'chia',
+            'wallet',
+            'send',
+            '-t',
+            safe_address,
+            '-a',
+            safe_amount,
+            '-m',
+            safe_fee,
+            '--override',
+        ]
+
+        if self.fingerprint is not None:
+            cmd.extend([
+                '-f',
+                str(self.fingerprint),
+            ])
+
+        if wallet_id is not None:
+            cmd.extend([
+                '-i',
+                str(wallet_id),
+            ])
+
+        if safe_memo is not None:
+            cmd.extend([
+                '-e',
+                safe_memo,
+            ])
+
+        # The output is searched for the transaction id, and passed on in the error if the send failed.
+        if wallet_id is not None:
+            # chia asks which wallet to use; the empty line answers with the active one.
+            ps = subprocess.Popen(('echo'), stdout=subprocess.PIPE)
+            proc = subprocess.run(cmd, stdin=ps.stdout, capture_output=True, text=True)
+            ps.wait()
+            if proc.returncode != 0:
+                # The cached NAME wallet id may be stale; look it up again next time.
+                forget_name_wallet_id(self)
+        else:
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise SendError(f'The wallet rejected the transaction: {proc.stderr.strip() or proc.stdout.strip() or "chia wallet send failed"}')
+        # e.g. "Run 'chia wallet get_transaction -f 1234 -tx 0x...' to get status"; report an empty id if it's missing.
+        match = re.search(r'-tx (0x[0-9a-fA-F]{64})', proc.stdout)
+        return match.group(1) if match else ''
+
+    def get_name_wallet_id(self):
+        return cmd_determine_name_wallet_id(self.fingerprint)
+
+    def is_name_wallet(self, wallet_id):
+        # There is no cheap way to ask the CLI, so a cached id is trusted until a send with it fails.
+        return True
+
+    def send_transaction_multi(self, additions, fee):
+        import subprocess
+
+        if self.fingerprint is not None:
+            try:
+                self._rpc('log_in', fingerprint=int(self.fingerprint))
+            except WalletRpcError as err:
+                # Sending anyway would spend from whichever key the wallet has loaded.
+                raise SendError(f'Unable to switch the wallet to fingerprint {self.fingerprint}, not sending: {err}') from err
+        request = {
+            'wallet_id': 1,
+            'additions': _rpc_additions(additions),
+            'fee': fee,
+        }
+        cmd = [
+            'chia',
+            'rpc',
+            'wallet',
+            'send_transaction_multi',
+            json.dumps(request),
+        ]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        try:
+            response = json.loads(proc.stdout)
+        except ValueError:
+            response = {}
+        if proc.returncode != 0 or not response.get('success', True) or 'error' in response:
+            raise SendError(f'The wallet rejected the transaction: {response.get("error") or proc.stderr.strip() or proc.stdout.strip()}')
+        return response.get('transaction_id') or response.get('transaction', {}).get('name')
+
+    def _rpc(self, endpoint, **params):
+        '''Call a wallet RPC endpoint through `chia rpc wallet`; raises WalletRpcError.'''
+        import subprocess
+
+        proc = subprocess.run(['chia', 'rpc', 'wallet', endpoint, json.dumps(params)], capture_output=True, text=True)
+        try:
+            response = json.loads(proc.stdout)
+        except ValueError:
+            raise WalletRpcError(proc.stderr.strip() or proc.stdout.strip() or f'{endpoint} failed') from None
+        if proc.returncode != 0 or not response.get('success', True) or 'error' in response:
+            raise WalletRpcError(response.get('error') or f'{endpoint} failed')
+        return response
+
+    def get_height(self):
+        return self._rpc('get_height_info')['height']
+
+    def get_transactions(self, wallet_id, count):
+        return self._rpc('get_transactions', wallet_id=int(wallet_id), start=0, end=count, sort_key='RELEVANCE')['transactions']
+
+    def get_transaction(self, transaction_id):
+        return self._rpc('get_transaction', transaction_id=transaction_id)['transaction']
+
+
+class WalletRpcError(Exception):
+    '''The wallet RPC couldn't be reached, or it returned an error.'''
+
+
+class WalletRpcUncertain(WalletRpcError):
+    '''A call that spends was sent, but no answer came back; the wallet may or may not have acted on it.'''
+
+
+class WalletRpcClient:
+    '''Client for the chia wallet daemon's HTTPS JSON-RPC API.
+
+    Authenticates with the local wallet's private ssl certificate (mutual TLS)
+    and keeps a single persistent connection open, so a call takes a few
+    milliseconds instead of a `chia` process start-up.
+    '''
+
+    def __init__(self, host=WALLET_RPC_HOST, port=WALLET_RPC_PORT, root=CHIA_ROOT, timeout=WALLET_RPC_TIMEOUT, service='wallet'):
+        import ssl
+        import http.client
+
+        ssl_dir = os.path.join(root, 'config', 'ssl')
+        context = ssl.create_default_context(cafile=os.path.join(ssl_dir, 'ca', 'private_ca.crt'))
+        context.check_hostname = False
+        context.load_cert_chain(
+            os.path.join(ssl_dir, service, f'private_{service}.crt'),
+            os.path.join(ssl_dir, service, f'private_{service}.key'),
+        )
+        self.host = host
+        self.port = port
+        self._conn = http.client.HTTPSConnection(host, port, context=context, timeout=timeout)
+        self._lock = threading.Lock()
+
+    # Endpoints that spend; sending one of these twice pays twice.
+    NOT_IDEMPOTENT = frozenset(['send_transaction', 'send_transaction_multi', 'cat_spend'])
+
+    def call(self, endpoint, **params):
+        '''POST params to the endpoint and return the response. Raises WalletRpcError.
+
+        A call is only sent again if it was to go out on a kept-alive
+        connection that the wallet had already closed. The NOT_IDEMPOTENT
+        endpoints are never sent twice: they get a new connection, and if one
+        fails once it may have reached the wallet, it raises WalletRpcUncertain.
+        '''
+        import http.client
+
+        body = json.dumps(params)
+        headers = {'Content-Type': 'application/json'}
+        with self._lock:
+            if endpoint in self.NOT_IDEMPOTENT:
+                self._conn.close()
+            while True:
+                reused = self._conn.sock is not None
+                sent = False
+                try:
+                    self._conn.request('POST', f'/{endpoint}', body=body, headers=headers)
+                    sent = True
+                    response = self._conn.getresponse()
+                    data = response.read()
+                    break
+                except (OSError, http.client.HTTPException) as err:
+                    self._conn.close()
+                    # A closed keep-alive connection fails while writing, or with no response at all.
+                    stale = reused and isinstance(err, ConnectionError) and (not sent or isinstance(err, http.client.RemoteDisconnected))
+                    if sent and endpoint in self.NOT_IDEMPOTENT:
+                        raise WalletRpcUncertain(
+                            f'No answer from the wallet RPC at {self.host}:{self.port} to {endpoint} ({err}); '
+                            'the wallet may have sent the transaction, check it before trying again'
+                        ) from err
+                    if not stale:
+                        raise WalletRpcError(f'Unable to reach the wallet RPC at {self.host}:{self.port}: {err}') from err
+        try:
+            result = json.loads(data)
+        except ValueError:
+            result = None
+        if not isinstance(result, dict):
+            raise WalletRpcError(f'Invalid response from {endpoint}: {data[:200]!r}')
+        if not result.get('success', False):
+            raise WalletRpcError(result.get('error') or f'{endpoint} failed')
+        return result
+
+    def get_wallets(self, wallet_type=None):
+        params = {} if wallet_type is None else {'type': wallet_type}
+        return self.call('get_wallets', **params)['wallets']
+
+    def get_logged_in_fingerprint(self):
+        return self.call('get_logged_in_fingerprint').get('fingerprint')
+
+    def log_in(self, fingerprint):
+        return self.call('log_in', fingerprint=int(fingerprint))
+
+    def cat_get_asset_id(self, wallet_id):
+        return self.call('cat_get_asset_id', wallet_id=wallet_id)['asset_id']
+
+    def send_transaction(self, address, amount, fee, memos=None, wallet_id=1):
+        params = {'wallet_id': wallet_id, 'address': address, 'amount': amount, 'fee': fee}
+        if memos:
+            params['memos'] = memos
+        return self.call('send_transaction', **params)['transaction_id']
+
+    def cat_spend(self, wallet_id, inner_address, amount, fee, memos=None):
+        params = {'wallet_id': wallet_id, 'inner_address': inner_address, 'amount': amount, 'fee': fee}
+        if memos:
+            params['memos'] = memos
+        return self.call('cat_spend', **params)['transaction_id']
+
+    def send_transaction_multi(self, additions, fee, wallet_id=1):
+        result = self.call('send_transaction_multi', wallet_id=wallet_id, additions=additions, fee=fee)
+        return result.get('transaction_id') or result['transaction']['name']
+
+    def get_transaction(self, transaction_id):
+        return self.call('get_transaction', transaction_id=transaction_id)['transaction']
+
+    def get_height_info(self):
+        return self.call('get_height_info')['height']
+
+    def get_transactions(self, wallet_id, start=0, end=50, sort_key='RELEVANCE'):
+        return self.call('get_transactions', wallet_id=wallet_id, start=start, end=end, sort_key=sort_key)['transactions']
+
+    def close(self):
+        self._conn.close()
+
+
+class FullNodeRpcClient(WalletRpcClient):
+    '''Client for the chia full node's HTTPS JSON-RPC API.'''
+
+    def __init__(self, host=WALLET_RPC_HOST, port=FULL_NODE_RPC_PORT, root=CHIA_ROOT, timeout=WALLET_RPC_TIMEOUT):
+        super().__init__(host, port, root, timeout, service='full_node')
+
+    def get_peak_height(self):
+        peak = self.call('get_blockchain_state')['blockchain_state'].get('peak')
+        return None if peak is None else peak['height']
+
+    def get_block_record_by_height(self, height):
+        return self.call('get_block_record_by_height', height=height)['block_record']
+
+    def get_block_spends(self, header_hash):
+        return self.call('get_block_spends', header_hash=header_hash)['block_spends']
+
+
+class RpcWalletBackend:
+    '''Wallet backend that talks to the wallet daemon over its JSON-RPC API.'''
+
+    name = 'rpc'
+
+    def __init__(self, client, fingerprint=None):
+        self.client = client
+        if fingerprint is not None and client.get_logged_in_fingerprint() != int(fingerprint):
+            client.log_in(fingerprint)
+        self.fingerprint = fingerprint
+
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            self.fingerprint = self.client.get_logged_in_fingerprint()
+        return self.fingerprint
+
+    def send(self, safe_address, safe_amount, safe_fee, safe_memo, wallet_id=None):
+        memos = [safe_memo] if safe_memo is not None else None
+        fee = _to_mojos(safe_fee, MOJOS_PER_XCH)
+        try:
+            if wallet_id is None:
+                transaction_id = self.client.send_transaction(safe_address, _to_mojos(safe_amount, MOJOS_PER_XCH), fee, memos)
+            else:
+                transaction_id = self.client.cat_spend(int(wallet_id), safe_address, _to_mojos(safe_amount, MOJOS_PER_CAT), fee, memos)
+        except WalletRpcUncertain:
+            raise
+        except WalletRpcError as err:
+            raise SendError(f'The wallet rejected the transaction: {err}') from err
+        return transaction_id
+
+    def get_name_wallet_id(self):
+        for wallet in self.client.get_wallets(WALLET_TYPE_CAT):
+            if self.client.cat_get_asset_id(wallet['id']) == NAME_ASSET_ID:
+                return str(wallet['id'])
+
+    def is_name_wallet(self, wallet_id):
+        try:
+            return self.client.cat_get_asset_id(int(wallet_id)) == NAME_ASSET_ID
+        except (WalletRpcError, ValueError):
+            return False
+
+    def send_transaction_multi(self, additions, fee):
+        try:
+            return self.client.send_transaction_multi(_rpc_additions(additions), fee)
+        except WalletRpcUncertain:
+            raise
+        except WalletRpcError as err:
+            raise SendError(f'The wallet rejected the transaction: {err}') from err
+
+    def get_height(self):
+        return self.client.get_height_info()
+
+    def get_transactions(self, wallet_id, count):
+        return self.client.get_transactions(int(wallet_id), end=count)
+
+    def get_transaction(self, transaction_id):
+        return self.client.get_transaction(transaction_id)
+
+
+def _rpc_additions(additions):
+    '''Turn (puzzle_hash, mojos, memo) tuples into send_transaction_multi additions.'''
+    return [
+        {
+            'puzzle_hash': '0x' + puzzle_hash.hex(),
+            'amount': mojos,
+            **({'memos': [memo]} if memo else {}),
+        }
+        for puzzle_hash, mojos, memo in additions
+    ]
+
+
+def _to_mojos(amount, per_unit):
+    '''Convert a decimal amount (string or number) to the nearest whole number of mojos.'''
+    from decimal import Decimal
+    return int((Decimal(str(amount)) * per_unit).to_integral_value())
+
+
+_wallet_backends = {}
+
+
+def get_wallet_backend(name=None, fingerprint=None):
+    '''Return the wallet backend to use: 'rpc', 'cli' or 'auto' (default WALLET_BACKEND).
+
+    'auto' uses the wallet RPC if it is reachable, and falls back to the chia CLI.
+    fingerprint selects the wallet key to use; by default it's the active one.
+    '''
+    name = name or WALLET_BACKEND
+    key = (name, fingerprint)
+    if key in _wallet_backends:
+        return _wallet_backends[key]
+    if name == 'cli':
+        backend = CliWalletBackend(fingerprint)
+    elif name in ('rpc', 'auto'):
+        try:
+            client = WalletRpcClient()
+            client.call('get_sync_status')
+            backend = RpcWalletBackend(client, fingerprint)
+        except (OSError, WalletRpcError) as err:
+            if name == 'rpc':
+                raise WalletRpcError(f'The wallet RPC is not available: {err}') from err
+            backend = CliWalletBackend(fingerprint)
+    else:
+        raise ValueError(f'Unknown wallet backend: {name}')
+    _wallet_backends[key] = backend
+    return backend
+
+
+def send_transaction_multi(additions, fee, backend=None):
+    '''Send one XCH transaction with several outputs through the chia wallet.
+
+    additions is a list of (puzzle_hash, mojos, memo) tuples, where memo may be
+    None, and fee is in mojos. Returns the transaction id. Raises SendError if
+    the wallet rejected the transaction, and WalletRpcUncertain if it may or
+    may not have sent it.
+    '''
+    if backend is None:
+        backend = get_wallet_backend()
+    return backend.send_transaction_multi(additions, fee)
+
+
+class _Options:
+    pass
+
+
+def _add_resolve_options(parser):
+    parser.add_option(
+        '--no-cache',
+        action='store_true',
+        help='Do not use the local resolution cache',
+    )
+    parser.add_option(
+        '--refresh',
+        action='store_true',
+        help='Download the name record again, even if it is cached',
+    )
+    parser.add_option(
+        '--cache-ttl',
+        type='int',
+        help=f'Seconds a cached name record stays valid (default {CACHE_TTL})',
+    )
+    parser.add_option(
+        '--not-found-ttl',
+        type='int',
+        help=f'Seconds an unregistered name stays cached as not found (default {NOT_FOUND_TTL})',
+    )
+    parser.add_option(
+        '--stale-while-revalidate',
+        type='int',
+        default=0,
+        help='Answer from a cached record up to this many seconds after it expired, and revalidate it in the background',
+    )
+    parser.add_option(
+        '--hedge-delay',
+        type='float',
+        help=f'Seconds to wait for a mirror before also asking the next one (default {HEDGE_DELAY})',
+    )
+    parser.add_option(
+        '--verify-onchain',
+        action='store_true',
+        help='Resolve from the on-chain index built by `name index` instead of the secondary cache',
+    )
+
+
+def _resolve_kwargs(options):
+    '''Turn the options added by _add_resolve_options() into lookup() arguments.'''
+    return dict(
+        use_cache=not options.no_cache,
+        refresh=options.refresh,
+        cache_ttl=options.cache_ttl,
+        not_found_ttl=options.not_found_ttl,
+        stale_while_revalidate=options.stale_while_revalidate,
+        hedge_delay=options.hedge_delay,
+        verify_onchain=options.verify_onchain,
+    )
+
+
+def _resolve_with_options(name, options):
+    return resolve(name, **_resolve_kwargs(options))
+
+
+def _add_wallet_options(parser):
+    parser.add_option(
+        '--backend',
+        choices=['auto', 'rpc', 'cli'],
+        help=f'How to talk to the wallet: auto, rpc or cli (default {WALLET_BACKEND})',
+    )
+    parser.add_option(
+        '--fingerprint',
+        type='int',
+        help='Fingerprint of the wallet key to use (default: the active key)',
+    )
+
+
+def _wallet_backend_from_options(options):
+    '''Return the wallet backend selected by --backend and --fingerprint, or None (after printing why) if it isn't available.'''
+    try:
+        return get_wallet_backend(getattr(options, 'backend', None), getattr(options, 'fingerprint', None))
+    except WalletRpcError as err:
+        print(err)
+
+
+def _parse_fee(options):
+    '''Return (safe_fee, mojos) from the -m/--fee and -M/--Fee options.
+
+    Both are None if the fee isn't a whole, non-negative number of mojos. The
+    conversion is exact (see xch_to_mojos()), so the fee that's sent is the one
+    that was asked for.
+    '''
+    if options.Fee is not None:
+        if sanitize_number(options.Fee) is None:
+            return None, None
+        mojos = int(options.Fee)
+    elif options.fee is not None:
+        try:
+            mojos = xch_to_mojos(options.fee)
+        except ValueError:
+            return None, None
+    else:
+        mojos = 1
+    if mojos < 0:
+        return None, None
+    return mojos_to_xch(mojos), str(mojos)
+
+
+def cloak_memo(memo):
+    '''Encrypt a registration memo (adding a secret salt) for a cloaked registration.'''
+    from urllib.parse import quote
+    import base64
+
+    memo_payload = memo.encode('utf-8')
+    if INCLUDE_SALT:
+        # Here we append a secret to the memo_payload.
+        memo_payload += b':' + base64.b64encode(os.urandom(20))
+    encmemo = encrypt(memo_payload)
+    return ':register:' + quote(encmemo)
+
+
+def prepare_send(address, amount, fee=None, memo=None, cloak=False, use_name_tokens=False):
+    '''Validate a payment to an XCH address and return it as a SendRequest.
+
+    amount and fee are in XCH (amount is in NAME tokens with use_name_tokens);
+    the fee defaults to 1 mojo. With cloak=True the memo is encrypted for
+    Namesdao, see cloak_memo(). Raises SendError for invalid input.
+    '''
+    import shlex
+
+    safe_amount = sanitize_number12dec(amount)
+    if safe_amount is not None and float(safe_amount) == 0:
+        raise SendError('Please provide an amount higher than 0.000000000001 (10^-12) XCH')
+
+    safe_address = sanitize_address(address)
+    safe_fee = '0.000000000001' if fee is None else sanitize_number12dec(fee)
+    if safe_fee is None:
+        raise SendError('Please use a number to indicate the network transaction fee (in XCH)')
+    if safe_amount is None:
+        raise SendError('Please use a number to indicate the amount of XCH to send')
+    if safe_address is None:
+        raise SendError('Sorry, we don\'t have an address for that name.')
+
+    if memo and cloak:
+        safe_memo = cloak_memo(memo)
+    elif memo:
+        safe_memo = shlex.quote(memo)
+    else:
+        safe_memo = None
+    return SendRequest(safe_address, safe_amount, safe_fee, safe_memo, use_name_tokens)
+
+
+def submit_send(request, backend=None, wallet_id=None):
+    '''Send a SendRequest through the wallet backend (default: get_wallet_backend()).
+
+    Returns a SendResult; its transaction_id is None if the backend doesn't
+    report one. Raises SendError if the wallet isn't available or doesn't take
+    the transaction, or if the wallet RPC didn't answer; then the transaction
+    may have been sent after all. wallet_id is the NAME token wallet, see
+    find_name_wallet_id(); by default it's looked up.
+    '''
+    if backend is None:
+        try:
+            backend = get_wallet_backend()
+        except WalletRpcError as err:
+            raise SendError(str(err)) from err
+    try:
+        transaction_id = cmd_send_after_confirmation(
+            request.address, request.amount, request.fee, request.memo,
+            use_name_tokens=request.use_name_tokens, backend=backend, wallet_id=wallet_id,
+        )
+    except WalletRpcError as err:
+        raise SendError(str(err)) from err
+    return SendResult(*request, transaction_id or None)
+
+
+def send_payment(address, amount, fee=None, memo=None, cloak=False, use_name_tokens=False, backend=None):
+    '''Send amount XCH (or NAME tokens) to an XCH address without prompting; see prepare_send() and submit_send().'''
+    return submit_send(prepare_send(address, amount, fee, memo, cloak, use_name_tokens), backend)
+
+
+# A queued send or registration, see JobQueue; payload is the dict it was enqueued with
+Job = namedtuple('Job', ['id', 'batch', 'seq', 'kind', 'payload', 'state', 'transaction_id', 'error'])
+
+
+class JobQueue:
+    '''Durable SQLite queue of the transactions a batch command sends.
+
+    `wallet send-batch` and `name register-batch` enqueue every transaction as
+    a job of a batch before anything is sent, then submit the jobs in order.
+    A job is marked JOB_SUBMITTING (and committed) before it's handed to the
+    wallet, and JOB_SUBMITTED with its transaction id (or JOB_FAILED) after,
+    so a run that dies halfway can be resumed (`queue resume`) without sending
+    anything twice: jobs caught in JOB_SUBMITTING may or may not have reached
+    the wallet, and are failed by recover() instead of being sent again.
+
+    Jobs are indexed by (batch, state), so claiming the next pending one costs
+    the same however many rows the queue holds; enqueueing is a single
+    transaction per batch.
+    '''
+
+    # States of the jobs that still need attention
+    UNFINISHED = (JOB_PENDING, JOB_SUBMITTING, JOB_FAILED)
+    _UNFINISHED_IN = 'IN (' + ', '.join('?' * len(UNFINISHED)) + ')'  # bound to UNFINISHED
+
+    def __init__(self, path=None):
+        import sqlite3
+
+        if path is None:
+            path = os.path.join(get_data_dir(), JOBS_FILENAME)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS batches ('
+                ' id INTEGER PRIMARY KEY,'
+                ' kind TEXT NOT NULL,'
+                ' source TEXT,'
+                ' digest TEXT,'
+                ' created_at REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id INTEGER PRIMARY KEY,'
+                ' batch INTEGER NOT NULL,'
+                ' seq INTEGER NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' state TEXT NOT NULL,'
+                ' transaction_id TEXT,'
+                ' error TEXT,'
+                ' updated_at REAL NOT NULL,'
+                ' UNIQUE (batch, seq))'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS batches_digest ON batches (digest)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS jobs_batch_state ON jobs (batch, state)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS jobs_transaction_id ON jobs (transaction_id) WHERE transaction_id IS NOT NULL')
+
+    def create_batch(self, kind, payloads, source=None, digest=None):
+        '''Enqueue a batch of jobs of a kind ('send' or 'register'); returns the batch id.'''
+        now = time.time()
+        with self._lock, self._db:
+            batch = self._db.execute(
+                'INSERT INTO batches (kind, source, digest, created_at) VALUES (?, ?, ?, ?)',
+                (kind, source, digest, now),
+            ).lastrowid
+            self._db.executemany(
+                'INSERT INTO jobs (batch, seq, payload, state, updated_at) VALUES (?, ?, ?, ?, ?)',
+                ((batch, seq, json.dumps(payload), JOB_PENDING, now) for seq, payload in enumerate(payloads, 1)),
+            )
+        return batch
+
+    def unfinished_batch(self, digest):
+        '''Return the id of a batch with this digest that still has unfinished or failed jobs, or None.'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT batches.id FROM batches JOIN jobs ON jobs.batch = batches.id'
+                f' WHERE batches.digest = ? AND jobs.state {self._UNFINISHED_IN} LIMIT 1',
+                (digest,) + self.UNFINISHED,
+            ).fetchone()
+        return row[0] if row else None
+
+    def batches(self, unfinished_only=False):
+        '''Return (id, kind, source, created_at) for every batch (only those with unfinished or failed jobs if unfinished_only).'''
+        query = 'SELECT id, kind, source, created_at FROM batches'
+        params = ()
+        if unfinished_only:
+            query += f' WHERE EXISTS (SELECT 1 FROM jobs WHERE jobs.batch = batches.id AND jobs.state {self._UNFINISHED_IN})'
+            params = self.UNFINISHED
+        with self._lock:
+            return self._db.execute(query + ' ORDER BY id', params).fetchall()
+
+    def counts(self, batch):
+        '''Return {state: number of jobs} for a batch.'''
+        with self._lock:
+            return dict(self._db.execute('SELECT state, COUNT(*) FROM jobs WHERE batch = ? GROUP BY state', (batch,)))
+
+    def _job(self, row):
+        job_id, batch, seq, kind, payload, state, transaction_id, error = row
+        return Job(job_id, batch, seq, kind, json.loads(payload), state, transaction_id, error)
+
+    _JOB_COLUMNS = 'jobs.id, batch, seq, kind, payload, state, transaction_id, error'
+
+    def jobs(self, batch, state=None, page_size=1000):
+        '''Yield the Jobs of a batch, in order, optionally only those in state.'''
+        query = f'SELECT {self._JOB_COLUMNS} FROM jobs JOIN batches ON batches.id = jobs.batch WHERE batch = ? AND jobs.id > ?'
+        if state is not None:
+            query += ' AND state = ?'
+        query += ' ORDER BY jobs.id LIMIT ?'
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(query, (batch, last) + ((state,) if state is not None else ()) + (page_size,)).fetchall()
+            for row in rows:
+                yield self._job(row)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def claim(self, batch):
+        '''Mark the next pending job of a batch as JOB_SUBMITTING and return it, or None if there is none.'''
+        with self._lock, self._db:
+            # jobs_batch_state holds the ids in order, so this doesn't depend on the size of the queue.
+            row = self._db.execute(
+                f'SELECT {self._JOB_COLUMNS} FROM jobs JOIN batches ON batches.id = jobs.batch'
+                ' WHERE batch = ? AND state = ? ORDER BY jobs.id LIMIT 1',
+                (batch, JOB_PENDING),
+            ).fetchone()
+            if row is None:
+                return
+            self._db.execute(
+                'UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?',
+                (JOB_SUBMITTING, time.time(), row[0]),
+            )
+        return self._job(row)._replace(state=JOB_SUBMITTING)
+
+    def finish(self, job_id, transaction_id=None, error=None):
+        '''Record the wallet's answer: JOB_SUBMITTED, or JOB_FAILED if there's an error.'''
+        state = JOB_FAILED if error is not None else JOB_SUBMITTED
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET state = ?, transaction_id = ?, error = ?, updated_at = ? WHERE id = ?',
+                (state, transaction_id or None, error, time.time(), job_id),
+            )
+        return state
+
+    def settle(self, job_id, state, error=None):
+        '''Record what became of a submitted job's transaction: JOB_CONFIRMED, or JOB_FAILED with an error.'''
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ? AND state = ?',
+                (state, error, time.time(), job_id, JOB_SUBMITTED),
+            )
+
+    def release(self, job_id):
+        '''Put a claimed job that was never handed to the wallet back in the queue.'''
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?',
+                (JOB_PENDING, time.time(), job_id, JOB_SUBMITTING),
+            )
+
+    def recover(self, batch):
+        '''Fail the jobs a dead run left in JOB_SUBMITTING; returns how many there were.'''
+        with self._lock, self._db:
+            return self._db.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE batch = ? AND state = ?',
+                (JOB_FAILED, JOB_INTERRUPTED, time.time(), batch, JOB_SUBMITTING),
+            ).rowcount
+
+    def retry(self, job_ids):
+        '''Put failed jobs back in the queue; returns how many were.'''
+        with self._lock, self._db:
+            return self._db.executemany(
+                'UPDATE jobs SET state = ?, error = NULL, updated_at = ? WHERE id = ? AND state = ?',
+                ((JOB_PENDING, time.time(), job_id, JOB_FAILED) for job_id in job_ids),
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    '''Return the process-wide JobQueue, or None (after saying why) if it can't be opened.'''
+    import sqlite3
+
+    global _job_queue
+    if _job_queue is None:
+        try:
+            _job_queue = JobQueue()
+        except (OSError, sqlite3.Error) as err:
+            print(f'Unable to open the job queue: {err}')
+            return
+    return _job_queue
+
+
+def _submit_job(job, backend, name_wallet_id):
+    '''Hand a job to the wallet; returns (transaction_id, error).'''
+    payload = job.payload
+    try:
+        if 'additions' in payload:
+            transaction_id = send_transaction_multi(
+                [(bytes.fromhex(puzzle_hash), mojos, memo) for puzzle_hash, mojos, memo in payload['additions']],
+                payload['fee'],
+                backend=backend,
+            )
+        else:
+            transaction_id = cmd_send_after_confirmation(
+                payload['address'], payload['amount'], payload['fee'], payload['memo'],
+                use_name_tokens=payload['asset'] == 'NAME', backend=backend, wallet_id=name_wallet_id,
+            )
+    except WalletRpcUncertain:
+        # Like a run that died mid-send: it may have gone out, so it mustn't be sent again blindly.
+        return None, JOB_INTERRUPTED
+    except Exception as err:
+        return None, str(err)
+    return transaction_id, None
+
+
+def run_jobs(queue, batch, backend, concurrency=1, stop_on_failure=False):
+    '''Submit the pending jobs of a batch through the wallet backend, at most concurrency at once.
+
+    Yields each Job once it's finished, in queue order, with its new state,
+    transaction id and error. With stop_on_failure, no more jobs are started
+    after one fails; the rest stay pending. Raises SendError, once the jobs
+    already started have finished, if NAME token jobs can't be sent because
+    the wallet has no NAME token wallet.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    name_wallet_id = None
+    pending = deque()
+    stopped = False
+    missing_wallet = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            job = None if stopped else queue.claim(batch)
+            if job is not None and job.payload.get('asset') == 'NAME' and name_wallet_id is None:
+                try:
+                    name_wallet_id = find_name_wallet_id(backend)
+                except SendError as err:
+                    # Nothing was sent; leave the job for a later run.
+                    queue.release(job.id)
+                    job = None
+                    stopped = True
+                    missing_wallet = err
+            if job is not None:
+                pending.append((job, executor.submit(_submit_job, job, backend, name_wallet_id)))
+                if len(pending) < concurrency:
+                    continue
+            if not pending:
+                if missing_wallet is not None:
+                    raise missing_wallet
+                return
+            job, future = pending.popleft()
+            transaction_id, error = future.result()
+            state = queue.finish(job.id, transaction_id, error)
+            stopped = stopped or (stop_on_failure and state == JOB_FAILED)
+            yield job._replace(state=state, transaction_id=transaction_id or None, error=error)
+
+
+# A transaction followed by track_transactions(); job is the queued Job it was sent for, or None
+TrackedTransaction = namedtuple('TrackedTransaction', ['transaction_id', 'wallet_id', 'job'])
+
+
+class WalletBlockFeed:
+    '''New blocks and the wallet's transactions, read through a wallet backend, for track_transactions().
+
+    wait_for_block() polls the wallet's height every poll_interval seconds,
+    which is a cheap call; transactions are only read when a block arrived.
+    Anything with the same four methods can stand in for it, such as a feed
+    driven by a push subscription, or a stub.
+    '''
+
+    def __init__(self, backend, poll_interval=TRACK_POLL_INTERVAL):
+        self.backend = backend
+        self.poll_interval = poll_interval
+
+    def get_height(self):
+        return self.backend.get_height()
+
+    def wait_for_block(self, height):
+        '''Return the wallet's height once it's past height.'''
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                new_height = self.backend.get_height()
+            except WalletRpcError as err:
+                print(f'Unable to get the wallet height: {err}', file=sys.stderr)
+                continue
+            if new_height > height:
+                return new_height
+
+    def transactions(self, wallet_id, count):
+        '''Return the wallet's count most relevant transactions: the unconfirmed ones, then the latest confirmed.'''
+        return self.backend.get_transactions(wallet_id, count)
+
+    def transaction(self, transaction_id):
+        '''Return one transaction, or None if the wallet doesn't know it.'''
+        try:
+            return self.backend.get_transaction(transaction_id)
+        except WalletRpcError as err:
+            if 'not found' in str(err).lower():
+                return
+            raise
+
+
+def _transaction_outcome(record, blocks, expire_blocks):
+    '''Return (event, details) for a wallet transaction record that has settled, or None if it's still in flight.'''
+    if record is None:
+        return 'failed', {'error': 'The wallet does not know this transaction'}
+    if record.get('confirmed'):
+        return 'confirmed', {'height': record.get('confirmed_at_height')}
+    # sent_to has a [peer, MempoolInclusionStatus, error] entry per peer the wallet sent it to.
+    sent_to = record.get('sent_to') or []
+    if sent_to and not any(status in (MEMPOOL_SUCCESS, MEMPOOL_PENDING) for _, status, _ in sent_to):
+        return 'failed', {'error': next((error for _, _, error in reversed(sent_to) if error), 'Rejected by every peer')}
+    if blocks >= expire_blocks:
+        return 'expired', {'blocks': blocks}
+
+
+def _track_event(event, tracked, **details):
+    '''Return the event dict for a tracked transaction (or, with tracked None, a name check).'''
+    record = {'event': event, 'time': round(time.time(), 3)}
+    if tracked is not None:
+        record['transaction_id'] = tracked.transaction_id
+        if tracked.job is not None:
+            record.update(job=tracked.job.id, batch=tracked.job.batch)
+            if 'name' in tracked.job.payload:
+                record['name'] = tracked.job.payload['name']
+    record.update(details)
+    count('namesdao_track_events_total', event=event)
+    return record
+
+
+def _normalize_transaction_id(transaction_id):
+    return '0x' + transaction_id.lower().removeprefix('0x')
+
+
+def track_transactions(transactions, feed, expire_blocks=TRACK_EXPIRE_BLOCKS, check_names=False, resolve_kwargs=None):
+    '''Follow many transactions together until each is confirmed, fails or expires; yields an event dict for each.
+
+    transactions are TrackedTransactions and feed is a WalletBlockFeed (or a
+    stand-in). The transactions of every wallet involved are read once at the
+    start and then once per new block, however many are followed; a
+    transaction is only looked up on its own at the start or when it is about
+    to expire, if that read didn't include it. The events are
+
+        {'event': 'confirmed', 'transaction_id': ..., 'height': ...}
+        {'event': 'failed', 'transaction_id': ..., 'error': ...}
+        {'event': 'expired', 'transaction_id': ..., 'blocks': ...}
+
+    plus the 'job', 'batch' and 'name' of queued jobs and a 'time'. With
+    check_names, the name of each confirmed registration job is then resolved
+    (with resolve_kwargs) on every new block until it is registered, giving
+    {'event': 'resolved', 'name': ..., 'address': ..., 'expected': ..., 'ok': ...},
+    or {'event': 'unresolved', 'name': ..., 'blocks': ...} after expire_blocks.
+    '''
+    resolve_kwargs = dict(resolve_kwargs or {}, refresh=True)
+    height = feed.get_height()
+    followed = {}  # wallet id -> {transaction id: (TrackedTransaction, height it was first seen at)}
+    for tracked in transactions:
+        tracked = tracked._replace(transaction_id=_normalize_transaction_id(tracked.transaction_id))
+        followed.setdefault(tracked.wallet_id, {})[tracked.transaction_id] = (tracked, height)
+    registering = {}  # name -> (TrackedTransaction, height its registration confirmed at)
+    first = True
+    while True:
+        for wallet_id, in_flight in followed.items():
+            if not in_flight:
+                continue
+            try:
+                with trace_span('track_sweep', wallet_id=wallet_id, transactions=len(in_flight)):
+                    records = feed.transactions(wallet_id, 2 * len(in_flight) + TRACK_SWEEP_SIZE)
+            except WalletRpcError as err:
+                print(f'Unable to read the transactions of wallet {wallet_id}: {err}', file=sys.stderr)
+                continue
+            records = {_normalize_transaction_id(record['name']): record for record in records}
+            for transaction_id, (tracked, since) in list(in_flight.items()):
+                record = records.get(transaction_id)
+                if record is None:
+                    if not first and height - since < expire_blocks:
+                        # Not among the latest transactions, so it can't have changed.
+                        continue
+                    try:
+                        record = feed.transaction(transaction_id)
+                    except WalletRpcError as err:
+                        print(f'Unable to get transaction {transaction_id}: {err}', file=sys.stderr)
+                        continue
+                outcome = _transaction_outcome(record, height - since, expire_blocks)
+                if outcome is None:
+                    continue
+                event, details = outcome
+                del in_flight[transaction_id]
+                yield _track_event(event, tracked, **details)
+                if event == 'confirmed' and check_names and tracked.job is not None and tracked.job.kind == 'register':
+                    registering[tracked.job.payload['name']] = (tracked, height)
+        if registering:
+            names = list(registering)
+            for name, result in zip(names, resolve_many(names, **resolve_kwargs)):
+                tracked, confirmed_at = registering[name]
+                if result.address is None:
+                    if height - confirmed_at >= expire_blocks:
+                        del registering[name]
+                        yield _track_event('unresolved', tracked, name=name, status=result.status, blocks=height - confirmed_at)
+                    continue
+                target = tracked.job.payload['target']
+                expected = sanitize_address(target) or lookup(target, **resolve_kwargs).address
+                del registering[name]
+                yield _track_event('resolved', tracked, name=name, address=result.address, expected=expected, ok=result.address == expected)
+        first = False
+        if not registering and not any(followed.values()):
+            return
+        height = feed.wait_for_block(height)
+
+
+def _cmd_send(name, address, options, name_token_amount=0):
+    # This is a shared method for processing operations that require sending chia.
+    safe_fee, mojos = _parse_fee(options)
+    if safe_fee is None:
+        if options.Fee is not None:
+            print('Please use a whole number to indicate the network transaction fee (in mojos)')
+        else:
+            print('Please use a number with at most 12 decimals to indicate the network transaction fee (in XCH)')
+        return
+
+    asset_name = 'XCH'
+    if name_token_amount:
+        # This means that NAME tokens will be sent instead of XCH.
+        amount = name_token_amount
+        asset_name = 'NAME'
+    elif options.amount is None:
+        amount = '0.000000000001'
+    else:
+        amount = options.amount
+
+    try:
+        request = prepare_send(address, amount, safe_fee, options.memo, options.cloak, use_name_tokens=bool(name_token_amount))
+    except SendError as err:
+        print(err)
+        return
+    if options.memo and options.cloak:
+        print (f'Replaced {request.memo} for {options.memo}')
+
+    if not options.yes:
+        if request.memo:
+            memo_txt = f'a memo of "{request.memo}" and'
+        else:
+            memo_txt = ''
+
+        print(
+            "Welcome to Namesdao wallet send\n"
+            "Namesdao, the Name Service for the Chia Blockchain\n"
+            "\n"
+            f"{name} maps to this XCH address: {request.address}\n"
+            #f"AIR token has asset id 824c71e37ac660006e03f7884561e7a124d930460ae1506a9c234c06ebc6aa1d"
+            #f"and your current balance is: 10 AIR"
+            "\n"
+            f"Please confirm, send {request.amount} {asset_name} to {name},\n"
+            f"with {memo_txt} network transaction fee of {mojos} mojos? (Y/n)"
+        )
+        if input() not in ('Y', 'Yes', 'yes', 'y'):
+            return
+
+    backend = _wallet_backend_from_options(options)
+    if backend is None:
+        return
+    try:
+        wallet_id = None
+        if request.use_name_tokens:
+            wallet_id = find_name_wallet_id(backend)
+            print('NAME token wallet id is', wallet_id)
+        result = submit_send(request, backend, wallet_id=wallet_id)
+    except (SendError, WalletRpcError) as err:
+        print(err)
+        return
+    print(f'Transaction submitted: {result.transaction_id or "(no id)"}')
+    return result
+
+
+async def async_resolve(name, **kwargs):
+    '''Resolve a Namesdao name from asyncio code; returns the ResolveResult.
+
+    The lookup runs in a worker thread, see lookup() for kwargs. Raises
+    NameNotFoundError if the name isn't registered, and ResolveError if it
+    can't be resolved for another reason.
+    '''
+    import asyncio
+
+    result = await asyncio.to_thread(lookup, name, **kwargs)
+    if result.address is None:
+        raise (NameNotFoundError if result.status == RESOLVE_NOT_FOUND else ResolveError)(result)
+    return result
+
+
+async def async_resolve_many(names, concurrency=RESOLVE_CONCURRENCY, **kwargs):
+    '''Resolve many names from asyncio code, yielding a ResolveResult per name in input order.
+
+    names may be an iterable or an async iterable. At most concurrency lookups
+    run at once, and no more names are taken from names until the caller has
+    consumed the oldest result, so a slow consumer holds back the lookups.
+    Failed lookups are yielded, not raised. Leaving the loop early (or
+    cancelling the task) cancels the lookups that haven't started yet.
+    '''
+    import asyncio
+    from functools import partial
+    from concurrent.futures import ThreadPoolExecutor
+
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+
+    async def aiter_names():
+        if hasattr(names, '__aiter__'):
+            async for name in names:
+                yield name
+        else:
+            for name in names:
+                yield name
+
+    try:
+        async for name in aiter_names():
+            pending.append(loop.run_in_executor(executor, partial(lookup, name, **kwargs)))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def async_send(recipient, amount, fee=None, memo=None, cloak=False, use_name_tokens=False, backend=None, **kwargs):
+    '''Send amount XCH (or NAME tokens) to a Namesdao name or XCH address from asyncio code.
+
+    A name is resolved first (see async_resolve(), which kwargs are passed
+    to). Returns a SendResult; raises ResolveError or SendError. Cancelling
+    stops a payment that hasn't reached the wallet yet, but once submit_send()
+    is running, the transaction may still go out.
+    '''
+    import asyncio
+
+    address = sanitize_address(recipient)
+    if address is None:
+        address = (await async_resolve(recipient, **kwargs)).address
+    request = await asyncio.to_thread(prepare_send, address, amount, fee, memo, cloak, use_name_tokens)
+    return await asyncio.to_thread(submit_send, request, backend)
+
+
+def cmd_send():
+    '''send command: Send XCH to the address that corresponds to the Namesdao name'''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-a', '--amount',
+        help='How much chia to send, in XCH  [required]',
+    )
+    parser.add_option(
+        '-e', '--memo',
+        help='Additional memo for the transaction',
+    )
+    parser.add_option(
+        '-k', '--cloak',
+        action='store_true',
+        help='Encrypt memo',
+    )
+    parser.add_option(
+        '-m', '--fee',
+        help='Set the fees for the transaction, in XCH',
+    )
+    parser.add_option(
+        '-M', '--Fee',
+        help='Set the fees for the transaction, in mojos [takes precedence over --fee]',
+    )
+    parser.add_option(
+        '-y', '--yes',
+        action='store_true',
+        help='Execute without asking for confirmation',
+    )
+    _add_resolve_options(parser)
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    try:
+        name = args[0]
+    except IndexError:
+        print('Please provide a name, e.g. hello.xch')
+        display_help()
+        return
+    # TODO: Improve help message re name/address. And give better error message in case no name is provided.
+    address = sanitize_address(name)
+    if not address:
+        address = _resolve_with_options(name, options)
+        if address is None:
+            return
+
+    _cmd_send(name, address, options)
+
+
+def _read_payouts(path):
+    '''Read (name_or_address, amount, memo) rows from a payouts csv file.'''
+    import csv
+
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            if row[0].strip() == 'name_or_address':
+                continue
+            row = [col.strip() for col in row] + ['', '']
+            yield row[0], row[1], row[2] or None
+
+
+def cmd_send_batch():
+    '''send-batch command: Send XCH to every recipient in a csv file, in as few transactions as possible.
+
+    The csv has `name_or_address,amount,memo` columns (memo is optional, amount
+    is in XCH). All names are resolved up front, and nothing is sent if any of
+    them can't be resolved and verified. The outputs are then sent in
+    transactions of at most --chunk-size outputs each, through the job queue
+    (see JobQueue), so that an interrupted run can be finished with
+    `queue resume`.
+    '''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-m', '--fee',
+        help='Set the fees for each transaction, in XCH',
+    )
+    parser.add_option(
+        '-M', '--Fee',
+        help='Set the fees for each transaction, in mojos [takes precedence over --fee]',
+    )
+    parser.add_option(
+        '--chunk-size',
+        type='int',
+        default=BATCH_CHUNK_SIZE,
+        help=f'Maximum number of outputs per transaction (default {BATCH_CHUNK_SIZE})',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=RESOLVE_CONCURRENCY,
+        help=f'Number of names to resolve in parallel (default {RESOLVE_CONCURRENCY})',
+    )
+    parser.add_option(
+        '-y', '--yes',
+        action='store_true',
+        help='Execute without asking for confirmation',
+    )
+    _add_resolve_options(parser)
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    try:
+        path, = args
+    except ValueError:
+        print('Please provide a csv file with name_or_address,amount,memo columns')
+        display_help()
+        return
+    if options.chunk_size < 1 or options.concurrency < 1:
+        print('Please use positive numbers for --chunk-size and --concurrency')
+        return
+
+    safe_fee, fee_mojos = _parse_fee(options)
+    if fee_mojos is None:
+        print('Please use a number to indicate the network transaction fee, in XCH with at most 12 decimals or in whole mojos')
+        return
+
+    try:
+        rows = list(_read_payouts(path))
+        digest = _file_digest(path)
+    except OSError as err:
+        print(f'Unable to read {path}: {err}')
+        return
+    if not rows:
+        print(f'No payouts found in {path}')
+        return
+    queue = get_job_queue()
+    if queue is None:
+        return
+    batch = queue.unfinished_batch(digest)
+    if batch is not None:
+        print(f'{path} is already queued as batch {batch}; see `namesdao queue list {batch}`, and `queue retry` or `queue resume` it.')
+        return
+
+    errors = []
+    amounts = []
+    for recipient, amount, memo in rows:
+        try:
+            mojos = xch_to_mojos(amount)
+        except ValueError as err:
+            errors.append(f'{recipient}: {err}')
+            continue
+        if mojos <= 0:
+            errors.append(f'{recipient}: Please provide an amount higher than 0.000000000001 (10^-12) XCH')
+        amounts.append(mojos)
+    if errors:
+        print('Not sending anything, the following payouts are invalid:')
+        for error in errors:
+            print(f'  {error}')
+        return
+
+    names = list(dict.fromkeys(normalize_name(recipient) for recipient, _, _ in rows if not sanitize_address(recipient)))
+    resolved = {}
+    for result in resolve_many(names, concurrency=options.concurrency, **_resolve_kwargs(options)):
+        if result.address is None or not sanitize_address(result.address):
+            errors.append(f'{result.name}: {result.status}')
+        resolved[result.name] = result
+    if errors:
+        print('Not sending anything, the following names could not be resolved:')
+        for error in errors:
+            print(f'  {error}')
+        return
+
+    additions = []
+    for (recipient, _, memo), mojos in zip(rows, amounts):
+        address = sanitize_address(recipient) or resolved[normalize_name(recipient)].address
+        try:
+            puzzle_hash = decode_puzzle_hash(address)
+        except ValueError as err:
+            print(f'Not sending anything, {recipient} has an invalid address: {err}')
+            return
+        additions.append((recipient, address, puzzle_hash, mojos, memo))
+
+    chunks = [additions[i:i + options.chunk_size] for i in range(0, len(additions), options.chunk_size)]
+    total = sum(mojos for _, _, _, mojos, _ in additions)
+    unsigned = sum(1 for result in resolved.values() if result.status not in (RESOLVE_VERIFIED, RESOLVE_ONCHAIN))
+
+    print(
+        "Welcome to Namesdao wallet send-batch\n"
+        "Namesdao, the Name Service for the Chia Blockchain\n"
+    )
+    for recipient, address, _, mojos, memo in additions:
+        memo_txt = f' (memo "{memo}")' if memo else ''
+        print(f'  {mojos_to_xch(mojos)} XCH to {recipient} -> {address}{memo_txt}')
+    print(
+        "\n"
+        f"Recipients: {len(additions)}, of which {len(resolved)} Namesdao names"
+        f"{f' ({unsigned} without a verified signature)' if unsigned else ''}\n"
+        f"Total: {mojos_to_xch(total)} XCH in {len(chunks)} transaction(s)\n"
+        f"Network transaction fees: {fee_mojos} mojos per transaction, {int(fee_mojos) * len(chunks)} mojos in total"
+    )
+    if not options.yes:
+        print('Please confirm, send these payouts? (Y/n)')
+        if input() not in ('Y', 'Yes', 'yes', 'y'):
+            return
+
+    backend = _wallet_backend_from_options(options)
+    if backend is None:
+        return
+    batch = queue.create_batch(
+        'send',
+        (
+            {
+                'additions': [[puzzle_hash.hex(), mojos, memo] for _, _, puzzle_hash, mojos, memo in chunk],
+                'fee': int(fee_mojos),
+            }
+            for chunk in chunks
+        ),
+        source=os.path.abspath(path),
+        digest=digest,
+    )
+    _drain_send_batch(queue, batch, backend, len(chunks))
+
+
+def _file_digest(path):
+    '''Return the sha256 hex digest of a file, used to recognise a batch file that's already queued.'''
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _drain_send_batch(queue, batch, backend, total):
+    '''Send the pending transactions of a send-batch one at a time, stopping at the first failure.'''
+    for job in run_jobs(queue, batch, backend, stop_on_failure=True):
+        if job.state == JOB_FAILED:
+            print(
+                f'Stopped at transaction {job.seq} of {total} ({job.error}); the earlier transactions were sent.\n'
+                f'Use `namesdao queue retry {job.id}` and `namesdao queue resume {batch}` to try again.'
+            )
+            return
+        print(f'Transaction {job.seq} of {total} ({len(job.payload["additions"])} outputs) submitted: {job.transaction_id or "(no id)"}')
+
+
+def _read_names(lines):
+    '''Yield the non-empty, non-comment names from an iterable of lines.'''
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def cmd_resolve():
+    '''resolve command: Show the XCH address for the given Namesdao name(s).
+
+    With a single name, print its address. With several names, a file of names
+    (--from-file) or `-` to read names from stdin, resolve them concurrently and
+    print one `name<TAB>address<TAB>status` line per name.
+    '''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-f', '--from-file',
+        help='Read names to resolve from a file, one per line',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=RESOLVE_CONCURRENCY,
+        help=f'Number of names to resolve in parallel (default {RESOLVE_CONCURRENCY})',
+    )
+    _add_resolve_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    if len(args) == 1 and args[0] != '-' and not options.from_file:
+        address = _resolve_with_options(args[0], options)
+        if address:
+            print(address)
+        return
+
+    if not args and not options.from_file:
+        print('Please provide a name')
+        display_help()
+        return
+    if options.concurrency < 1:
+        print('Please use a positive number for --concurrency')
+        return
+
+    def names():
+        for arg in args:
+            if arg == '-':
+                yield from _read_names(sys.stdin)
+            else:
+                yield arg
+        if options.from_file:
+            with open(options.from_file) as f:
+                yield from _read_names(f)
+
+    results = resolve_many(
+        names(),
+        concurrency=options.concurrency,
+        **_resolve_kwargs(options),
+    )
+    for result in results:
+        print(f'{result.name}\t{result.address or ""}\t{result.status}', flush=True)
+    summary = _format_revalidation_stats()
+    if summary:
+        print(summary, file=sys.stderr)
+
+
+def cmd_warm():
+    '''warm command: Prefetch the records of an address book of names into the resolution cache.
+
+    Names come from the arguments, a file (--from-file) or stdin (`-`). All of
+    them are downloaded (or revalidated, if cached) concurrently, so `wallet
+    send` to any of them doesn't wait for the mirrors. With --interval, the
+    address book is read again every --interval seconds and the records that
+    would expire before the next pass are refreshed, soonest expiry first.
+    Each pass prints the names that changed or failed and a summary.
+    '''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-f', '--from-file',
+        help='Read names from an address book file, one per line',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=WARM_CONCURRENCY,
+        help=f'Number of names to refresh in parallel (default {WARM_CONCURRENCY})',
+    )
+    parser.add_option(
+        '--rate-limit',
+        type='float',
+        default=WARM_RATE_LIMIT,
+        help=f'Maximum mirror lookups per second, 0 for no limit (default {WARM_RATE_LIMIT})',
+    )
+    parser.add_option(
+        '--interval',
+        type='float',
+        help='Keep running, refreshing records before they expire, and check every this many seconds',
+    )
+    parser.add_option(
+        '--cache-ttl',
+        type='int',
+        help=f'Seconds a cached name record stays valid (default {CACHE_TTL})',
+    )
+    parser.add_option(
+        '--hedge-delay',
+        type='float',
+        help=f'Seconds to wait for a mirror before also asking the next one (default {HEDGE_DELAY})',
+    )
+    options, args = parser.parse_args(sys.argv[3:])
+
+    if not args and not options.from_file:
+        print('Please provide names or an address book file')
+        display_help()
+        return
+    if options.concurrency < 1 or options.rate_limit < 0 or (options.interval is not None and options.interval <= 0):
+        print('Please use a positive number for --concurrency, --rate-limit and --interval')
+        return
+    if '-' in args and options.interval is not None:
+        print('Please use --from-file rather than stdin with --interval')
+        return
+
+    def names():
+        for arg in args:
+            if arg == '-':
+                yield from _read_names(sys.stdin)
+            else:
+                yield arg
+        if options.from_file:
+            with open(options.from_file) as f:
+                yield from _read_names(f)
+
+    rate_limiter = RateLimiter(options.rate_limit) if options.rate_limit else None
+    cache = get_resolve_cache(options.cache_ttl)
+    if cache is None:
+        return
+
+    while True:
+        due = names()
+        if options.interval is not None:
+            deadline = time.time() + options.interval + WARM_REFRESH_AHEAD
+            due = [name for name in due if (cache.expires_at(normalize_name(name)) or 0) <= deadline]
+
+        counts = {'refreshed': 0, 'changed': 0, 'failed': 0}
+        not_modified = 0
+        started = time.monotonic()
+        for result in warm(due, concurrency=options.concurrency, rate_limiter=rate_limiter, hedge_delay=options.hedge_delay):
+            counts[result.outcome] += 1
+            not_modified += result.not_modified
+            if result.outcome == 'changed':
+                print(f'{result.name}\tchanged\t{result.previous_address or "-"} -> {result.address}', flush=True)
+            elif result.outcome == 'failed':
+                print(f'{result.name}\tfailed\t{result.status}', flush=True)
+
+        warmed = sum(counts.values())
+        if warmed or options.interval is None:
+            elapsed = time.monotonic() - started
+            print(
+                f'Warmed {warmed} names in {elapsed:.1f}s: {counts["refreshed"]} refreshed '
+                f'({not_modified} not modified), {counts["changed"]} changed, {counts["failed"]} failed',
+                flush=True,
+            )
+        if options.interval is None:
+            return
+        time.sleep(options.interval)
+
+
+def cmd_reverse():
+    '''reverse command: Show the Namesdao names that resolve to the given XCH address(es).
+
+    Names come from the on-chain index (see `name index`) and the names this
+    machine has resolved before. With a single address, print its names one per
+    line. With several addresses, a file of addresses (--from-file) or `-` to
+    read them from stdin, print one `address<TAB>name,name,...` line per address.
+    '''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-f', '--from-file',
+        help='Read addresses from a file, one per line',
+    )
+    options, args = parser.parse_args(sys.argv[3:])
+
+    if not args and not options.from_file:
+        print('Please provide an address')
+        display_help()
+        return
+
+    def addresses():
+        for arg in args:
+            if arg == '-':
+                yield from _read_names(sys.stdin)
+            else:
+                yield arg
+        if options.from_file:
+            with open(options.from_file) as f:
+                yield from _read_names(f)
+
+    addresses = list(addresses())
+    client = get_daemon_client()
+    results = client.reverse_many(addresses) if client is not None else None
+    if results is None:
+        results = []
+        for address in addresses:
+            try:
+                results.append(reverse_lookup(address))
+            except ValueError:
+                results.append(None)
+
+    if len(args) == 1 and args[0] != '-' and not options.from_file:
+        names = results[0]
+        if names is None:
+            print(f'{addresses[0]} is not a valid address')
+        elif not names:
+            print(f'No known names resolve to {addresses[0]}')
+        for name in names or ():
+            print(f'{name}.xch')
+        return
+
+    for address, names in zip(addresses, results):
+        if names is None:
+            print(f'{address}\t\tinvalid')
+        else:
+            print(f'{address}\t{",".join(f"{name}.xch" for name in names)}')
+
+
+def cmd_register():
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-a', '--amount',
+        help='How much chia to send, in XCH. If no amount is provided, then NAME tokens will be sent',
+    )
+    parser.add_option(
+        '-k', '--cloak',
+        action='store_true',
+        help='Encrypt memo',
+    )
+    parser.add_option(
+        '-m', '--fee',
+        help='Set the fees for the transaction, in XCH',
+    )
+    parser.add_option(
+        '-M', '--Fee',
+        help='Set the fees for the transaction, in mojos [takes precedence over --fee]',
+    )
+    parser.add_option(
+        '-y', '--yes',
+        action='store_true',
+        help='Execute without asking for confirmation',
+    )
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+    try:
+        name, address = args
+    except ValueError:
+        print('Please provide a name and a recipient address or name')
+        print('Sample usage:')
+        print('python namesdao.py name register nameToRegister.xch xchaddresstoregister -m 0.0000000001')
+        print('python namesdao.py name register ___nameToRegister.xch xchaddresstoregister -a 0.000000000001 -m 0.0000000001')
+        print('python namesdao.py name register ___nameToRegister.xch xchaddresstoregister --cloak -a 0.000000000001 -m 0.0000000001')
+        return
+
+    memo = f'{name}:{address}'
+    opts = _Options()
+    opts.memo = memo
+    opts.cloak = options.cloak
+    opts.yes = options.yes
+    opts.amount = options.amount
+    opts.fee = options.fee
+    opts.Fee = options.Fee
+    opts.backend = options.backend
+    opts.fingerprint = options.fingerprint
+
+    if not options.amount:
+        fee=get_name_token_fee(name)
+        if fee:
+            _cmd_send('namesdao.xch', RECIPIENT_ADDRESS, opts, name_token_amount=fee)
+            return
+
+    _cmd_send('namesdao.xch', RECIPIENT_ADDRESS, opts)
+
+
+def _read_registrations(path):
+    '''Read (name, address) rows from a registrations csv file.'''
+    import csv
+
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            if row[0].strip() == 'name':
+                continue
+            row = [col.strip() for col in row] + ['']
+            yield row[0], row[1]
+
+
+def cmd_register_batch():
+    '''register-batch command: Register every name in a csv file of `name,address` rows.
+
+    The NAME token (or XCH) cost of every registration is worked out up front,
+    cloaked memos are encrypted in a pool of processes, and after a single
+    confirmation the registrations are queued (see JobQueue) and sent with
+    bounded parallelism. The outcome of every row is written to a results csv
+    file.
+    '''
+    from optparse import OptionParser
+    import shlex
+
+    parser = OptionParser()
+    parser.add_option(
+        '-a', '--amount',
+        help='How much chia to send per registration, in XCH. If no amount is provided, then NAME tokens will be sent',
+    )
+    parser.add_option(
+        '-k', '--cloak',
+        action='store_true',
+        help='Encrypt memos',
+    )
+    parser.add_option(
+        '-m', '--fee',
+        help='Set the fees for each transaction, in XCH',
+    )
+    parser.add_option(
+        '-M', '--Fee',
+        help='Set the fees for each transaction, in mojos [takes precedence over --fee]',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=REGISTER_BATCH_CONCURRENCY,
+        help=f'Number of registrations to send in parallel (default {REGISTER_BATCH_CONCURRENCY})',
+    )
+    parser.add_option(
+        '-o', '--output',
+        help='Write the result of every registration to this csv file (default: <file>.results.csv)',
+    )
+    parser.add_option(
+        '-y', '--yes',
+        action='store_true',
+        help='Execute without asking for confirmation',
+    )
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    try:
+        path, = args
+    except ValueError:
+        print('Please provide a csv file with name,address columns')
+        display_help()
+        return
+    if options.concurrency < 1:
+        print('Please use a positive number for --concurrency')
+        return
+    output = options.output or f'{path}.results.csv'
+
+    safe_fee, fee_mojos = _parse_fee(options)
+    if safe_fee is None:
+        print('Please use a number to indicate the network transaction fee, in XCH with at most 12 decimals or in whole mojos')
+        return
+    if options.amount is not None:
+        safe_amount = sanitize_number12dec(options.amount)
+        if safe_amount is None or float(safe_amount) == 0:
+            print('Please provide an amount higher than 0.000000000001 (10^-12) XCH')
+            return
+
+    try:
+        rows = list(_read_registrations(path))
+        digest = _file_digest(path)
+    except OSError as err:
+        print(f'Unable to read {path}: {err}')
+        return
+    invalid = [name for name, address in rows if not address]
+    if invalid:
+        print('Not registering anything, these rows have no address: ' + ', '.join(invalid))
+        return
+    if not rows:
+        print(f'No registrations found in {path}')
+        return
+    queue = get_job_queue()
+    if queue is None:
+        return
+    batch = queue.unfinished_batch(digest)
+    if batch is not None:
+        print(f'{path} is already queued as batch {batch}; see `namesdao queue list {batch}`, and `queue retry` or `queue resume` it.')
+        return
+
+    # Work out what each registration costs, like `name register` does.
+    registrations = []
+    for name, address in rows:
+        token_fee = None if options.amount else get_name_token_fee(name)
+        if token_fee:
+            registrations.append([name, address, token_fee, 'NAME'])
+        else:
+            registrations.append([name, address, safe_amount if options.amount else '0.000000000001', 'XCH'])
+
+    memos = [f'{name}:{address}' for name, address in rows]
+    if options.cloak:
+        from concurrent.futures import ProcessPoolExecutor
+
+        print(f'Encrypting {len(memos)} memos...')
+        with ProcessPoolExecutor() as executor:
+            memos = list(executor.map(cloak_memo, memos, chunksize=16))
+    else:
+        memos = [shlex.quote(memo) for memo in memos]
+
+    total_xch = sum(xch_to_mojos(amount) for _, _, amount, asset in registrations if asset == 'XCH')
+    total_name = sum(_to_mojos(amount, MOJOS_PER_CAT) for _, _, amount, asset in registrations if asset == 'NAME')
+    print(
+        "Welcome to Namesdao name register-batch\n"
+        "Namesdao, the Name Service for the Chia Blockchain\n"
+        "\n"
+        f"Registrations: {len(registrations)}{' (cloaked)' if options.cloak else ''}\n"
+        f"Total: {mojos_to_xch(total_xch)} XCH and {total_name / MOJOS_PER_CAT:g} NAME\n"
+        f"Network transaction fees: {fee_mojos} mojos per registration, {int(fee_mojos) * len(registrations)} mojos in total"
+    )
+    if not options.yes:
+        print('Please confirm, send these registrations? (Y/n)')
+        if input() not in ('Y', 'Yes', 'yes', 'y'):
+            return
+
+    backend = _wallet_backend_from_options(options)
+    if backend is None:
+        return
+    batch = queue.create_batch(
+        'register',
+        (
+            {
+                'name': name,
+                'target': address,
+                'address': RECIPIENT_ADDRESS,
+                'amount': amount,
+                'asset': asset,
+                'fee': safe_fee,
+                'memo': memo,
+            }
+            for (name, address, amount, asset), memo in zip(registrations, memos)
+        ),
+        source=os.path.abspath(path),
+        digest=digest,
+    )
+    _drain_register_batch(queue, batch, backend, options.concurrency, output)
+
+
+def _drain_register_batch(queue, batch, backend, concurrency, output, mode='w'):
+    '''Send the pending registrations of a register-batch, appending the outcome of each to the output csv.'''
+    import csv
+
+    submitted = failed = 0
+    with open(output, mode, newline='') as f:
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(['name', 'address', 'amount', 'asset', 'status', 'transaction_id', 'error', 'job'])
+        try:
+            for job in run_jobs(queue, batch, backend, concurrency=concurrency):
+                payload = job.payload
+                status = 'failed' if job.state == JOB_FAILED else 'submitted'
+                failed += job.state == JOB_FAILED
+                submitted += job.state != JOB_FAILED
+                writer.writerow([
+                    payload['name'], payload['target'], payload['amount'], payload['asset'],
+                    status, job.transaction_id or '', job.error or '', job.id,
+                ])
+                f.flush()
+        except SendError as err:
+            print(err)
+
+    print(f'{submitted} registrations submitted, {failed} failed. Results are in {output}')
+    pending = queue.counts(batch).get(JOB_PENDING, 0)
+    if pending:
+        print(f'{pending} registrations were not sent; use `namesdao queue resume {batch}` to send them.')
+
+
+def cmd_queue_status():
+    '''queue status command: Show the batches in the job queue and how many of their jobs are in each state'''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '--all',
+        action='store_true',
+        help='Also show batches whose jobs have all been submitted',
+    )
+    options, args = parser.parse_args(sys.argv[3:])
+
+    queue = get_job_queue()
+    if queue is None:
+        return
+    batches = queue.batches(unfinished_only=not options.all)
+    if not batches:
+        print('No unfinished or failed batches in the job queue' if not options.all else 'The job queue is empty')
+        return
+    for batch, kind, source, created_at in batches:
+        counts = queue.counts(batch)
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))
+        states = ', '.join(
+            f'{counts.get(state, 0)} {state}' for state in (JOB_PENDING, JOB_SUBMITTING, JOB_SUBMITTED, JOB_CONFIRMED, JOB_FAILED)
+        )
+        print(f'{batch}\t{kind}\t{created}\t{source or ""}\t{states}')
+
+
+def cmd_queue_list():
+    '''queue list command: List the jobs of a batch, with their state, transaction id and error'''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '--state',
+        help='Only list jobs in this state (pending, submitting, submitted, confirmed or failed)',
+    )
+    options, args = parser.parse_args(sys.argv[3:])
+
+    try:
+        batch, = args
+        batch = int(batch)
+    except ValueError:
+        print('Please provide a batch id, see `namesdao queue status`')
+        return
+    queue = get_job_queue()
+    if queue is None:
+        return
+    for job in queue.jobs(batch, state=options.state):
+        print(f'{job.id}\t{job.state}\t{job.transaction_id or ""}\t{job.error or ""}')
+
+
+def cmd_queue_resume():
+    '''queue resume command: Send the pending jobs of unfinished batches, without sending anything twice
+
+    Jobs that an interrupted run left in JOB_SUBMITTING may have reached the
+    wallet, so they're failed rather than sent again; check them in the
+    wallet, and `queue retry` the ones that didn't go out.
+    '''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=REGISTER_BATCH_CONCURRENCY,
+        help=f'Number of registrations to send in parallel (default {REGISTER_BATCH_CONCURRENCY})',
+    )
+    parser.add_option(
+        '-o', '--output',
+        help='Append the result of every registration to this csv file (default: <file>.results.csv)',
+    )
+    parser.add_option(
+        '-y', '--yes',
+        action='store_true',
+        help='Execute without asking for confirmation',
+    )
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    if options.concurrency < 1:
+        print('Please use a positive number for --concurrency')
+        return
+    try:
+        wanted = {int(arg) for arg in args}
+    except ValueError:
+        print('Please provide batch ids, see `namesdao queue status`')
+        return
+    queue = get_job_queue()
+    if queue is None:
+        return
+    batches = [batch for batch in queue.batches(unfinished_only=True) if not wanted or batch[0] in wanted]
+    if not batches:
+        print('Nothing to resume')
+        return
+
+    pending = {}
+    for batch, kind, source, _ in batches:
+        interrupted = queue.recover(batch)
+        if interrupted:
+            print(
+                f'Batch {batch}: {interrupted} job(s) were interrupted while being sent and may or may not have reached the wallet.\n'
+                f'  They are marked failed, see `namesdao queue list {batch} --state failed`; `namesdao queue retry` the ones that were not sent.'
+            )
+        pending[batch] = queue.counts(batch).get(JOB_PENDING, 0)
+    batches = [batch for batch in batches if pending[batch[0]]]
+    if not batches:
+        print('No pending jobs left to send')
+        return
+
+    print(
+        "Welcome to Namesdao queue resume\n"
+        "Namesdao, the Name Service for the Chia Blockchain\n"
+    )
+    for batch, kind, source, _ in batches:
+        print(f'  Batch {batch} ({kind} {source or ""}): {pending[batch]} pending job(s)')
+    if not options.yes:
+        print('Please confirm, send the pending jobs? (Y/n)')
+        if input() not in ('Y', 'Yes', 'yes', 'y'):
+            return
+
+    backend = _wallet_backend_from_options(options)
+    if backend is None:
+        return
+    for batch, kind, source, _ in batches:
+        if kind == 'send':
+            _drain_send_batch(queue, batch, backend, sum(queue.counts(batch).values()))
+        else:
+            output = options.output or f'{source}.results.csv'
+            _drain_register_batch(queue, batch, backend, options.concurrency, output, mode='a')
+
+
+def cmd_queue_retry():
+    '''queue retry command: Put failed jobs back in the queue, to be sent by `queue resume`'''
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '--batch',
+        type='int',
+        help='Retry every failed job of this batch',
+    )
+    options, args = parser.parse_args(sys.argv[3:])
+
+    try:
+        job_ids = [int(arg) for arg in args]
+    except ValueError:
+        print('Please provide job ids, see `namesdao queue list`')
+        return
+    queue = get_job_queue()
+    if queue is None:
+        return
+    if options.batch is not None:
+        failed = list(queue.jobs(options.batch, state=JOB_FAILED))
+        interrupted = sum(job.error == JOB_INTERRUPTED for job in failed)
+        if interrupted:
+            print(f'Warning: {interrupted} of these jobs were interrupted and may already have been sent.')
+        job_ids.extend(job.id for job in failed)
+    if not job_ids:
+        print('Please provide job ids or --batch, see `namesdao queue list`')
+        return
+    retried = queue.retry(job_ids)
+    print(f'{retried} failed job(s) put back in the queue; use `namesdao queue resume` to send them.')
+
+
+def cmd_track():
+    '''track command: Follow in-flight transactions until they confirm, fail or expire, printing an NDJSON event for each
+
+    Transaction ids come from the arguments, or else from the jobs of the job
+    queue that were submitted (of --batch, or of every batch). The wallet is
+    read once per new block for all of them together, and the jobs are marked
+    confirmed or failed. With --check-names, confirmed registrations are then
+    followed until their name resolves, and checked against the address they
+    were registered to.
+    '''
+    from optparse import OptionParser
+    import re
+
+    parser = OptionParser()
+    parser.add_option(
+        '--batch',
+        type='int',
+        help='Only track the submitted jobs of this batch of the job queue',
+    )
+    parser.add_option(
+        '--wallet-id',
+        default='1',
+        help='Wallet id of the transactions given as arguments (default 1, the XCH wallet)',
+    )
+    parser.add_option(
+        '--expire-blocks',
+        type='int',
+        default=TRACK_EXPIRE_BLOCKS,
+        help=f'Report a transaction expired if it is not confirmed after this many blocks (default {TRACK_EXPIRE_BLOCKS})',
+    )
+    parser.add_option(
+        '--poll-interval',
+        type='float',
+        default=TRACK_POLL_INTERVAL,
+        help=f'Seconds between checks for a new block (default {TRACK_POLL_INTERVAL})',
+    )
+    parser.add_option(
+        '--check-names',
+        action='store_true',
+        help='After a registration confirms, check that the name resolves to the address it was registered to',
+    )
+    _add_resolve_options(parser)
+    _add_wallet_options(parser)
+    options, args = parser.parse_args(sys.argv[3:])
+
+    if options.expire_blocks < 1 or options.poll_interval <= 0:
+        print('Please use positive numbers for --expire-blocks and --poll-interval')
+        return
+    invalid = [arg for arg in args if not re.fullmatch(r'(0x)?[0-9a-fA-F]{64}', arg)]
+    if invalid:
+        print('Please provide transaction ids as 64 hex digits: ' + ', '.join(invalid))
+        return
+
+    backend = _wallet_backend_from_options(options)
+    if backend is None:
+        return
+    queue = None
+    if args:
+        transactions = [TrackedTransaction(arg, options.wallet_id, None) for arg in args]
+    else:
+        queue = get_job_queue()
+        if queue is None:
+            return
+        batches = [options.batch] if options.batch is not None else [batch for batch, _, _, _ in queue.batches()]
+        jobs = [job for batch in batches for job in queue.jobs(batch, state=JOB_SUBMITTED)]
+        untracked = sum(not job.transaction_id for job in jobs)
+        if untracked:
+            print(f'{untracked} submitted job(s) have no transaction id and cannot be tracked', file=sys.stderr)
+        jobs = [job for job in jobs if job.transaction_id]
+        name_wallet_id = None
+        if any(job.payload.get('asset') == 'NAME' for job in jobs):
+            name_wallet_id = get_name_wallet_id(backend)
+            if not name_wallet_id:
+                print('Unable to determine NAME token wallet id, which the NAME token registrations were sent from')
+                return
+        transactions = [
+            TrackedTransaction(job.transaction_id, name_wallet_id if job.payload.get('asset') == 'NAME' else '1', job)
+            for job in jobs
+        ]
+    if not transactions:
+        print('No submitted transactions to track', file=sys.stderr)
+        return
+
+    print(f'Tracking {len(transactions)} transaction(s)', file=sys.stderr)
+    events = track_transactions(
+        transactions,
+        WalletBlockFeed(backend, options.poll_interval),
+        expire_blocks=options.expire_blocks,
+        check_names=options.check_names,
+        resolve_kwargs=_resolve_kwargs(options),
+    )
+    for event in events:
+        if queue is not None and 'job' in event:
+            if event['event'] == 'confirmed':
+                queue.settle(event['job'], JOB_CONFIRMED)
+            elif event['event'] == 'failed':
+                queue.settle(event['job'], JOB_FAILED, event['error'])
+            elif event['event'] == 'expired':
+                queue.settle(event['job'], JOB_FAILED, f'Not confirmed after {event["blocks"]} blocks; the wallet may still send it')
+        print(json.dumps(event), flush=True)
+
+
+def clvm_deserialize(blob):
+    '''Parse a serialized CLVM program into nested (first, rest) tuples and bytes atoms.'''
+    ops = ['parse']
+    values = []
+    pos = 0
+    while ops:
+        op = ops.pop()
+        if op == 'cons':
+            rest = values.pop()
+            values.append((values.pop(), rest))
+            continue
+        b = blob[pos]
+        if b == 0xff:
+            pos += 1
+            ops.extend(['cons', 'parse', 'parse'])
+            continue
+        if b == 0x80:
+            values.append(b'')
+            pos += 1
+            continue
+        if b <= 0x7f:
+            values.append(bytes([b]))
+            pos += 1
+            continue
+        # The number of leading 1 bits is the length of the size prefix.
+        prefix_len = 0
+        mask = 0x80
+        while b & mask:
+            prefix_len += 1
+            mask >>= 1
+        if prefix_len > 5:
+            raise ValueError('Invalid CLVM atom size')
+        size = int.from_bytes(bytes([b & (mask * 2 - 1)]) + blob[pos + 1:pos + prefix_len], 'big')
+        pos += prefix_len
+        if pos + size > len(blob):
+            raise ValueError('Truncated CLVM program')
+        values.append(blob[pos:pos + size])
+        pos += size
+    return values[0]
+
+
+def _clvm_list(sexp):
+    items = []
+    while isinstance(sexp, tuple):
+        items.append(sexp[0])
+        sexp = sexp[1]
+    return items
+
+
+def extract_name_records(coin_spends, registrars):
+    '''Yield (name, owner_puzzle_hash) records created by the given block spends.
+
+    A record is a CREATE_COIN condition in a spend of a registrar coin (one
+    whose puzzle hash is in registrars) with a `<name>.xch` memo; the created
+    coin's puzzle hash is the owner. Only standard transaction spends, whose
+    conditions are spelled out in the solution, are understood.
+    '''
+    for coin_spend in coin_spends:
+        if bytes.fromhex(coin_spend['coin']['puzzle_hash'].removeprefix('0x')) not in registrars:
+            continue
+        try:
+            solution = _clvm_list(clvm_deserialize(bytes.fromhex(coin_spend['solution'].removeprefix('0x'))))
+        except (ValueError, IndexError):
+            continue
+        if len(solution) < 2 or not isinstance(solution[1], tuple) or solution[1][0] != b'\x01':
+            continue
+        for condition in _clvm_list(solution[1][1]):
+            condition = _clvm_list(condition)
+            if len(condition) < 4 or condition[0] != b'\x33' or not isinstance(condition[1], bytes) or len(condition[1]) != 32:
+                continue
+            for memo in _clvm_list(condition[3]):
+                if isinstance(memo, bytes) and memo.endswith(b'.xch'):
+                    try:
+                        yield normalize_name(memo.decode('utf-8')), condition[1]
+                    except UnicodeDecodeError:
+                        pass
+
 
-    # Normalize name
-    name = name.lower()
+class OnchainIndex:
+    '''SQLite index of the Namesdao name records found on chain, with a block height checkpoint.
 
-    # Remove any permitted top-level suffix
-    suffixes = ['.xch', '.chia']
-    for suffix in suffixes:
-        if name.endswith(suffix):
-            name = name[:-len(suffix)]
-            break
+    Every record of a name is kept with the height it was found at, and the
+    newest one at or below the checkpoint is the name's current owner; so when
+    a reorg rolls back the blocks above some height, an update made in them
+    goes away and the owner before it is back.
+    '''
 
-    # This is the URL from which the resolving data will be downloaded.
-    urls = [
-        f'https://namesdaolookup.xchstorage.com/{name}.json',
-        f'https://storage1.xchstorage.cyou/names_lookup/{name}.json',
-    ]
-    signature_urls = [f'{u}.gpg' for u in urls]
+    def __init__(self, path=None):
+        import sqlite3
 
-    retries = 3
-    url_idx = 0
-    url = urls[url_idx]
-    signature_url = signature_urls[url_idx]
-    while retries > 0:
-        try:
-            request = Request(
-                url,
-                data=None,
+        if path is None:
+            path = os.path.join(get_data_dir(), ONCHAIN_INDEX_FILENAME)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._db:
+            # Column name -> its position in the primary key (0 if it isn't part of it).
+            primary_key = {row[1]: row[5] for row in self._db.execute('PRAGMA table_info(names)')}
+            # The first release kept only the latest record of each name.
+            migrate = primary_key.get('name') == 1 and not primary_key.get('height')
+            if migrate:
+                self._db.execute('DROP INDEX IF EXISTS names_height')
+                self._db.execute('ALTER TABLE names RENAME TO names_v1')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS names ('
+                ' name TEXT NOT NULL,'
+                ' puzzle_hash BLOB NOT NULL,'
+                ' height INTEGER NOT NULL,'
+                ' PRIMARY KEY (name, height))'
+            )
+            if migrate:
+                self._db.execute('INSERT INTO names (name, puzzle_hash, height) SELECT name, puzzle_hash, height FROM names_v1')
+                self._db.execute('DROP TABLE names_v1')
+            self._db.execute('CREATE INDEX IF NOT EXISTS names_height ON names (height)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoint ('
+                ' id INTEGER PRIMARY KEY CHECK (id = 0),'
+                ' height INTEGER NOT NULL,'
+                ' header_hash TEXT NOT NULL)'
             )
-            response = urlopen(request)
-        except HTTPError as err:
-            code = err.getcode()
-            if code in (403, 404):
-                url_idx += 1
-                if url_idx >= len(urls):
-                    print('We don\'t currently have this address registered in our cache.')
-                else:
-                    url = urls[url_idx]
-                    continue
-            else:
-                print('An error occurred while trying to resolve. Please try again.')
-                print(f'Error was: {err}')
-            return
-        except URLError:
-            retries -= 0 # TODO: subtract 1?
-            if retries <= 0:
-                print('An error occurred while trying to resolve. Please check your network connection and try again.')
-                break
-            else:
-                time.sleep(1)
-            continue
 
-        # Now we try to download the signature file.
-        signature_response = None
-        try:
-            request = Request(
-                signature_url,
-                data=None,
+    def checkpoint(self):
+        '''Return (height, header_hash) of the last indexed block, or None.'''
+        with self._lock:
+            return self._db.execute('SELECT height, header_hash FROM checkpoint').fetchone()
+
+    def apply(self, records, height, header_hash):
+        '''Store the (name, puzzle_hash, height) records found up to (and including) height, and move the checkpoint there.'''
+        with self._lock, self._db:
+            # Of two records of a name in one block, the later one wins.
+            self._db.executemany(
+                'INSERT OR REPLACE INTO names (name, puzzle_hash, height) VALUES (?, ?, ?)',
+                records,
             )
-            signature_response = urlopen(request)
-        except HTTPError as err:
-            code = err.getcode()
-            if code in (403, 404):
-                #print('WARNING: No signature.')
-                pass
-            else:
-                print('An error occurred while trying to download the signature file. Please try again.')
-                print(f'Error was: {err}')
-        except URLError:
-            print('An error occurred while trying to download the signature file. Please check your network connection and try again.')
-        break
-
-    message = response.read()
-    data = json.loads(message.decode('utf-8'))
-    if signature_response:
-        signature = signature_response.read()
-        if verify(message, signature):
-            print('Verified signature')
-        else:
-            print('WARNING: Aborting due to invalid signature.')
-            return
-    return data['address']
+            self._set_checkpoint(height, header_hash)
 
-def cmd_send_after_confirmation(safe_address, safe_amount, safe_fee, safe_memo, use_name_tokens=False):
-    cmd = [
-        'chia',
-        'wallet',
-        'send',
-        '-t',
-        safe_address,
-        '-a',
-        safe_amount,
-        '-m',
-        safe_fee,
-        '--override',
-    ]
+    def _set_checkpoint(self, height, header_hash):
+        self._db.execute(
+            'INSERT OR REPLACE INTO checkpoint (id, height, header_hash) VALUES (0, ?, ?)',
+            (height, header_hash),
+        )
 
-    if use_name_tokens:
-        wallet_id = cmd_determine_name_wallet_id()
-        if not wallet_id:
-            print('Unable to determine NAME token wallet id. Please specify an amount with `-a <amount>` to send XCH.')
-            return
-        print('NAME token wallet id is', wallet_id.decode('utf-8'))
-        cmd.extend([
-            '-i',
-            wallet_id,
-        ])
+    def rollback(self, height, header_hash):
+        '''Forget everything indexed above height (after a reorg), and move the checkpoint back to that block.'''
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM names WHERE height > ?', (height,))
+            self._set_checkpoint(height, header_hash)
+        # The reverse index can't tell which names went away; rebuild it when next needed.
+        forget_reverse_index()
 
-    if safe_memo is not None:
-        cmd.extend([
-            '-e',
-            safe_memo,
-        ])
+    def get(self, name):
+        '''Return (puzzle_hash, height) of the current record for name, or None.'''
+        with self._lock:
+            return self._db.execute(
+                'SELECT puzzle_hash, height FROM names'
+                ' WHERE name = ? AND height <= (SELECT height FROM checkpoint)'
+                ' ORDER BY height DESC LIMIT 1',
+                (normalize_name(name),),
+            ).fetchone()
 
-    if use_name_tokens:
-        print('Automatically choosing active wallet...')
-        ps = subprocess.Popen(('echo'), stdout=subprocess.PIPE)
-        subprocess.run(cmd, stdin=ps.stdout)
-        ps.wait()
-    else:
-        subprocess.run(cmd)
+    def lookup(self, name):
+        '''Resolve name from the index, as a ResolveResult.'''
+        name = normalize_name(name)
+        row = self.get(name)
+        if row is None:
+            checkpoint = self.checkpoint()
+            indexed = f' (indexed up to height {checkpoint[0]})' if checkpoint else ' (run `name index` first)'
+            return ResolveResult(name, None, RESOLVE_NOT_FOUND, f'{name}.xch has no record in the on-chain index{indexed}.')
+        return ResolveResult(name, encode_puzzle_hash(row[0]), RESOLVE_ONCHAIN, None)
 
+    def items(self):
+        '''Return (name, puzzle_hash) of the current record of every indexed name.'''
+        with self._lock:
+            # With MAX(), SQLite takes the bare columns from the row with the highest height.
+            rows = self._db.execute(
+                'SELECT name, puzzle_hash, MAX(height) FROM names'
+                ' WHERE height <= (SELECT height FROM checkpoint) GROUP BY name'
+            ).fetchall()
+        return [(name, puzzle_hash) for name, puzzle_hash, _ in rows]
 
-def cmd_determine_name_wallet_id():
-    '''Determine NAME wallet id from the Chia CLI
+    def sample_names(self, limit):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT name FROM names LIMIT ?', (limit,))]
 
-    The wallet id is used to pay with NAME tokens when registering a name.
-    '''
-    cmd = [
-        'chia',
-        'wallet',
-        'show',
-        #'-f',
-        #fingerprint,
-    ]
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(DISTINCT name) FROM names').fetchone()[0]
 
-    ps = subprocess.Popen(('echo'), stdout=subprocess.PIPE)
-    out = subprocess.check_output(cmd, stdin=ps.stdout)
-    ps.wait()
-    #print('out=', out)
-    match = re.search(rb'-Asset ID:\s+4c4380af7d15c896d9e6266f322ac494c398803032eef56f2ab65877956d007f\n\s+-Wallet ID:\s+(\d+)', out)
-    return match.group(1)
 
+_onchain_index = None
 
-class _Options:
-    pass
 
+def get_onchain_index():
+    global _onchain_index
+    if _onchain_index is None:
+        _onchain_index = OnchainIndex()
+    return _onchain_index
 
-def _cmd_send(name, address, options, name_token_amount=0):
-    # This is a shared method for processing operations that require sending chia.
-    if options.Fee is not None:
-        mojos = sanitize_number(options.Fee)
-        if mojos is None:
-            safe_fee = None
-        else:
-            safe_fee = str(int(mojos)*1e-12)
-    elif options.fee is not None:
-        safe_fee = sanitize_number12dec(options.fee)
-        if safe_fee is None:
-            mojos = None
-        else:
-            mojos = str(int(float(safe_fee)*1e12))
-    else:
-        safe_fee = '0.000000000001'
-        mojos = '1'
 
-    asset_name = 'XCH'
-    if name_token_amount:
-        # This means that NAME tokens will be sent instead of XCH.
-        safe_amount = name_token_amount
-        asset_name = 'NAME'
-    elif options.amount is None:
-        safe_amount = '0.000000000001'
-    else:
-        safe_amount = sanitize_number12dec(options.amount)
+class OnchainIndexer:
+    '''Follow a full node and index the Namesdao name records in each new block.
 
-    if float(safe_amount) == 0:
-        print('Please provide an amount higher than 0.000000000001 (10^-12) XCH')
-        return
+    Progress is checkpointed (by height and header hash) as blocks are indexed,
+    so a restart resumes where it stopped; if the checkpoint block was reorged
+    out, the last ONCHAIN_REORG_DEPTH blocks are indexed again. The first sync
+    needs a start height: there were no Namesdao records in the blocks before
+    the registrar's first spend, and indexing them takes hours.
+    '''
 
-    safe_address = sanitize_address(address)
-    if options.fee is not None and safe_fee is None:
-        if options.Fee is not None:
-            print('Please use a number to indicate the network transaction fee (in mojos)')
-        else:
-            print('Please use a number to indicate the network transaction fee (in XCH)')
-        return
+    def __init__(self, client, index, registrars=None, confirmations=ONCHAIN_CONFIRMATIONS, commit_every=100):
+        self.client = client
+        self.index = index
+        self.registrars = {decode_puzzle_hash(address) for address in (registrars or NAMESDAO_REGISTRARS)}
+        self.confirmations = confirmations
+        self.commit_every = commit_every
 
-    if safe_amount is None:
-        print('Please use a number to indicate the amount of XCH to send')
-        return
-    if safe_address is None:
-        print('Sorry, we don\'t have an address for that name.')
-        return
-
-    memo = options.memo
-
-    if memo and options.cloak:
-        # We encrypt the memo here if the cloak flag was set.
-        orig_memo = memo
-        hash = hashlib.sha256()
-        memo_payload = memo.encode('utf-8')
-        if INCLUDE_SALT:
-            # Here we append a secret to the memo_payload.
-            memo_payload += b':' + base64.b64encode(os.urandom(20))
-        encmemo = encrypt(memo_payload)
-        safe_memo = ':register:' + quote(encmemo)
-        print (f'Replaced {safe_memo} for {orig_memo}')
-    elif memo:
-        safe_memo = shlex.quote(memo)
-    else:
-        safe_memo = None
+    def _resume_height(self, start_height):
+        checkpoint = self.index.checkpoint()
+        if checkpoint is None:
+            if start_height is None:
+                raise ValueError('Nothing is indexed yet; a start height is needed, such as the height of the first Namesdao registration')
+            return start_height
+        height, header_hash = checkpoint
+        if self.client.get_block_record_by_height(height)['header_hash'] != header_hash:
+            height = max(0, height - ONCHAIN_REORG_DEPTH)
+            self.index.rollback(height, self.client.get_block_record_by_height(height)['header_hash'])
+        return height + 1
 
-    if options.yes:
-        cmd_send_after_confirmation(safe_address, safe_amount, safe_fee, safe_memo, use_name_tokens=bool(name_token_amount))
-        return
+    def sync(self, start_height=None, stop_height=None):
+        '''Index blocks from the checkpoint up to the confirmed peak (or stop_height).
 
-    if safe_memo:
-        memo_txt = f'a memo of "{safe_memo}" and'
-    else:
-        memo_txt = ''
+        start_height is where to start when nothing is indexed yet; raises
+        ValueError if it's needed and missing. Returns (blocks, records, seconds).
+        '''
+        started = time.monotonic()
+        height = self._resume_height(start_height)
+        peak = self.client.get_peak_height()
+        target = (peak or 0) - self.confirmations
+        if stop_height is not None:
+            target = min(target, stop_height)
 
-    print(
-        "Welcome to Namesdao wallet send\n"
-        "Namesdao, the Name Service for the Chia Blockchain\n"
-        "\n"
-        f"{name} maps to this XCH address: {safe_address}\n"
-        #f"AIR token has asset id 824c71e37ac660006e03f7884561e7a124d930460ae1506a9c234c06ebc6aa1d"
-        #f"and your current balance is: 10 AIR"
-        "\n"
-        f"Please confirm, send {safe_amount} {asset_name} to {name},\n"
-        f"with {memo_txt} network transaction fee of {mojos} mojos? (Y/n)"
-    )
-    if input() in ('Y', 'Yes', 'yes', 'y'):
-        cmd_send_after_confirmation(safe_address, safe_amount, safe_fee, safe_memo, use_name_tokens=bool(name_token_amount))
+        blocks = 0
+        found = 0
+        records = []
+        while height <= target:
+            block_record = self.client.get_block_record_by_height(height)
+            if block_record.get('timestamp') is not None:
+                # Only transaction blocks have spends.
+                for name, puzzle_hash in extract_name_records(self.client.get_block_spends(block_record['header_hash']), self.registrars):
+                    records.append((name, puzzle_hash, height))
+            blocks += 1
+            if blocks % self.commit_every == 0 or height == target:
+                self.index.apply(records, height, block_record['header_hash'])
+                if _reverse_index is not None:
+                    for name, puzzle_hash, _ in records:
+                        _reverse_index.update(name, puzzle_hash)
+                found += len(records)
+                records = []
+            height += 1
+        return blocks, found, time.monotonic() - started
 
 
-def cmd_send():
-    '''send command: Send XCH to the address that corresponds to the Namesdao name'''
+def cmd_index():
+    '''index command: Index the Namesdao name records on the Chia blockchain, from a full node.
+
+    Used by `wallet resolve --verify-onchain`. Indexing resumes from the last
+    checkpoint; with --follow it keeps indexing new blocks as they arrive.
+    '''
+    from optparse import OptionParser
 
     parser = OptionParser()
     parser.add_option(
-        '-a', '--amount',
-        help='How much chia to send, in XCH  [required]',
-    )
-    parser.add_option(
-        '-e', '--memo',
-        help='Additional memo for the transaction',
+        '--start-height',
+        type='int',
+        help='Height to start at when there is no checkpoint yet (required the first time)',
     )
     parser.add_option(
-        '-k', '--cloak',
-        action='store_true',
-        help='Encrypt memo',
+        '--stop-height',
+        type='int',
+        help='Stop after indexing this height',
     )
     parser.add_option(
-        '-m', '--fee',
-        help='Set the fees for the transaction, in XCH',
+        '--confirmations',
+        type='int',
+        default=ONCHAIN_CONFIRMATIONS,
+        help=f'Only index blocks this many blocks below the peak (default {ONCHAIN_CONFIRMATIONS})',
     )
     parser.add_option(
-        '-M', '--Fee',
-        help='Set the fees for the transaction, in mojos [takes precedence over --fee]',
+        '--follow',
+        action='store_true',
+        help='Keep indexing new blocks as they arrive',
     )
     parser.add_option(
-        '-y', '--yes',
-        action='store_true',
-        help='Execute without asking for confirmation',
+        '--interval',
+        type='float',
+        default=10,
+        help='Seconds between checks for new blocks with --follow (default 10)',
     )
     options, args = parser.parse_args(sys.argv[3:])
 
     try:
-        name = args[0]
-    except IndexError:
-        print('Please provide a name, e.g. hello.xch')
-        display_help()
+        client = FullNodeRpcClient()
+    except OSError as err:
+        print(f'Unable to use the full node RPC: {err}')
         return
-    # TODO: Improve help message re name/address. And give better error message in case no name is provided.
-    address = sanitize_address(name)
-    if not address:
-        address = resolve(name)
-        if address is None:
+    index = get_onchain_index()
+    if options.start_height is None and index.checkpoint() is None:
+        print('Nothing is indexed yet; please give the height to start at with --start-height')
+        return
+    indexer = OnchainIndexer(client, index, confirmations=options.confirmations)
+
+    while True:
+        try:
+            blocks, found, seconds = indexer.sync(options.start_height, options.stop_height)
+        except WalletRpcError as err:
+            print(f'Unable to index: {err}')
+            return
+        if blocks or not options.follow:
+            checkpoint = index.checkpoint()
+            rate = blocks / seconds if seconds else 0
+            print(
+                f'Indexed {blocks} blocks in {seconds:.1f}s ({rate:.1f} blocks/s), {found} name records; '
+                f'checkpoint at height {checkpoint[0] if checkpoint else "-"}, {len(index)} names indexed'
+            )
+            sample = index.sample_names(1000)
+            if sample:
+                started = time.perf_counter()
+                for name in sample:
+                    index.lookup(name)
+                print(f'Lookup latency: {(time.perf_counter() - started) / len(sample) * 1e6:.0f} µs')
+        if not options.follow:
             return
+        time.sleep(options.interval)
 
-    _cmd_send(name, address, options)
 
+def _download_snapshot(url):
+    '''Download a signed index file (url and url.gpg); returns its bytes, or None after printing why not.'''
+    from urllib.error import HTTPError, URLError
 
-def cmd_resolve():
-    '''resolve command: Show the XCH address for the given Namesdao name.
+    pool = get_connection_pool()
+    try:
+        _, _, data = pool.get(url)
+        _, _, signature = pool.get(f'{url}.gpg')
+    except HTTPError as err:
+        if err.getcode() in (403, 404):
+            return
+        print(f'An error occurred while downloading {err.url}: {err}')
+        return
+    except URLError as err:
+        print(f'An error occurred while downloading {url}. Please check your network connection and try again.')
+        return
+    if not verify(data, signature):
+        print(f'WARNING: Ignoring {url} due to an invalid signature.')
+        return
+    return data
 
-    We use this for simple testing.
+
+def _sync_snapshot(url, index, path):
+    '''Install the signed snapshot at url, or just its delta from the generation we already have.'''
+    import tempfile
+
+    data = None
+    if index is not None:
+        data = _download_snapshot(f'{url}.delta-{index.generation}')
+    if data is None:
+        data = _download_snapshot(url)
+        if data is None:
+            print(f'Unable to download a signed snapshot from {url}')
+            return
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(data)
+    try:
+        try:
+            snapshot = NameIndex(f.name)
+        except ValueError as err:
+            print(f'Invalid snapshot: {err}')
+            return
+        try:
+            flags = snapshot.flags | NameIndex.FLAG_VERIFIED
+            if snapshot.flags & NameIndex.FLAG_DELTA:
+                if index is None:
+                    print('Received a delta without a full snapshot to apply it to')
+                    return
+                # The names the delta doesn't touch are only as verified as the index they come from.
+                flags &= ~(NameIndex.FLAG_DELTA | NameIndex.FLAG_VERIFIED)
+                flags |= index.flags & NameIndex.FLAG_VERIFIED
+                count = NameIndex.write(path, NameIndex.merge(index, snapshot), snapshot.generation, flags, snapshot.created)
+                print(f'Applied {len(snapshot)} changes; {count} names indexed (generation {snapshot.generation})')
+            else:
+                count = NameIndex.write(path, snapshot, snapshot.generation, flags, snapshot.created)
+                print(f'{count} names indexed (generation {snapshot.generation})')
+        finally:
+            snapshot.close()
+    finally:
+        os.unlink(f.name)
+
+
+def cmd_sync():
+    '''sync command: Build or update the offline name index used by resolve().
+
+    With --snapshot, download a signed index snapshot (or only the delta since
+    the generation we have, published as <url>.delta-<generation>). With
+    --from-file, resolve the listed names and apply what changed to the index.
     '''
+    from optparse import OptionParser
 
     parser = OptionParser()
+    parser.add_option(
+        '--snapshot',
+        help='URL of a signed index snapshot to download',
+    )
+    parser.add_option(
+        '-f', '--from-file',
+        help='Resolve the names in this file (one per line, - for stdin) into the index',
+    )
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=RESOLVE_CONCURRENCY,
+        help=f'Number of names to resolve in parallel (default {RESOLVE_CONCURRENCY})',
+    )
+    parser.add_option(
+        '--hedge-delay',
+        type='float',
+        help=f'Seconds to wait for a mirror before also asking the next one (default {HEDGE_DELAY})',
+    )
     options, args = parser.parse_args(sys.argv[3:])
-    try:
-        name = args[0]
-    except IndexError:
-        print('Please provide a name')
-        display_help()
+    if bool(options.snapshot) == bool(options.from_file):
+        print('Please provide either --snapshot URL or --from-file FILE')
         return
-    address = resolve(name)
-    if address:
-        print(address)
 
+    path = os.path.join(get_data_dir(), NAME_INDEX_FILENAME)
+    index = get_name_index()
+
+    if options.snapshot:
+        _sync_snapshot(options.snapshot, index, path)
+        return
+
+    def names():
+        if options.from_file == '-':
+            yield from _read_names(sys.stdin)
+            return
+        with open(options.from_file) as f:
+            yield from _read_names(f)
+
+    updates = {}
+    resolved = set()
+    all_verified = True
+    failed = 0
+    started = time.time()
+    results = resolve_many(names(), concurrency=options.concurrency, refresh=True, hedge_delay=options.hedge_delay, use_daemon=False)
+    for result in results:
+        key = NameIndex.name_key(result.name)
+        if result.address is not None:
+            try:
+                puzzle_hash = decode_puzzle_hash(result.address)
+            except ValueError:
+                failed += 1
+                continue
+            all_verified = all_verified and result.status == RESOLVE_VERIFIED
+        elif result.status == RESOLVE_NOT_FOUND:
+            puzzle_hash = NameIndex.DELETED
+        else:
+            failed += 1
+            continue
+        resolved.add(key)
+        current = index.get_key(key) if index is not None else None
+        if current != (None if puzzle_hash == NameIndex.DELETED else puzzle_hash):
+            updates[key] = puzzle_hash
+
+    # The names that weren't resolved again are carried over from the old index, with its age and verification.
+    carried_over = index is not None and any(key not in resolved for key, _ in index)
+    flags = NameIndex.FLAG_VERIFIED if all_verified and (not carried_over or index.verified) else 0
+    generation = (index.generation if index is not None else 0) + 1
+    # The index is as old as its oldest record.
+    created = min(started, index.created) if carried_over else started
+    count = NameIndex.write(path, NameIndex.merge(index or [], sorted(updates.items())), generation, flags, created)
+    removed = sum(1 for puzzle_hash in updates.values() if puzzle_hash == NameIndex.DELETED)
+    print(f'{len(updates) - removed} names added or changed, {removed} removed, {failed} failed; {count} names indexed')
+
+
+def cmd_check():
+    '''check command: Screen candidate names for availability before registering them.
+
+    Candidates come from the arguments, a file (--from-file) or stdin (`-`),
+    and are normalized like `wallet resolve` does, skipping duplicates. They
+    are looked up concurrently, with at most --rate-limit mirror lookups per
+    second (cached and not-found-cached names don't count), and each prints a
+    `name<TAB>available|taken|error<TAB>fee` line as soon as it's known, in
+    input order. The fee is the NAME token fee get_name_token_fee() charges.
+    '''
+    from optparse import OptionParser
 
-def cmd_register():
     parser = OptionParser()
     parser.add_option(
-        '-a', '--amount',
-        help='How much chia to send, in XCH. If no amount is provided, then NAME tokens will be sent',
-    )
-    parser.add_option(
-        '-k', '--cloak',
-        action='store_true',
-        help='Encrypt memo',
+        '-f', '--from-file',
+        help='Read candidate names from a file, one per line',
     )
     parser.add_option(
-        '-m', '--fee',
-        help='Set the fees for the transaction, in XCH',
+        '-c', '--concurrency',
+        type='int',
+        default=CHECK_CONCURRENCY,
+        help=f'Number of names to check in parallel (default {CHECK_CONCURRENCY})',
     )
     parser.add_option(
-        '-M', '--Fee',
-        help='Set the fees for the transaction, in mojos [takes precedence over --fee]',
+        '--rate-limit',
+        type='float',
+        default=CHECK_RATE_LIMIT,
+        help=f'Maximum mirror lookups per second, 0 for no limit (default {CHECK_RATE_LIMIT})',
     )
     parser.add_option(
-        '-y', '--yes',
+        '--available-only',
         action='store_true',
-        help='Execute without asking for confirmation',
+        help='Only print the names that are available',
     )
+    _add_resolve_options(parser)
     options, args = parser.parse_args(sys.argv[3:])
-    try:
-        name, address = args
-    except ValueError:
-        print('Please provide a name and a recipient address or name')
-        print('Sample usage:')
-        print('python namesdao.py name register nameToRegister.xch xchaddresstoregister -m 0.0000000001')
-        print('python namesdao.py name register ___nameToRegister.xch xchaddresstoregister -a 0.000000000001 -m 0.0000000001')
-        print('python namesdao.py name register ___nameToRegister.xch xchaddresstoregister --cloak -a 0.000000000001 -m 0.0000000001')
+
+    if not args and not options.from_file:
+        print('Please provide names to check')
+        display_help()
+        return
+    if options.concurrency < 1 or options.rate_limit < 0:
+        print('Please use a positive number for --concurrency and --rate-limit')
         return
 
-    memo = f'{name}:{address}'
-    opts = _Options()
-    opts.memo = memo
-    opts.cloak = options.cloak
-    opts.yes = options.yes
-    opts.amount = options.amount
-    opts.fee = options.fee
-    opts.Fee = options.Fee
+    def lines():
+        for arg in args:
+            if arg == '-':
+                yield from sys.stdin
+            else:
+                yield arg
+        if options.from_file:
+            with open(options.from_file) as f:
+                yield from f
 
-    if not options.amount:
-        fee=get_name_token_fee(name)
-        if fee:
-            _cmd_send('namesdao.xch', RECIPIENT_ADDRESS, opts, name_token_amount=fee)
-            return
+    def candidates():
+        seen = set()
+        for name in _read_names(lines()):
+            name = normalize_name(name)
+            if name not in seen:
+                seen.add(name)
+                yield name
 
-    _cmd_send('namesdao.xch', RECIPIENT_ADDRESS, opts)
+    kwargs = _resolve_kwargs(options)
+    if options.rate_limit:
+        kwargs['rate_limiter'] = RateLimiter(options.rate_limit)
+    counts = {'available': 0, 'taken': 0, 'error': 0}
+    started = time.monotonic()
+    # Resolve in-process, so the rate limit covers every mirror lookup.
+    for result in resolve_many(candidates(), concurrency=options.concurrency, use_daemon=False, **kwargs):
+        if result.address is not None:
+            availability = 'taken'
+        elif result.status == RESOLVE_NOT_FOUND:
+            availability = 'available'
+        else:
+            availability = 'error'
+        counts[availability] += 1
+        if options.available_only and availability != 'available':
+            continue
+        fee = get_name_token_fee(result.name)
+        print(f'{result.name}\t{availability}\t{f"{fee} NAME" if fee else "free"}', flush=True)
+
+    elapsed = time.monotonic() - started
+    checked = sum(counts.values())
+    print(
+        f'Checked {checked} names in {elapsed:.1f}s ({checked / elapsed if elapsed else 0:.0f}/s): '
+        f'{counts["available"]} available, {counts["taken"]} taken, {counts["error"]} errors',
+        file=sys.stderr,
+    )
+    summary = _format_revalidation_stats()
+    if summary:
+        print(summary, file=sys.stderr)
 
 
 def get_name_token_fee(name):
@@ -645,15 +5244,177 @@ def get_name_token_fee(name):
     return '5'
 
 
+def cmd_serve():
+    '''serve command: Run a resolver daemon with a local HTTP API.
+
+    The daemon keeps resolved names in memory, reuses its mirror connections
+    and gpg context, and answers:
+
+        GET /resolve/<name>[?refresh=1]       -> {"name", "address", "status", "detail"}
+        POST /resolve {"names": [...]}         -> {"results": [...]}
+        GET /reverse/<address>                -> {"address", "names"}
+        POST /reverse {"addresses": [...]}     -> {"results": [...]}
+        GET /health
+        GET /metrics                          -> Prometheus text format
+
+    It listens on --host/--port, or on a Unix socket with --socket. Every
+    request needs an `Authorization: Bearer <token>` header with the random
+    token the daemon writes to serve.json (readable only by its owner) in the
+    data directory, except GET /metrics on a loopback address or a Unix
+    socket, so that a local Prometheus can scrape it. While it is running,
+    `wallet resolve` and `wallet send` use it automatically.
+    '''
+    from http.server import ThreadingHTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    import atexit
+    import ipaddress
+    import secrets
+    import signal
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option(
+        '--host',
+        default=DAEMON_HOST,
+        help=f'Address to listen on (default {DAEMON_HOST})',
+    )
+    parser.add_option(
+        '--port',
+        type='int',
+        default=DAEMON_PORT,
+        help=f'Port to listen on (default {DAEMON_PORT})',
+    )
+    parser.add_option(
+        '--socket',
+        help='Listen on this Unix socket instead of a TCP port',
+    )
+    parser.add_option(
+        '--memory-cache-size',
+        type='int',
+        default=DAEMON_CACHE_SIZE,
+        help=f'Number of names to keep in memory (default {DAEMON_CACHE_SIZE})',
+    )
+    parser.add_option(
+        '--no-cache',
+        action='store_true',
+        help='Do not use the local resolution cache (the in-memory cache is still used)',
+    )
+    parser.add_option(
+        '--cache-ttl',
+        type='int',
+        default=CACHE_TTL,
+        help=f'Seconds a cached name record stays valid (default {CACHE_TTL})',
+    )
+    parser.add_option(
+        '--not-found-ttl',
+        type='int',
+        default=NOT_FOUND_TTL,
+        help=f'Seconds an unregistered name stays cached as not found (default {NOT_FOUND_TTL})',
+    )
+    parser.add_option(
+        '--stale-while-revalidate',
+        type='int',
+        default=STALE_WHILE_REVALIDATE,
+        help=(
+            'Answer from a cached record up to this many seconds after it expired, and revalidate it '
+            f'in the background (default {STALE_WHILE_REVALIDATE}, 0 to disable)'
+        ),
+    )
+    parser.add_option(
+        '--hedge-delay',
+        type='float',
+        help=f'Seconds to wait for a mirror before also asking the next one (default {HEDGE_DELAY})',
+    )
+    options, args = parser.parse_args(sys.argv[2:])
+
+    memory_cache = LruCache(options.memory_cache_size, options.cache_ttl)
+    get_reverse_index()
+    enable_metrics()
+    token = secrets.token_hex(DAEMON_TOKEN_BYTES)
+    try:
+        loopback = ipaddress.ip_address(options.host).is_loopback
+    except ValueError:
+        loopback = options.host == 'localhost'
+    handler = _make_daemon_handler(memory_cache, dict(
+        use_cache=not options.no_cache,
+        cache_ttl=options.cache_ttl,
+        not_found_ttl=options.not_found_ttl,
+        stale_while_revalidate=options.stale_while_revalidate,
+        hedge_delay=options.hedge_delay,
+    ), token, open_metrics=bool(options.socket) or loopback)
+
+    if options.socket:
+        class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(options.socket):
+            os.unlink(options.socket)
+        server = ThreadingUnixHTTPServer(options.socket, handler)
+        state = {'pid': os.getpid(), 'socket': os.path.abspath(options.socket), 'token': token}
+        where = options.socket
+    else:
+        server = ThreadingHTTPServer((options.host, options.port), handler)
+        server.daemon_threads = True
+        host, port = server.server_address[:2]
+        state = {'pid': os.getpid(), 'host': host, 'port': port, 'token': token}
+        where = f'http://{host}:{port}'
+
+    # Parse the Namesdao key now rather than on the first signed record.
+    get_signature_verifier()
+
+    state_path = os.path.join(get_data_dir(), DAEMON_STATE_FILENAME)
+    # The token is a secret: create the file owner-only, and tighten an existing one before writing it.
+    fd = os.open(state_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with open(fd, 'w') as f:
+        json.dump(state, f)
+
+    def cleanup():
+        try:
+            with open(state_path) as f:
+                if json.load(f).get('pid') == os.getpid():
+                    os.unlink(state_path)
+        except (OSError, ValueError):
+            pass
+        if options.socket and os.path.exists(options.socket):
+            os.unlink(options.socket)
+
+    atexit.register(cleanup)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    print(f'Namesdao resolver listening on {where}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 # Used to point to the method to process the command
 cmd_dict = {
     'wallet': {
         'send': cmd_send,
         'resolve': cmd_resolve,
+        'reverse': cmd_reverse,
+        'warm': cmd_warm,
+        'send-batch': cmd_send_batch,
+        'track': cmd_track,
     },
     'name': {
         'register': cmd_register,
+        'register-batch': cmd_register_batch,
+        'sync': cmd_sync,
+        'index': cmd_index,
+        'check': cmd_check,
+    },
+    'queue': {
+        'status': cmd_queue_status,
+        'list': cmd_queue_list,
+        'resume': cmd_queue_resume,
+        'retry': cmd_queue_retry,
     },
+    'serve': cmd_serve,
 }
 
 
@@ -663,8 +5424,23 @@ def display_help():
         "python namesdao.py wallet send $address -a $amount -m $fee\n"
         "python namesdao.py wallet send hellobilly.xch -a 0.000000000001 -m 0.000000000002\n"
         "python namesdao.py wallet resolve $address\n"
+        "python namesdao.py wallet send-batch payouts.csv -m $fee [--chunk-size 100]\n"
+        "python namesdao.py wallet resolve $name1 $name2 ... [--from-file names.txt] [--concurrency 16]\n"
         "python namesdao.py name register ___nameToRegister.xch xchaddresstoregister -a 0.000000000001 -m 0.0000000001\n"
         "python namesdao.py name register ___nameToRegister.xch xchaddresstoregister --cloak -a 0.000000000001 -m 0.0000000001\n"
+        "python namesdao.py name register-batch names.csv [--cloak] [-m $fee] [--concurrency 4] [--output results.csv]\n"
+        "python namesdao.py name sync --from-file names.txt | --snapshot $url\n"
+        "python namesdao.py name index [--start-height HEIGHT] [--follow]\n"
+        "python namesdao.py name check $name1 $name2 ... [--from-file candidates.txt] [--rate-limit 100]\n"
+        "python namesdao.py wallet resolve $name --verify-onchain\n"
+        "python namesdao.py wallet reverse $xchaddress ... [--from-file addresses.txt]\n"
+        "python namesdao.py wallet warm $name1 $name2 ... [--from-file contacts.txt] [--interval 300]\n"
+        "python namesdao.py wallet track [$transaction_id ...] [--batch $batch] [--check-names]\n"
+        "python namesdao.py queue status [--all]\n"
+        "python namesdao.py queue list $batch [--state failed]\n"
+        "python namesdao.py queue resume [$batch ...] [--concurrency 4]\n"
+        "python namesdao.py queue retry $job1 $job2 ... | --batch $batch\n"
+        "python namesdao.py serve [--host 127.0.0.1] [--port 8477] [--socket /path/to/socket]\n"
         "\n"
         "Options:\n"
         "  First argument is the address to send the XCH  [required]\n"
@@ -674,19 +5450,48 @@ def display_help():
         "  -m, --fee TEXT                  Set the fees for the transaction, in XCH\n"
         "  -M, --Fee TEXT                  Set the fees for the transaction, in mojos [takes precedence over --fee]\n"
         "  -y, --yes                       Execute without asking for confirmation\n"
+        "  --no-cache                      Do not use the local resolution cache\n"
+        "  --refresh                       Download the name record again, even if it is cached\n"
+        "  --cache-ttl SECONDS             Seconds a cached name record stays valid\n"
+        "  --not-found-ttl SECONDS         Seconds an unregistered name stays cached as not found\n"
+        "  --stale-while-revalidate SECONDS  Answer from an expired cached record and revalidate it in the background\n"
+        "  --hedge-delay SECONDS           Seconds to wait for a mirror before also asking the next one\n"
+        "  --verify-onchain                Resolve from the on-chain index built by `name index`\n"
+        "  --backend auto|rpc|cli          How to talk to the wallet (default auto: the wallet RPC if it's running)\n"
+        "  --fingerprint FINGERPRINT       Fingerprint of the wallet key to use (default: the active key)\n"
+        "  --trace[=FILE]                  Write timing spans as json lines to stderr (or FILE)\n"
         "  -h, --help                      Show this message and exit.\n"
     )
 
+
+def _enable_tracing_from_argv():
+    '''Handle the global --trace[=FILE] option (or NAMESDAO_TRACE), removing it from sys.argv.'''
+    path = TRACE
+    for arg in sys.argv[1:]:
+        if arg == '--trace' or arg.startswith('--trace='):
+            path = arg.partition('=')[2] or '-'
+            sys.argv.remove(arg)
+            break
+    if path:
+        enable_tracing(path)
+
+
 # processing starts here
 def main():
+    _enable_tracing_from_argv()
     try:
-        if sys.argv[1] not in ('wallet', 'name'):
+        if sys.argv[1] not in cmd_dict:
             display_help()
             return
     except IndexError:
         display_help()
         return
 
+    if callable(cmd_dict[sys.argv[1]]):
+        # a top-level command, such as "serve"
+        cmd_dict[sys.argv[1]]()
+        return
+
     try:
         # see if we have a clear "send" or "resolve" command on the command line, if so proceed
         cmd = cmd_dict[sys.argv[1]][sys.argv[2]] # TODO test change of [1] to [2]
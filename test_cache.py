@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+
+import namesdao
+
+MESSAGE = b'{"address": "%s"}' % namesdao.RECIPIENT_ADDRESS.encode('ascii')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = namesdao.ResolveCache(str(tmp_path / 'cache.sqlite3'), ttl=3600, max_entries=100, not_found_ttl=300)
+    yield cache
+    cache.close()
+
+
+def age(cache, name, seconds):
+    '''Pretend the entry for name was fetched seconds earlier than it was.'''
+    with cache._db:
+        cache._db.execute('UPDATE records SET fetched_at = fetched_at - ? WHERE name = ?', (seconds, name))
+
+
+def test_put_get(cache):
+    cache.put('alice', MESSAGE, b'sig', True, etag='"1"', last_modified='Sat, 01 Jan 2022 00:00:00 GMT', mirror='http://mirror')
+    record = cache.get('alice')
+    assert record == namesdao.CachedRecord(MESSAGE, b'sig', True, '"1"', 'Sat, 01 Jan 2022 00:00:00 GMT', 'http://mirror', 0)
+    assert cache.get('bob') is None
+
+
+def test_unsigned_record_keeps_verified_none(cache):
+    cache.put('alice', MESSAGE, None, None)
+    assert cache.get('alice').verified is None
+
+
+def test_expired_record(cache):
+    cache.put('alice', MESSAGE, None, None)
+    age(cache, 'alice', 3700)
+    assert cache.get('alice') is None
+    assert cache.get('alice', max_stale=60) is None
+    record = cache.get('alice', max_stale=3600)
+    assert record.message == MESSAGE
+    assert 99 <= record.stale_for <= 101
+    assert cache.get('alice', max_stale=None).stale_for == pytest.approx(record.stale_for, abs=1)
+
+
+def test_touch_makes_record_fresh(cache):
+    cache.put('alice', MESSAGE, None, None)
+    age(cache, 'alice', 3700)
+    cache.touch('alice')
+    assert cache.get('alice').stale_for == 0
+
+
+def test_not_found_row(cache):
+    cache.put_not_found('nobody')
+    record = cache.get('nobody')
+    assert record.message == namesdao.ResolveCache.NOT_FOUND
+    assert (record.signature, record.verified, record.etag, record.mirror) == (None, None, None, None)
+
+
+def test_not_found_row_expires_after_not_found_ttl(cache):
+    cache.put('alice', MESSAGE, None, None)
+    cache.put_not_found('nobody')
+    age(cache, 'alice', 600)
+    age(cache, 'nobody', 600)
+    # Older than not_found_ttl, but not than ttl: only the negative entry expired.
+    assert cache.get('nobody') is None
+    assert cache.get('alice') is not None
+    assert cache.get('nobody', max_stale=None).stale_for == pytest.approx(300, abs=1)
+    assert cache.expires_at('nobody') == pytest.approx(cache.expires_at('alice') - 3300, abs=1)
+
+
+def test_registered_name_replaces_not_found_row(cache):
+    cache.put_not_found('alice')
+    cache.put('alice', MESSAGE, None, None)
+    assert cache.get('alice').message == MESSAGE
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = namesdao.ResolveCache(str(tmp_path / 'cache.sqlite3'), max_entries=2)
+    try:
+        cache.put('alice', MESSAGE, None, None)
+        cache.put('bob', MESSAGE, None, None)
+        with cache._db:
+            cache._db.execute('UPDATE records SET accessed_at = accessed_at - 10')
+        cache.get('alice')
+        cache.put('carol', MESSAGE, None, None)
+        assert sorted(name for name, _ in cache.items()) == ['alice', 'carol']
+    finally:
+        cache.close()
+
+
+def test_adds_validator_columns_to_an_old_cache(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    db = sqlite3.connect(path)
+    with db:
+        # The records table as the first release created it, before conditional revalidation.
+        db.execute(
+            'CREATE TABLE records ('
+            ' name TEXT PRIMARY KEY,'
+            ' message BLOB NOT NULL,'
+            ' signature BLOB,'
+            ' verified INTEGER,'
+            ' fetched_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        db.execute("INSERT INTO records VALUES ('alice', ?, x'01', 1, strftime('%s', 'now'), strftime('%s', 'now'))", (MESSAGE,))
+    db.close()
+
+    cache = namesdao.ResolveCache(path)
+    try:
+        columns = {row[1] for row in cache._db.execute('PRAGMA table_info(records)')}
+        assert set(namesdao.ResolveCache.VALIDATOR_COLUMNS) <= columns
+        record = cache.get('alice')
+        assert (record.message, record.signature, record.verified) == (MESSAGE, b'\x01', True)
+        assert (record.etag, record.last_modified, record.mirror) == (None, None, None)
+        cache.put('bob', MESSAGE, None, None, etag='"2"', mirror='http://mirror')
+        assert cache.get('bob').etag == '"2"'
+    finally:
+        cache.close()
+
+    # Opening the migrated cache again leaves it alone.
+    namesdao.ResolveCache(path).close()
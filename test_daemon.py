@@ -0,0 +1,66 @@
+from http.server import ThreadingHTTPServer
+import http.client
+import json
+import threading
+
+import pytest
+
+import namesdao
+
+TOKEN = 'secret'
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    '''Start a resolver daemon handler on a loopback port; returns a function making (status, body) requests to it.'''
+    monkeypatch.setattr(namesdao, '_metrics', namesdao.Metrics())
+    servers = []
+
+    def start(open_metrics):
+        handler = namesdao._make_daemon_handler(namesdao.LruCache(10, 60), {}, TOKEN, open_metrics=open_metrics)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        def get(path, token=None):
+            conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+            try:
+                conn.request('GET', path, headers={'Authorization': f'Bearer {token}'} if token else {})
+                response = conn.getresponse()
+                return response.status, response.read()
+            finally:
+                conn.close()
+
+        return get
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_metrics_need_the_token_unless_open(daemon):
+    get = daemon(open_metrics=False)
+    assert get('/metrics')[0] == 403
+    assert get('/metrics', TOKEN)[0] == 200
+
+    get = daemon(open_metrics=True)
+    assert get('/metrics')[0] == 200
+    # Only the metrics are open.
+    status, body = get('/health')
+    assert (status, json.loads(body)) == (403, {'error': 'Missing or wrong token'})
+    assert get('/health', TOKEN)[0] == 200
+
+
+def test_enable_tracing_to_a_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(namesdao, '_tracer', None)
+    path = tmp_path / 'trace.jsonl'
+    tracer = namesdao.enable_tracing(str(path))
+    try:
+        with namesdao.trace_span('verify', name='alice'):
+            pass
+        span = json.loads(path.read_text())
+        assert (span['phase'], span['name'], span['trace']) == ('verify', 'alice', tracer.trace_id)
+    finally:
+        tracer._out.close()
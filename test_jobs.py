@@ -0,0 +1,197 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import namesdao
+
+# Enqueue five registrations, send two, and die while the third is with the wallet.
+CRASHING_RUN = '''
+import os
+import sys
+
+import namesdao
+
+queue = namesdao.JobQueue(sys.argv[1])
+batch = queue.create_batch('register', [{payload}] * 5, source='names.csv', digest='digest')
+for _ in range(2):
+    job = queue.claim(batch)
+    queue.finish(job.id, '0x' + bytes([job.seq]).hex() * 32)
+queue.claim(batch)
+os._exit(1)
+'''
+
+
+def payload(name='alice', asset='XCH'):
+    return {
+        'name': name,
+        'target': namesdao.RECIPIENT_ADDRESS,
+        'address': namesdao.RECIPIENT_ADDRESS,
+        'amount': '0.000000000001',
+        'asset': asset,
+        'fee': '0.000000000001',
+        'memo': f'{name}.xch:{namesdao.RECIPIENT_ADDRESS}',
+    }
+
+
+class RecordingWallet:
+    '''A wallet backend that records the memo of every send; sends of the memos in fail are refused.'''
+
+    name = 'recording'
+
+    def __init__(self, fail=(), uncertain=(), name_wallet_id='2'):
+        self.fail = set(fail)
+        self.uncertain = set(uncertain)
+        self.name_wallet_id = name_wallet_id
+        self.sent = []
+
+    def get_fingerprint(self):
+        return 1
+
+    def get_name_wallet_id(self):
+        return self.name_wallet_id
+
+    def is_name_wallet(self, wallet_id):
+        return wallet_id == self.name_wallet_id
+
+    def send(self, safe_address, safe_amount, safe_fee, safe_memo, wallet_id=None):
+        self.sent.append(safe_memo)
+        if safe_memo in self.uncertain:
+            raise namesdao.WalletRpcUncertain('No answer from the wallet')
+        if safe_memo in self.fail:
+            raise namesdao.SendError('The wallet rejected the transaction: not enough coins')
+        return '0x' + bytes([len(self.sent)]).hex() * 32
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = namesdao.JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    yield queue
+    queue.close()
+
+
+def test_jobs_are_claimed_in_order(queue):
+    batch = queue.create_batch('register', [payload(name) for name in ('alice', 'bob', 'carol')])
+    assert queue.counts(batch) == {namesdao.JOB_PENDING: 3}
+    first = queue.claim(batch)
+    assert (first.seq, first.kind, first.payload['name'], first.state) == (1, 'register', 'alice', namesdao.JOB_SUBMITTING)
+    assert queue.finish(first.id, '0x01') == namesdao.JOB_SUBMITTED
+    second = queue.claim(batch)
+    assert queue.finish(second.id, error='rejected') == namesdao.JOB_FAILED
+    assert queue.claim(batch).payload['name'] == 'carol'
+    assert queue.claim(batch) is None
+    assert [(job.seq, job.state, job.transaction_id, job.error) for job in queue.jobs(batch, page_size=2)] == [
+        (1, namesdao.JOB_SUBMITTED, '0x01', None),
+        (2, namesdao.JOB_FAILED, None, 'rejected'),
+        (3, namesdao.JOB_SUBMITTING, None, None),
+    ]
+    assert [job.seq for job in queue.jobs(batch, state=namesdao.JOB_FAILED)] == [2]
+
+
+def test_unfinished_batches(queue):
+    done = queue.create_batch('send', [{'fee': 1}], digest='done')
+    queue.finish(queue.claim(done).id, '0x01')
+    queue.settle(next(queue.jobs(done)).id, namesdao.JOB_CONFIRMED)
+    unfinished = queue.create_batch('send', [{'fee': 1}, {'fee': 1}], digest='unfinished')
+    queue.finish(queue.claim(unfinished).id, '0x02')
+    failed = queue.create_batch('register', [payload()], digest='failed')
+    queue.finish(queue.claim(failed).id, error='rejected')
+
+    assert queue.unfinished_batch('done') is None
+    assert queue.unfinished_batch('unfinished') == unfinished
+    assert queue.unfinished_batch('failed') == failed
+    assert queue.unfinished_batch('unknown') is None
+    assert [row[0] for row in queue.batches()] == [done, unfinished, failed]
+    assert [row[0] for row in queue.batches(unfinished_only=True)] == [unfinished, failed]
+
+
+def test_release_and_retry(queue):
+    batch = queue.create_batch('register', [payload()])
+    job = queue.claim(batch)
+    queue.release(job.id)
+    job = queue.claim(batch)
+    queue.finish(job.id, error='rejected')
+    assert queue.retry([job.id]) == 1
+    assert queue.claim(batch).id == job.id
+
+
+def test_run_jobs(queue):
+    batch = queue.create_batch('register', [payload(name) for name in ('alice', 'bob', 'carol', 'dave')])
+    wallet = RecordingWallet(fail={payload('bob')['memo']})
+    jobs = list(namesdao.run_jobs(queue, batch, wallet, concurrency=2))
+    assert [(job.payload['name'], job.state, job.error) for job in jobs] == [
+        ('alice', namesdao.JOB_SUBMITTED, None),
+        ('bob', namesdao.JOB_FAILED, 'The wallet rejected the transaction: not enough coins'),
+        ('carol', namesdao.JOB_SUBMITTED, None),
+        ('dave', namesdao.JOB_SUBMITTED, None),
+    ]
+    assert sorted(wallet.sent) == sorted(payload(name)['memo'] for name in ('alice', 'bob', 'carol', 'dave'))
+    assert queue.counts(batch) == {namesdao.JOB_SUBMITTED: 3, namesdao.JOB_FAILED: 1}
+
+
+def test_run_jobs_stop_on_failure(queue):
+    batch = queue.create_batch('register', [payload(name) for name in ('alice', 'bob', 'carol')])
+    wallet = RecordingWallet(fail={payload('alice')['memo']})
+    jobs = list(namesdao.run_jobs(queue, batch, wallet, stop_on_failure=True))
+    assert [job.state for job in jobs] == [namesdao.JOB_FAILED]
+    assert queue.counts(batch) == {namesdao.JOB_FAILED: 1, namesdao.JOB_PENDING: 2}
+
+
+def test_run_jobs_does_not_resend_an_uncertain_send(queue):
+    batch = queue.create_batch('register', [payload(name) for name in ('alice', 'bob')])
+    wallet = RecordingWallet(uncertain={payload('alice')['memo']})
+    jobs = list(namesdao.run_jobs(queue, batch, wallet))
+    assert [(job.state, job.error) for job in jobs] == [(namesdao.JOB_FAILED, namesdao.JOB_INTERRUPTED), (namesdao.JOB_SUBMITTED, None)]
+    assert list(namesdao.run_jobs(queue, batch, wallet)) == []
+    assert wallet.sent == [payload('alice')['memo'], payload('bob')['memo']]
+
+
+def test_run_jobs_without_a_name_wallet(queue):
+    batch = queue.create_batch('register', [payload('alice'), payload('bob', asset='NAME'), payload('carol')])
+    wallet = RecordingWallet(name_wallet_id=None)
+    jobs = []
+    with pytest.raises(namesdao.SendError, match='NAME token wallet id'):
+        for job in namesdao.run_jobs(queue, batch, wallet):
+            jobs.append(job)
+    assert [job.payload['name'] for job in jobs] == ['alice']
+    # Nothing was sent for bob; the rest of the batch is left for a later run.
+    assert wallet.sent == [payload('alice')['memo']]
+    assert queue.counts(batch) == {namesdao.JOB_SUBMITTED: 1, namesdao.JOB_PENDING: 2}
+
+
+def test_resume_after_a_crash(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    run = subprocess.run(
+        [sys.executable, '-c', CRASHING_RUN.replace('{payload}', repr(payload())), path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, NAMESDAO_DATA_DIR=str(tmp_path / 'data')),
+        capture_output=True,
+        text=True,
+    )
+    assert run.returncode == 1, run.stderr
+
+    queue = namesdao.JobQueue(path)
+    try:
+        batch = queue.unfinished_batch('digest')
+        assert batch is not None
+        assert queue.counts(batch) == {namesdao.JOB_SUBMITTED: 2, namesdao.JOB_SUBMITTING: 1, namesdao.JOB_PENDING: 2}
+
+        # The interrupted job may have reached the wallet: it's failed, not sent again.
+        assert queue.recover(batch) == 1
+        interrupted, = queue.jobs(batch, state=namesdao.JOB_FAILED)
+        assert (interrupted.seq, interrupted.error) == (3, namesdao.JOB_INTERRUPTED)
+        wallet = RecordingWallet()
+        jobs = list(namesdao.run_jobs(queue, batch, wallet))
+        assert [job.seq for job in jobs] == [4, 5]
+        assert len(wallet.sent) == 2
+        assert queue.counts(batch) == {namesdao.JOB_SUBMITTED: 4, namesdao.JOB_FAILED: 1}
+        assert queue.recover(batch) == 0
+
+        # Once it's known not to have gone out, `queue retry` sends it.
+        assert queue.retry([interrupted.id]) == 1
+        assert [job.seq for job in namesdao.run_jobs(queue, batch, wallet)] == [3]
+        assert queue.counts(batch) == {namesdao.JOB_SUBMITTED: 5}
+        assert queue.unfinished_batch('digest') is None
+    finally:
+        queue.close()
@@ -0,0 +1,196 @@
+import json
+import time
+
+import pytest
+
+import namesdao
+from bench import StubMirror, _make_fixtures
+
+PRIMARY, SECONDARY = 'http://primary.invalid', 'http://secondary.invalid'
+
+
+@pytest.fixture
+def mirrors(monkeypatch):
+    '''Start two stub mirrors serving unsigned records for alice and bob, and point namesdao at them.'''
+    started = []
+
+    def start(*latencies_and_error_rates, fixtures=None):
+        fixtures = _make_fixtures(['alice', 'bob']) if fixtures is None else fixtures
+        for latency, error_rate in latencies_and_error_rates:
+            started.append(StubMirror(fixtures, latency, error_rate, seed=len(started)))
+        monkeypatch.setattr(namesdao, 'MIRRORS', [mirror.url for mirror in started])
+        monkeypatch.setattr(namesdao, '_backoff_delay', lambda attempt: 0)
+        return started
+
+    yield start
+    for mirror in started:
+        mirror.close()
+
+
+def test_mirror_health_circuit_opens_after_consecutive_failures():
+    health = namesdao.MirrorHealth()
+    assert health.state(PRIMARY) == health.CLOSED
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD - 1):
+        health.record_failure(PRIMARY)
+    assert health.state(PRIMARY) == health.CLOSED
+    health.record_success(PRIMARY, 0.1)
+    # A success resets the count.
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD - 1):
+        health.record_failure(PRIMARY)
+    assert health.state(PRIMARY) == health.CLOSED
+    health.record_failure(PRIMARY)
+    assert health.state(PRIMARY) == health.OPEN
+    assert health.order([PRIMARY, SECONDARY]) == [SECONDARY]
+
+
+def test_mirror_health_all_open_keeps_every_mirror():
+    health = namesdao.MirrorHealth()
+    for mirror in (PRIMARY, SECONDARY):
+        for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD):
+            health.record_failure(mirror)
+    assert sorted(health.order([PRIMARY, SECONDARY])) == [PRIMARY, SECONDARY]
+
+
+def test_mirror_health_half_open_after_cooldown():
+    health = namesdao.MirrorHealth()
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD):
+        health.record_failure(PRIMARY)
+    health._mirrors[PRIMARY]['opened_at'] -= namesdao.CIRCUIT_COOLDOWN
+    assert health.state(PRIMARY) == health.HALF_OPEN
+    assert PRIMARY in health.order([PRIMARY, SECONDARY])
+
+    # A failed probe opens the circuit again, for another cooldown.
+    health.record_failure(PRIMARY)
+    assert health.state(PRIMARY) == health.OPEN
+    assert health.order([PRIMARY, SECONDARY]) == [SECONDARY]
+
+    # A successful one closes it.
+    health._mirrors[PRIMARY]['opened_at'] -= namesdao.CIRCUIT_COOLDOWN
+    assert health.state(PRIMARY) == health.HALF_OPEN
+    health.record_success(PRIMARY, 0.1)
+    assert health.state(PRIMARY) == health.CLOSED
+    assert health._mirrors[PRIMARY]['failures'] == 0
+
+
+def test_mirror_health_half_open_probe_fails_below_threshold():
+    health = namesdao.MirrorHealth()
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD):
+        health.record_failure(PRIMARY)
+    health._mirrors[PRIMARY]['failures'] = 0
+    health._mirrors[PRIMARY]['opened_at'] -= namesdao.CIRCUIT_COOLDOWN
+    health.record_failure(PRIMARY)
+    assert health.state(PRIMARY) == health.OPEN
+
+
+def test_mirror_health_ranks_by_error_weighted_latency():
+    health = namesdao.MirrorHealth()
+    health.record_success(PRIMARY, 0.2)
+    health.record_success(SECONDARY, 0.1)
+    assert health.order([PRIMARY, SECONDARY]) == [SECONDARY, PRIMARY]
+    # Unknown mirrors keep their place at the front.
+    assert health.order(['http://new.invalid', PRIMARY, SECONDARY]) == ['http://new.invalid', SECONDARY, PRIMARY]
+    health.record_failure(SECONDARY)
+    health.record_failure(SECONDARY)
+    assert health.order([PRIMARY, SECONDARY]) == [PRIMARY, SECONDARY]
+
+
+def test_mirror_health_is_saved_and_loaded(tmp_path):
+    path = str(tmp_path / 'mirrors.json')
+    health = namesdao.MirrorHealth(path)
+    health.save()
+    assert not (tmp_path / 'mirrors.json').exists()
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD):
+        health.record_failure(PRIMARY)
+    health.record_success(SECONDARY, 0.1)
+    health.save()
+    assert set(json.loads((tmp_path / 'mirrors.json').read_text())) == {PRIMARY, SECONDARY}
+
+    loaded = namesdao.MirrorHealth(path)
+    assert loaded.state(PRIMARY) == loaded.OPEN
+    assert loaded.order([PRIMARY, SECONDARY]) == [SECONDARY]
+
+
+def test_mirror_health_ignores_a_broken_state_file(tmp_path):
+    (tmp_path / 'mirrors.json').write_text('{not json')
+    assert namesdao.MirrorHealth(str(tmp_path / 'mirrors.json')).order([PRIMARY, SECONDARY]) == [PRIMARY, SECONDARY]
+
+
+def test_fetch_record_from_primary(mirrors):
+    primary, secondary = mirrors((0, 0), (0, 0))
+    result = namesdao._fetch_record('alice', hedge_delay=5)
+    assert result.status is None
+    assert json.loads(result.message)['address'] == namesdao.RECIPIENT_ADDRESS
+    assert (result.signature, result.verified, result.mirror) == (None, None, primary.url)
+    assert secondary.requests == 0
+
+
+def test_fetch_record_hedges_a_slow_mirror(mirrors):
+    primary, secondary = mirrors((1.0, 0), (0, 0))
+    started = time.monotonic()
+    result = namesdao._fetch_record('alice', hedge_delay=0.05)
+    assert time.monotonic() - started < 0.5
+    assert result.status is None
+    assert result.mirror == secondary.url
+    assert primary.requests >= 1
+
+
+def test_fetch_record_does_not_hedge_within_the_delay(mirrors):
+    primary, secondary = mirrors((0.05, 0), (0, 0))
+    result = namesdao._fetch_record('alice', hedge_delay=5)
+    assert result.mirror == primary.url
+    assert secondary.requests == 0
+
+
+def test_fetch_record_fails_over_and_opens_the_circuit(mirrors):
+    primary, secondary = mirrors((0, 1.0), (0, 0))
+    health = namesdao.get_mirror_health()
+    for _ in range(namesdao.CIRCUIT_FAILURE_THRESHOLD):
+        result = namesdao._fetch_record('alice', hedge_delay=5)
+        assert result.status is None
+        assert result.mirror == secondary.url
+    assert health.state(primary.url) == health.OPEN
+
+    # With the circuit open, the primary isn't asked at all.
+    asked = primary.requests
+    assert namesdao._fetch_record('bob', hedge_delay=5).mirror == secondary.url
+    assert primary.requests == asked
+
+
+def test_fetch_record_not_found(mirrors):
+    mirrors((0, 0), (0, 0))
+    result = namesdao._fetch_record('nobody', hedge_delay=5)
+    assert result.status == namesdao.RESOLVE_NOT_FOUND
+    assert not result.retryable
+
+
+def test_fetch_record_gives_up_after_retries(mirrors):
+    primary, secondary = mirrors((0, 1.0), (0, 1.0))
+    result = namesdao._fetch_record('alice', hedge_delay=5)
+    assert result.status == namesdao.RESOLVE_ERROR
+    # The json file of each mirror in each round; the signature requests fail too.
+    assert primary.requests + secondary.requests >= 2 * namesdao.RESOLVE_RETRIES
+
+
+def test_lookup_caches_not_found(mirrors):
+    primary, secondary = mirrors((0, 0), (0, 0))
+    assert namesdao.lookup('nobody').status == namesdao.RESOLVE_NOT_FOUND
+    asked = primary.requests + secondary.requests
+    result = namesdao.lookup('nobody')
+    assert result.status == namesdao.RESOLVE_NOT_FOUND
+    assert result.detail == namesdao.NOT_FOUND_DETAIL
+    assert primary.requests + secondary.requests == asked
+
+
+def test_fetch_record_verifies_signatures(mirrors, signing_key, monkeypatch):
+    pubkey, fingerprint, sign = signing_key
+    monkeypatch.setattr(namesdao, 'RECIPIENT_PUBKEY', pubkey)
+    monkeypatch.setattr(namesdao, 'RECIPIENT_FINGERPRINT', fingerprint)
+    fixtures = _make_fixtures(['alice', 'bob'], sign)
+    fixtures['bob.json.gpg'] = fixtures['alice.json.gpg']
+    fixtures['bob.json'] = fixtures['bob.json'].replace(b'}', b', "name": "bob"}')
+    mirrors((0, 0), fixtures=fixtures)
+
+    result = namesdao._fetch_record('alice', hedge_delay=5)
+    assert (result.status, result.verified) == (None, True)
+    assert result.signature == fixtures['alice.json.gpg']
+    assert namesdao._fetch_record('bob', hedge_delay=5).status == namesdao.RESOLVE_BAD_SIGNATURE
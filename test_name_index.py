@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import namesdao
+
+ALICE = namesdao.decode_puzzle_hash(namesdao.RECIPIENT_ADDRESS)
+BOB = bytes(range(32))
+
+
+def records(*names_and_puzzle_hashes):
+    return sorted((namesdao.NameIndex.name_key(name), puzzle_hash) for name, puzzle_hash in names_and_puzzle_hashes)
+
+
+def test_write_and_get(tmp_path):
+    path = str(tmp_path / 'names.index')
+    assert namesdao.NameIndex.write(path, records(('alice', ALICE), ('bob', BOB)), 1, namesdao.NameIndex.FLAG_VERIFIED) == 2
+    index = namesdao.NameIndex(path)
+    try:
+        assert (index.get('alice'), index.get('Bob.xch'), index.get('carol')) == (ALICE, BOB, None)
+        assert (len(index), index.generation, index.verified) == (2, 1, True)
+    finally:
+        index.close()
+
+
+def test_merge():
+    merged = namesdao.NameIndex.merge(
+        records(('alice', ALICE), ('bob', BOB)),
+        records(('alice', namesdao.NameIndex.DELETED), ('carol', ALICE)),
+    )
+    assert list(merged) == records(('bob', BOB), ('carol', ALICE))
+
+
+def test_write_removes_the_partial_file(tmp_path):
+    path = str(tmp_path / 'names.index')
+
+    def failing():
+        yield from records(('alice', ALICE))
+        raise OSError('connection reset')
+
+    with pytest.raises(OSError):
+        namesdao.NameIndex.write(path, failing(), 1)
+    with pytest.raises(ValueError):
+        namesdao.NameIndex.write(path, reversed(records(('alice', ALICE), ('bob', BOB))), 1)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    '''Run `name sync --from-file` with the given (name, address, status) resolve results; returns the new index.'''
+    def run(*results):
+        names = tmp_path / 'names.txt'
+        names.write_text(''.join(f'{name}\n' for name, _, _ in results))
+        monkeypatch.setattr(namesdao, 'resolve_many', lambda names, **kwargs: (
+            namesdao.ResolveResult(name, address, status, None) for name, address, status in results
+        ))
+        monkeypatch.setattr(namesdao.sys, 'argv', ['namesdao', 'name', 'sync', '--from-file', str(names)])
+        namesdao.cmd_sync()
+        return namesdao.get_name_index()
+
+    return run
+
+
+def test_sync_verified_flag_follows_the_merged_records(sync):
+    address = namesdao.RECIPIENT_ADDRESS
+    index = sync(('alice', address, namesdao.RESOLVE_VERIFIED), ('bob', address, namesdao.RESOLVE_UNSIGNED))
+    assert not index.verified
+    # bob is still in the index, unverified.
+    assert not sync(('alice', address, namesdao.RESOLVE_VERIFIED)).verified
+    # Every name was resolved again with a verified signature.
+    index = sync(('alice', address, namesdao.RESOLVE_VERIFIED), ('bob', address, namesdao.RESOLVE_VERIFIED))
+    assert index.verified
+    assert not sync(('bob', None, namesdao.RESOLVE_NOT_FOUND), ('carol', address, namesdao.RESOLVE_UNSIGNED)).verified
+    # carol is gone, but alice comes from an index that isn't verified as a whole.
+    index = sync(('carol', None, namesdao.RESOLVE_NOT_FOUND))
+    assert (index.verified, index.get('alice'), index.get('carol')) == (False, ALICE, None)
@@ -0,0 +1,183 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+import namesdao
+
+REGISTRAR = namesdao.decode_puzzle_hash(namesdao.NAMESDAO_REGISTRARS[0])
+ALICE = hashlib.sha256(b'alice owner').digest()
+BOB = hashlib.sha256(b'bob owner').digest()
+CAROL = hashlib.sha256(b'carol owner').digest()
+CHANGE = hashlib.sha256(b'change').digest()
+
+# The solution of a standard transaction (p2_delegated_puzzle_or_hidden_puzzle) spending a registrar coin:
+# (() (q . conditions) ()), with the conditions
+#   (CREATE_COIN alice_owner 1 ("Alice.xch"))
+#   (CREATE_COIN change 999999)
+#   (CREATE_COIN bob_owner 1 (<70 byte hint> "bob.xch"))
+#   (AGG_SIG_ME <48 byte public key> "registration")
+#   (RESERVE_FEE 1000)
+REGISTRATION_SOLUTION = (
+    '0xff80ffff01ffff33ffa01e1499d5a383e499b1ece6dcae18f69e53d3232712feae95707da267cab7d14dff01ffff89416c6963652e78'
+    '63688080ffff33ffa012ea12eace7d655f471ce55e34f89b1b77a3d9d05a445ca82877dd2235beaa51ff830f423f80ffff33ffa04ffdfe'
+    'fe3f9427a9184e0017f2c50fc4aaa8ff3d6afca16c1fd1f6e23acd86d0ff01ffffc04668686868686868686868686868686868686868'
+    '686868686868686868686868686868686868686868686868686868686868686868686868686868686868686868686868686868ff8762'
+    '6f622e7863688080ffff32ffb00101010101010101010101010101010101010101010101010101010101010101010101010101010101'
+    '01010101010101ff8c726567697374726174696f6e80ffff34ff8203e88080ff8080'
+)
+
+
+# The same registrations, with alice.xch going to carol's owner puzzle hash instead: an update of alice.xch
+UPDATE_SOLUTION = '0x' + bytes.fromhex(REGISTRATION_SOLUTION[2:]).replace(ALICE, CAROL).hex()
+
+
+def coin_spend(puzzle_hash, solution=REGISTRATION_SOLUTION):
+    return {'coin': {'puzzle_hash': '0x' + puzzle_hash.hex(), 'parent_coin_info': '0x' + bytes(32).hex(), 'amount': 1000001}, 'puzzle_reveal': '0x80', 'solution': solution}
+
+
+def test_clvm_deserialize():
+    solution = namesdao._clvm_list(namesdao.clvm_deserialize(bytes.fromhex(REGISTRATION_SOLUTION[2:])))
+    assert len(solution) == 3
+    assert solution[0] == solution[2] == b''
+    quote, conditions = solution[1]
+    assert quote == b'\x01'
+    conditions = [namesdao._clvm_list(condition) for condition in namesdao._clvm_list(conditions)]
+    assert [condition[0] for condition in conditions] == [b'\x33', b'\x33', b'\x33', b'\x32', b'\x34']
+    assert conditions[1] == [b'\x33', CHANGE, (999999).to_bytes(3, 'big')]
+    hint, memo = namesdao._clvm_list(conditions[2][3])
+    assert (hint, memo) == (b'h' * 70, b'bob.xch')
+    assert conditions[4] == [b'\x34', (1000).to_bytes(2, 'big')]
+
+
+@pytest.mark.parametrize('blob', [b'', b'\xff\x80', b'\x85abc', b'\xfc\x00'])
+def test_clvm_deserialize_invalid(blob):
+    with pytest.raises((ValueError, IndexError)):
+        namesdao.clvm_deserialize(blob)
+
+
+def test_extract_name_records():
+    records = list(namesdao.extract_name_records([coin_spend(REGISTRAR)], {REGISTRAR}))
+    assert records == [('alice', ALICE), ('bob', BOB)]
+
+
+def test_extract_name_records_skips_other_spends():
+    spends = [
+        coin_spend(CHANGE),
+        coin_spend(REGISTRAR, '0xff80ff80'),
+        coin_spend(REGISTRAR, '0xff80ffff01'),
+        coin_spend(REGISTRAR, '0x' + bytes.fromhex(REGISTRATION_SOLUTION[2:]).replace(b'\x89Alice.xch', b'\x89Alice.org').hex()),
+    ]
+    assert list(namesdao.extract_name_records(spends, {REGISTRAR})) == [('bob', BOB)]
+
+
+class StubFullNode:
+    '''In-memory stand-in for FullNodeRpcClient: a chain of blocks, each with some coin spends.'''
+
+    def __init__(self):
+        self.blocks = []
+        self.spends = {}
+
+    def add_block(self, spends=(), transaction_block=True):
+        height = len(self.blocks)
+        header_hash = '0x' + hashlib.sha256(f'{height}:{len(self.spends)}'.encode('ascii')).hexdigest()
+        self.blocks.append({'height': height, 'header_hash': header_hash, 'timestamp': 1 if transaction_block else None})
+        self.spends[header_hash] = list(spends)
+
+    def get_peak_height(self):
+        return len(self.blocks) - 1 if self.blocks else None
+
+    def get_block_record_by_height(self, height):
+        return self.blocks[height]
+
+    def get_block_spends(self, header_hash):
+        return self.spends[header_hash]
+
+
+def test_indexer_sync_and_resume(tmp_path):
+    node = StubFullNode()
+    for height in range(10):
+        node.add_block([coin_spend(REGISTRAR)] if height == 3 else [], transaction_block=height % 2 == 1)
+    index = namesdao.OnchainIndex(str(tmp_path / 'onchain.sqlite3'))
+    indexer = namesdao.OnchainIndexer(node, index, confirmations=2, commit_every=4)
+
+    with pytest.raises(ValueError, match='start height'):
+        indexer.sync()
+    blocks, records, _ = indexer.sync(0)
+    assert (blocks, records) == (8, 2)
+    assert index.checkpoint() == (7, node.blocks[7]['header_hash'])
+    assert index.get('alice.xch') == (ALICE, 3)
+    assert index.lookup('bob') == namesdao.ResolveResult('bob', namesdao.encode_puzzle_hash(BOB), namesdao.RESOLVE_ONCHAIN, None)
+    assert index.lookup('carol').status == namesdao.RESOLVE_NOT_FOUND
+
+    # Nothing new until more blocks arrive.
+    assert indexer.sync()[:2] == (0, 0)
+    node.add_block()
+    assert indexer.sync()[:2] == (1, 0)
+    assert index.checkpoint()[0] == 8
+
+
+def test_indexer_reindexes_after_a_reorg(tmp_path):
+    node = StubFullNode()
+    for height in range(10):
+        node.add_block([coin_spend(REGISTRAR)] if height == 5 else [])
+    index = namesdao.OnchainIndex(str(tmp_path / 'onchain.sqlite3'))
+    indexer = namesdao.OnchainIndexer(node, index, confirmations=0)
+    indexer.sync(0)
+    assert index.get('alice') == (ALICE, 5)
+
+    # The chain is reorged from height 4 on, and the registration is gone.
+    del node.blocks[4:]
+    for _ in range(6):
+        node.add_block()
+    blocks, records, _ = indexer.sync()
+    assert records == 0
+    assert index.get('alice') is None
+    assert index.checkpoint() == (9, node.blocks[9]['header_hash'])
+
+
+def test_indexer_restores_the_owner_before_a_reorged_update(tmp_path):
+    node = StubFullNode()
+    for height in range(40):
+        spends = {2: [coin_spend(REGISTRAR)], 38: [coin_spend(REGISTRAR, UPDATE_SOLUTION)]}.get(height, [])
+        node.add_block(spends)
+    index = namesdao.OnchainIndex(str(tmp_path / 'onchain.sqlite3'))
+    indexer = namesdao.OnchainIndexer(node, index, confirmations=0)
+    indexer.sync(0)
+    assert index.get('alice') == (CAROL, 38)
+    assert sorted(index.items()) == [('alice', CAROL), ('bob', BOB)]
+    assert len(index) == 2
+
+    # The chain is reorged from height 36 on, taking the update with it; the registration at height 2 isn't re-indexed.
+    del node.blocks[36:]
+    for _ in range(5):
+        node.add_block()
+    blocks, records, _ = indexer.sync()
+    # From the height ONCHAIN_REORG_DEPTH below the old checkpoint, 39, to the new peak.
+    assert (blocks, records) == (40 - (39 - namesdao.ONCHAIN_REORG_DEPTH), 0)
+    assert index.get('alice') == (ALICE, 2)
+    assert sorted(index.items()) == [('alice', ALICE), ('bob', BOB)]
+    assert index.checkpoint() == (40, node.blocks[40]['header_hash'])
+
+
+def test_onchain_index_migrates_the_single_record_table(tmp_path):
+    path = str(tmp_path / 'onchain.sqlite3')
+    db = sqlite3.connect(path)
+    with db:
+        # The tables as the first release created them, with only the latest record of each name.
+        db.execute('CREATE TABLE names (name TEXT PRIMARY KEY, puzzle_hash BLOB NOT NULL, height INTEGER NOT NULL)')
+        db.execute('CREATE INDEX names_height ON names (height)')
+        db.execute('CREATE TABLE checkpoint (id INTEGER PRIMARY KEY CHECK (id = 0), height INTEGER NOT NULL, header_hash TEXT NOT NULL)')
+        db.execute("INSERT INTO names VALUES ('alice', ?, 3)", (ALICE,))
+        db.execute("INSERT INTO checkpoint VALUES (0, 7, '0x07')")
+    db.close()
+
+    index = namesdao.OnchainIndex(path)
+    assert index.get('alice') == (ALICE, 3)
+    index.apply([('alice', CAROL, 8)], 8, '0x08')
+    assert index.get('alice') == (CAROL, 8)
+    index.rollback(7, '0x07')
+    assert index.get('alice') == (ALICE, 3)
+
+    # Opening the migrated index again leaves it alone.
+    assert namesdao.OnchainIndex(path).get('alice') == (ALICE, 3)
@@ -0,0 +1,98 @@
+import pytest
+
+import namesdao
+
+MESSAGE = b'{"address": "%s"}' % namesdao.RECIPIENT_ADDRESS.encode('ascii')
+
+
+@pytest.fixture(scope='module')
+def verifier(signing_key):
+    pubkey, fingerprint, _ = signing_key
+    return namesdao.SignatureVerifier(pubkey, fingerprint)
+
+
+def test_parses_the_namesdao_key():
+    verifier = namesdao.SignatureVerifier()
+    assert verifier.key_id.hex().upper() == namesdao.RECIPIENT_FINGERPRINT[-16:]
+    assert verifier.n.bit_length() == 4096
+
+
+def test_accepts_a_good_signature(verifier, signing_key):
+    _, _, sign = signing_key
+    assert verifier.verify(MESSAGE, sign(MESSAGE)) is True
+    assert verifier.verify(MESSAGE, sign(MESSAGE, '--armor')) is True
+    assert verifier.verify(MESSAGE, sign(MESSAGE, '--digest-algo', 'SHA512')) is True
+
+
+def test_accepts_a_text_signature(verifier, signing_key):
+    _, _, sign = signing_key
+    signature = sign(b'line one\nline two\n', '--textmode')
+    assert verifier.verify(b'line one\nline two\n', signature) is True
+    assert verifier.verify(b'line one\r\nline two\r\n', signature) is True
+
+
+def test_rejects_a_modified_message(verifier, signing_key):
+    _, _, sign = signing_key
+    assert verifier.verify(MESSAGE.replace(b'xch1', b'xch2'), sign(MESSAGE)) is False
+
+
+def test_rejects_a_corrupted_signature(verifier, signing_key):
+    _, _, sign = signing_key
+    signature = bytearray(sign(MESSAGE))
+    signature[-1] ^= 1
+    assert verifier.verify(MESSAGE, bytes(signature)) is False
+
+
+def test_rejects_another_keys_signature(verifier, make_signing_key):
+    _, _, other_sign = make_signing_key()
+    assert verifier.verify(MESSAGE, other_sign(MESSAGE)) is False
+
+
+def test_unsupported_signature_algorithm(verifier, signing_key):
+    _, _, sign = signing_key
+    with pytest.raises(namesdao.UnsupportedSignature):
+        verifier.verify(MESSAGE, sign(MESSAGE, '--digest-algo', 'SHA1'))
+
+
+def test_unsupported_key_algorithm(make_signing_key):
+    pubkey, fingerprint, _ = make_signing_key('ed25519')
+    with pytest.raises(namesdao.UnsupportedSignature):
+        namesdao.SignatureVerifier(pubkey, fingerprint)
+
+
+def test_unsupported_expiring_key(make_signing_key):
+    pubkey, fingerprint, _ = make_signing_key(expire='1y')
+    with pytest.raises(namesdao.UnsupportedSignature):
+        namesdao.SignatureVerifier(pubkey, fingerprint)
+
+
+def test_unsupported_garbage(verifier):
+    for signature in (b'', b'not a signature', b'-----BEGIN PGP SIGNATURE-----\n\n!!!\n-----END PGP SIGNATURE-----\n'):
+        with pytest.raises(namesdao.UnsupportedSignature):
+            verifier.verify(MESSAGE, signature)
+
+
+def test_wrong_fingerprint(signing_key):
+    pubkey, _, _ = signing_key
+    with pytest.raises(namesdao.UnsupportedSignature):
+        namesdao.SignatureVerifier(pubkey, namesdao.RECIPIENT_FINGERPRINT)
+
+
+def test_verify_falls_back_to_gpg_for_unsupported_signatures(signing_key, monkeypatch):
+    pubkey, fingerprint, sign = signing_key
+    monkeypatch.setattr(namesdao, 'RECIPIENT_PUBKEY', pubkey)
+    monkeypatch.setattr(namesdao, 'RECIPIENT_FINGERPRINT', fingerprint)
+    checked = []
+
+    class Session:
+        def verify(self, message, signature):
+            checked.append(signature)
+            return True
+
+    monkeypatch.setattr(namesdao, 'get_crypto_session', Session)
+    good = sign(MESSAGE)
+    assert namesdao.verify(MESSAGE, good) is True
+    assert checked == []
+    sha1 = sign(MESSAGE, '--digest-algo', 'SHA1')
+    assert namesdao.verify(MESSAGE, sha1) is True
+    assert checked == [sha1]
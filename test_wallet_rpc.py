@@ -0,0 +1,198 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import namesdao
+
+
+class StubWallet:
+    '''A plain HTTP stand-in for the wallet RPC that records the endpoints it's called on.
+
+    answers maps an endpoint to its json response (a success with an empty
+    transaction id by default). delays maps an endpoint to seconds to wait
+    before answering its first call. With close_connections, every connection
+    is closed after one answer, without telling the client, as a wallet that
+    dropped an idle keep-alive connection would. hang_up is a set of endpoints
+    whose connection is closed without an answer.
+    '''
+
+    def __init__(self, answers=None, delays=None, close_connections=False, hang_up=()):
+        self.answers = answers or {}
+        self.delays = dict(delays or {})
+        self.calls = []
+        self.connections = 0
+        lock = threading.Lock()
+        wallet = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with lock:
+                    wallet.connections += 1
+
+            def do_POST(self):
+                endpoint = self.path.lstrip('/')
+                params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with lock:
+                    wallet.calls.append((endpoint, params))
+                    delay = wallet.delays.pop(endpoint, 0)
+                if endpoint in wallet.hang_up:
+                    self.close_connection = True
+                    return
+                time.sleep(delay)
+                body = json.dumps(wallet.answers.get(endpoint, {'success': True, 'transaction_id': '0x00'})).encode('utf-8')
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass
+                self.close_connection = close_connections
+
+            def log_message(self, format, *args):
+                pass
+
+        self.hang_up = set(hang_up)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def endpoints(self):
+        return [endpoint for endpoint, _ in self.calls]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_client(port, timeout=5):
+    '''A WalletRpcClient over plain HTTP; the real one needs the wallet's TLS certificates.'''
+    client = namesdao.WalletRpcClient.__new__(namesdao.WalletRpcClient)
+    client.host, client.port = '127.0.0.1', port
+    client._conn = http.client.HTTPConnection(client.host, port, timeout=timeout)
+    client._lock = threading.Lock()
+    return client
+
+
+@pytest.fixture
+def wallet():
+    started = []
+
+    def start(**kwargs):
+        started.append(StubWallet(**kwargs))
+        return started[-1]
+
+    yield start
+    for stub in started:
+        stub.close()
+
+
+def test_call(wallet):
+    stub = wallet(answers={'get_wallets': {'success': True, 'wallets': [{'id': 1}]}})
+    client = make_client(stub.port)
+    assert client.get_wallets(wallet_type=namesdao.WALLET_TYPE_CAT) == [{'id': 1}]
+    assert stub.calls == [('get_wallets', {'type': namesdao.WALLET_TYPE_CAT})]
+
+
+def test_call_keeps_the_connection_open(wallet):
+    stub = wallet(answers={'get_wallets': {'success': True, 'wallets': []}})
+    client = make_client(stub.port)
+    for _ in range(3):
+        client.get_wallets()
+    assert stub.connections == 1
+
+
+def test_call_error(wallet):
+    stub = wallet(answers={'get_wallets': {'success': False, 'error': 'not logged in'}, 'log_in': ['not', 'an', 'object']})
+    client = make_client(stub.port)
+    with pytest.raises(namesdao.WalletRpcError, match='not logged in'):
+        client.get_wallets()
+    with pytest.raises(namesdao.WalletRpcError, match='Invalid response from log_in'):
+        client.log_in(1)
+
+
+def test_call_unreachable():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    client = make_client(port)
+    with pytest.raises(namesdao.WalletRpcError) as excinfo:
+        client.send_transaction(namesdao.RECIPIENT_ADDRESS, 1, 0)
+    # Nothing was sent, so it's certain nothing was paid.
+    assert not isinstance(excinfo.value, namesdao.WalletRpcUncertain)
+
+
+def test_call_retries_on_a_stale_keep_alive_connection(wallet):
+    stub = wallet(answers={'get_wallets': {'success': True, 'wallets': []}}, close_connections=True)
+    client = make_client(stub.port)
+    for _ in range(5):
+        assert client.get_wallets() == []
+    assert stub.endpoints() == ['get_wallets'] * 5
+    assert stub.connections == 5
+
+
+def test_send_after_a_stale_keep_alive_connection(wallet):
+    stub = wallet(close_connections=True)
+    client = make_client(stub.port)
+    client.get_logged_in_fingerprint()
+    assert client.send_transaction(namesdao.RECIPIENT_ADDRESS, 1, 0) == '0x00'
+    assert stub.endpoints() == ['get_logged_in_fingerprint', 'send_transaction']
+
+
+def test_send_is_never_sent_twice_on_timeout(wallet):
+    stub = wallet(delays={'send_transaction': 1.0})
+    client = make_client(stub.port, timeout=0.3)
+    client.get_logged_in_fingerprint()
+    with pytest.raises(namesdao.WalletRpcUncertain):
+        client.send_transaction(namesdao.RECIPIENT_ADDRESS, 1, 0)
+    time.sleep(1.0)
+    assert stub.endpoints() == ['get_logged_in_fingerprint', 'send_transaction']
+
+
+@pytest.mark.parametrize('endpoint, send', [
+    ('send_transaction', lambda client: client.send_transaction(namesdao.RECIPIENT_ADDRESS, 1, 0)),
+    ('send_transaction_multi', lambda client: client.send_transaction_multi([{'puzzle_hash': '0x00', 'amount': 1}], 0)),
+    ('cat_spend', lambda client: client.cat_spend(2, namesdao.RECIPIENT_ADDRESS, 1, 0)),
+])
+def test_send_is_never_sent_twice_when_the_wallet_hangs_up(wallet, endpoint, send):
+    stub = wallet(hang_up={endpoint})
+    client = make_client(stub.port)
+    client.get_logged_in_fingerprint()
+    with pytest.raises(namesdao.WalletRpcUncertain):
+        send(client)
+    assert stub.endpoints() == ['get_logged_in_fingerprint', endpoint]
+
+
+def test_idempotent_call_is_not_retried_on_timeout(wallet):
+    stub = wallet(delays={'get_wallets': 1.0})
+    client = make_client(stub.port, timeout=0.3)
+    with pytest.raises(namesdao.WalletRpcError) as excinfo:
+        client.get_wallets()
+    assert not isinstance(excinfo.value, namesdao.WalletRpcUncertain)
+    time.sleep(1.0)
+    assert stub.endpoints() == ['get_wallets']
+
+
+def test_backend_send_reports_an_uncertain_send(wallet):
+    stub = wallet(hang_up={'send_transaction'}, answers={'get_logged_in_fingerprint': {'success': True, 'fingerprint': 1}})
+    backend = namesdao.RpcWalletBackend(make_client(stub.port))
+    with pytest.raises(namesdao.WalletRpcUncertain, match='check it before trying again'):
+        backend.send(namesdao.RECIPIENT_ADDRESS, '0.000000000001', '0.000000000001', '')
+    assert stub.endpoints().count('send_transaction') == 1
+
+
+def test_backend_send_raises_the_wallet_error(wallet, capsys):
+    stub = wallet(answers={'send_transaction': {'success': False, 'error': 'Can\'t send more than 0 mojos'}})
+    backend = namesdao.RpcWalletBackend(make_client(stub.port))
+    with pytest.raises(namesdao.SendError, match='Can\'t send more than 0 mojos'):
+        backend.send(namesdao.RECIPIENT_ADDRESS, '0.000000000001', '0.000000000001', '')
+    assert capsys.readouterr().out == ''